@@ -0,0 +1,320 @@
+# benchmark_pipeline.py
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from iou_calculator import batch_iou, boxes_to_array
+from main_llm import build_query_refiner, process_video
+from detector_backends import add_detector_arguments, build_detector
+from redetect_scheduler import add_redetect_arguments, scheduler_factory_from_args
+from stub_api_server import start_stub_server
+from synthetic_video import SYNTHETIC_OBJECTS, write_synthetic_tasks
+from task_store import open_task_store
+from tracker import add_tracker_arguments, tracker_factory_from_args
+from utils import VideoReader, save_results_to_json
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ('decode', 'refine', 'initial_detection', 'tracker_init', 'motion_gate', 'tracking', 'redetection', 'json_write')
+
+
+class StageTimer:
+    """
+    按阶段名累计每次调用的耗时 (秒)。
+    """
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def add(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def summary(self):
+        report = {}
+        for stage, values in self.samples.items():
+            values_ms = np.asarray(values) * 1000.0
+            report[stage] = {
+                "calls": len(values),
+                "total_s": float(values_ms.sum() / 1000.0),
+                "mean_ms": float(values_ms.mean()) if len(values) else 0.0,
+                "p50_ms": float(np.percentile(values_ms, 50)) if len(values) else 0.0,
+                "p95_ms": float(np.percentile(values_ms, 95)) if len(values) else 0.0,
+            }
+        return report
+
+
+class _TimedRefiner:
+    def __init__(self, refiner, timer):
+        self._refiner = refiner
+        self._timer = timer
+
+    def refine_query(self, frame, complex_query):
+        start = time.perf_counter()
+        try:
+            return self._refiner.refine_query(frame, complex_query)
+        finally:
+            self._timer.add('refine', time.perf_counter() - start)
+
+
+class _TimedDetector:
+    """
+    每个视频的第一次检测计入 initial_detection，之后的计入 redetection。
+    """
+    def __init__(self, detector, timer):
+        self._detector = detector
+        self._timer = timer
+        self._first = True
+
+    def _timed(self, method, *args, **kwargs):
+        stage = 'initial_detection' if self._first else 'redetection'
+        self._first = False
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._timer.add(stage, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        # 检测方法计时；其余属性 (例如检测缓存的 begin_video) 直接转发
+        attr = getattr(self._detector, name)
+        if name in ('detect_object', 'detect_prompts', 'redetect'):
+            return functools.partial(self._timed, attr)
+        return attr
+
+    @property
+    def frame_idx(self):
+        return self._detector.frame_idx
+
+    @frame_idx.setter
+    def frame_idx(self, value):
+        self._detector.frame_idx = value
+
+
+class _TimedTracker:
+    """
+    记录初始化/更新耗时，并用相邻两次 update 调用的间隔作为逐帧端到端延迟
+    (包括等待解码、跟踪、重检和记录结果)。
+    """
+    def __init__(self, tracker, timer, frame_latencies):
+        self._tracker = tracker
+        self._timer = timer
+        self._frame_latencies = frame_latencies
+        self._last_update = None
+
+    def initialize(self, frame, bbox):
+        start = time.perf_counter()
+        self._tracker.initialize(frame, bbox)
+        self._timer.add('tracker_init', time.perf_counter() - start)
+
+    def update(self, frame):
+        start = time.perf_counter()
+        if self._last_update is not None:
+            self._frame_latencies.append(start - self._last_update)
+        self._last_update = start
+        result = self._tracker.update(frame)
+        self._timer.add('tracking', time.perf_counter() - start)
+        return result
+
+    def needs_update(self, frame):
+        start = time.perf_counter()
+        result = self._tracker.needs_update(frame)
+        self._timer.add('motion_gate', time.perf_counter() - start)
+        return result
+
+
+class ColorDetector:
+    """
+    合成视频专用的检测器：按颜色找出目标矩形，可附加固定的模拟延迟。
+    用于在没有模型权重或 GPU 的机器上测量除模型推理以外的流水线开销。
+    """
+    def __init__(self, color_bgr=SYNTHETIC_OBJECTS[0][1], tolerance=30, latency=0.0):
+        color = np.array(color_bgr, dtype=np.int16)
+        self.lower = np.clip(color - tolerance, 0, 255).astype(np.uint8)
+        self.upper = np.clip(color + tolerance, 0, 255).astype(np.uint8)
+        self.latency = latency
+
+    def detect_object(self, frame, text_prompt, color_space="BGR"):
+        if self.latency:
+            time.sleep(self.latency)
+        if color_space != "BGR":
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        mask = cv2.inRange(frame, self.lower, self.upper)
+        points = cv2.findNonZero(mask)
+        if points is None:
+            return None
+        x, y, w, h = cv2.boundingRect(points)
+        return (x + w // 2, y + h // 2, w, h)
+
+    def redetect(self, frame, text_prompt, bbox_hint, color_space="BGR", **kwargs):
+        return self.detect_object(frame, text_prompt, color_space)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def _percentile_ms(values, q):
+    return float(np.percentile(np.asarray(values) * 1000.0, q)) if values else 0.0
+
+
+def build_segments(args):
+    """
+    决定合成任务的 (video_key, 帧数)：默认沿用任务文件中每个任务的片段长度，--num_frames 可统一覆盖。
+    """
+    if args.tasks_json and os.path.exists(args.tasks_json):
+        store = open_task_store(args.tasks_json)
+        keys = sorted(store.keys(), key=int)[:args.num_videos]
+        segments = []
+        for key in keys:
+            temp_gt = store.metadata(key)['temp_gt']
+            segments.append((key, args.num_frames or temp_gt['end_fid'] - temp_gt['begin_fid'] + 1))
+        return segments
+    return [(str(i), args.num_frames or 120) for i in range(1, args.num_videos + 1)]
+
+
+def benchmark_pipeline(args):
+    """
+    在本地生成的合成视频上运行完整流水线 (API 精炼走本地桩服务)，统计各阶段耗时、吞吐量与内存峰值。
+    """
+    videos_dir = os.path.join(args.work_dir, 'videos')
+    tasks_json = os.path.join(args.work_dir, 'tasks.json')
+    results_dir = os.path.join(args.work_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+
+    segments = build_segments(args)
+    print(f"正在生成 {len(segments)} 段 {args.width}x{args.height} 的合成视频...")
+    write_synthetic_tasks(videos_dir, tasks_json, segments, args.width, args.height, args.fps)
+    store = open_task_store(tasks_json)
+
+    server, base_url = start_stub_server(phrase=SYNTHETIC_OBJECTS[0][0], latency=args.api_latency)
+    refiner = build_query_refiner('stub.stub', cache_dir=None, base_url=base_url)
+    if args.detector == 'dino':
+        detector = build_detector(args)
+    else:
+        detector = ColorDetector(latency=args.detector_latency)
+    tracker_factory = tracker_factory_from_args(args)
+    scheduler_factory = scheduler_factory_from_args(args)
+
+    timer = StageTimer()
+    frame_latencies = []
+    per_video = {}
+    total_frames = 0
+    total_seconds = 0.0
+    try:
+        for video_key, _ in segments:
+            meta = store.metadata(video_key)
+            video_path = os.path.join(videos_dir, meta['vid'])
+            begin_fid, end_fid = meta['temp_gt']['begin_fid'], meta['temp_gt']['end_fid']
+
+            # 单独测一遍解码，排除其他阶段的干扰
+            with VideoReader(video_path) as video:
+                video.seek(begin_fid)
+                for frame_idx in range(begin_fid, end_fid + 1):
+                    start = time.perf_counter()
+                    if video.read_frame(frame_idx) is None:
+                        break
+                    timer.add('decode', time.perf_counter() - start)
+
+            result_path = os.path.join(results_dir, f"video_{video_key}.json")
+            start = time.perf_counter()
+            ok = process_video(video_path, tasks_json, result_path,
+                               _TimedRefiner(refiner, timer), _TimedDetector(detector, timer),
+                               lambda: _TimedTracker(tracker_factory(), timer, frame_latencies),
+                               scheduler_factory=scheduler_factory)
+            seconds = time.perf_counter() - start
+            if not ok:
+                print(f"错误: 视频 {video_key} 处理失败。")
+                continue
+
+            with open(result_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            start = time.perf_counter()
+            save_results_to_json(result, result_path)
+            timer.add('json_write', time.perf_counter() - start)
+
+            pred_bboxs = result[video_key]['pred_bboxs']
+            pred, mask = boxes_to_array([pred_bboxs.get(str(fid), {}) for fid in range(begin_fid, end_fid + 1)])
+            num_frames = len(pred_bboxs)
+            total_frames += num_frames
+            total_seconds += seconds
+            per_video[video_key] = {
+                "frames": num_frames,
+                "seconds": seconds,
+                "fps": num_frames / seconds if seconds > 0 else 0.0,
+                "mean_iou": float(batch_iou(pred, store.gt_boxes(video_key), mask).mean()),
+            }
+    finally:
+        server.shutdown()
+
+    report = {
+        "config": {
+            "width": args.width, "height": args.height, "fps": args.fps,
+            "detector": args.detector, "tracker_type": args.tracker_type,
+            "track_scale_mode": args.track_scale_mode, "track_max_skip": args.track_max_skip,
+            "redetect_mode": args.redetect_mode,
+            "local_redetect": args.local_redetect, "api_latency": args.api_latency,
+        },
+        "videos": len(per_video),
+        "frames": total_frames,
+        "seconds": total_seconds,
+        "fps": total_frames / total_seconds if total_seconds > 0 else 0.0,
+        "frame_latency_p50_ms": _percentile_ms(frame_latencies, 50),
+        "frame_latency_p95_ms": _percentile_ms(frame_latencies, 95),
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": timer.summary(),
+        "per_video": per_video,
+    }
+
+    print(f"\n共 {total_frames} 帧，{total_seconds:.2f}s，{report['fps']:.1f} 帧/秒；"
+          f"逐帧延迟 p50 {report['frame_latency_p50_ms']:.2f}ms / p95 {report['frame_latency_p95_ms']:.2f}ms；"
+          f"内存峰值 {report['peak_rss_mb'] or 0:.0f}MB")
+    print(f"{'阶段':<20}{'次数':>8}{'总耗时(s)':>12}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for stage, s in report['stages'].items():
+        print(f"{stage:<20}{s['calls']:>8}{s['total_s']:>12.3f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}")
+
+    if args.output:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"基准测试结果已保存至 {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在合成视频上对整条流水线做端到端基准测试 (不需要 sample_videos 目录与真实API)。")
+    parser.add_argument('--tasks_json', type=str, default='sample_video.json', help='沿用其中各任务的片段长度；文件不存在时使用 --num_frames。')
+    parser.add_argument('--num_videos', type=int, default=5, help='合成视频的数量 (最多取任务文件中的前 N 个任务)。')
+    parser.add_argument('--num_frames', type=int, default=None, help='统一指定每段任务的帧数，覆盖任务文件中的长度。')
+    parser.add_argument('--width', type=int, default=640, help='合成视频宽度。')
+    parser.add_argument('--height', type=int, default=480, help='合成视频高度。')
+    parser.add_argument('--fps', type=float, default=30.0, help='合成视频帧率。')
+    parser.add_argument('--detector', type=str, default='color', choices=['color', 'dino'],
+                        help='color: 按颜色定位目标的轻量检测器 (不加载模型); dino: Grounding DINO。')
+    parser.add_argument('--detector_latency', type=float, default=0.0, help='color 检测器每次调用附加的模拟延迟 (秒)。')
+    parser.add_argument('--api_latency', type=float, default=0.0, help='API 桩服务每个请求的模拟延迟 (秒)。')
+    parser.add_argument('--work_dir', type=str, default='output/benchmark_pipeline', help='合成视频、任务文件与结果的存放目录。')
+    parser.add_argument('--output', type=str, default='output/pipeline_benchmark.json', help='基准测试结果JSON文件路径。')
+    add_detector_arguments(parser)
+    add_tracker_arguments(parser)
+    add_redetect_arguments(parser)
+
+    args = parser.parse_args()
+
+    benchmark_pipeline(args)
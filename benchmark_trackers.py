@@ -0,0 +1,125 @@
+# benchmark_trackers.py
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from iou_calculator import batch_iou
+from task_store import open_task_store
+from tracker import Tracker, TRACKER_BACKENDS, SCALE_MODES, available_backends
+from utils import VideoReader
+
+
+def load_task_frames(video_path, begin_fid, end_fid):
+    """
+    一次性读出任务区间内的所有帧 (BGR)，让各个后端在完全相同的内存数据上比较，排除解码耗时。
+    """
+    with VideoReader(video_path) as video:
+        return [frame for frame in video.iter_frames(begin_fid, end_fid)]
+
+
+def run_backend(tracker_type, frames, gt_boxes, model_dir, scale_mode='none', target_size=96):
+    """
+    用真值的第一个框初始化跟踪器，在其余帧上逐帧跟踪。
+
+    Returns:
+        tuple: (跟踪耗时秒数, 逐帧 IoU 数组)。跟踪失败的帧 IoU 记为 0。
+    """
+    x1, y1, x2, y2 = (int(v) for v in gt_boxes[0])
+    w, h = x2 - x1, y2 - y1
+    tracker = Tracker(tracker_type=tracker_type, model_dir=model_dir, scale_mode=scale_mode, target_size=target_size)
+    tracker.initialize(frames[0], (x1 + w // 2, y1 + h // 2, w, h))
+
+    num_frames = min(len(frames), len(gt_boxes))
+    pred = np.zeros((num_frames - 1, 4), dtype=np.float64)
+    mask = np.zeros(num_frames - 1, dtype=bool)
+    elapsed = 0.0
+    for i in range(1, num_frames):
+        start = time.perf_counter()
+        success, bbox = tracker.update(frames[i])
+        elapsed += time.perf_counter() - start
+        if success:
+            cx, cy, w, h = bbox
+            pred[i - 1] = (cx - w // 2, cy - h // 2, cx + w // 2, cy + h // 2)
+            mask[i - 1] = True
+    return elapsed, batch_iou(pred, gt_boxes[1:num_frames], mask)
+
+
+def benchmark_trackers(args):
+    """
+    在样例任务上对比各个跟踪器后端的速度 (帧/秒) 与平均 IoU。
+    """
+    backends = args.backends or available_backends()
+    store = open_task_store(args.main_json_path)
+
+    totals = {name: {"frames": 0, "seconds": 0.0, "iou_sum": 0.0, "errors": 0} for name in backends}
+    keys = sorted(store.keys(), key=int)[:args.limit] if args.limit else sorted(store.keys(), key=int)
+    for video_key in tqdm(keys, desc="基准测试进度"):
+        meta = store.metadata(video_key)
+        video_path = os.path.join(args.videos_dir, meta.get('vid', f"video_{video_key}.mp4"))
+        if not os.path.exists(video_path):
+            print(f"跳过: 视频文件不存在 -> {video_path}")
+            continue
+        begin_fid, end_fid = meta['temp_gt']['begin_fid'], meta['temp_gt']['end_fid']
+        gt_boxes = store.gt_boxes(video_key)
+        frames = load_task_frames(video_path, begin_fid, end_fid)
+        if len(frames) < 2 or len(gt_boxes) < 2:
+            continue
+
+        for name in backends:
+            try:
+                seconds, ious = run_backend(name, frames, gt_boxes, args.tracker_model_dir,
+                                              args.track_scale_mode, args.track_target_size)
+            except Exception as e:
+                print(f"错误: 后端 {name} 在视频 {video_key} 上运行失败: {e}")
+                totals[name]["errors"] += 1
+                continue
+            totals[name]["frames"] += len(ious)
+            totals[name]["seconds"] += seconds
+            totals[name]["iou_sum"] += float(ious.sum())
+
+    report = {}
+    for name, t in totals.items():
+        report[name] = {
+            "speed_tier": TRACKER_BACKENDS[name][0],
+            "frames": t["frames"],
+            "fps": t["frames"] / t["seconds"] if t["seconds"] > 0 else 0.0,
+            "mean_iou": t["iou_sum"] / t["frames"] if t["frames"] else 0.0,
+            "errors": t["errors"],
+        }
+
+    print(f"\n{'后端':<8}{'档位':<10}{'帧数':>8}{'帧/秒':>12}{'平均IoU':>10}")
+    for name, r in sorted(report.items(), key=lambda item: -item[1]["fps"]):
+        print(f"{name:<8}{r['speed_tier']:<10}{r['frames']:>8}{r['fps']:>12.1f}{r['mean_iou']:>10.4f}")
+
+    if args.output:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"基准测试结果已保存至 {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在样例任务上对比各个跟踪器后端的速度与精度 (用真值首框初始化，不调用检测器)。")
+    parser.add_argument('--videos_dir', type=str, default='sample_videos', help='存放所有输入视频的目录。')
+    parser.add_argument('--main_json_path', type=str, default='sample_video.json', help='包含所有任务描述和真值的主JSON文件。')
+    parser.add_argument('--backends', type=str, nargs='+', default=None, choices=list(TRACKER_BACKENDS), help='要测试的后端，默认测试当前 OpenCV 构建中可用的全部后端。')
+    parser.add_argument('--tracker_model_dir', type=str, default='models', help='Nano/Vit 等 DNN 跟踪器的 ONNX 模型目录。')
+    parser.add_argument('--track_scale_mode', type=str, default='none', choices=SCALE_MODES, help='跟踪输入: none 原始整帧; downscale 缩小后的整帧; roi 目标周围缩小后的窗口。')
+    parser.add_argument('--track_target_size', type=int, default=96, help='downscale/roi 模式下缩放后目标长边的像素数。')
+    parser.add_argument('--limit', type=int, default=None, help='只测试前 N 个任务。')
+    parser.add_argument('--output', type=str, default='output/tracker_benchmark.json', help='基准测试结果JSON文件路径。')
+
+    args = parser.parse_args()
+
+    benchmark_trackers(args)
@@ -0,0 +1,143 @@
+# check_detector_parity.py
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from iou_calculator import calculate_iou
+from run_manifest import DETECTOR_CONFIG
+from task_store import open_task_store
+from utils import VideoReader
+
+
+def _corners(bbox):
+    """
+    detect_object 返回的 (cx, cy, w, h) -> calculate_iou 需要的角点字典。
+    """
+    cx, cy, w, h = bbox
+    return {"xmin": cx - w / 2, "ymin": cy - h / 2, "xmax": cx + w / 2, "ymax": cy + h / 2}
+
+
+def sample_frames(main_json_path, videos_dir, num_videos, frames_per_video):
+    """
+    从任务库中取前 num_videos 个视频，在每个真值区间内均匀抽取若干帧，与目标类别一起作为检测样本。
+
+    Returns:
+        list: [(video_key, frame_idx, frame, text_prompt)]
+    """
+    store = open_task_store(main_json_path)
+    samples = []
+    for video_key in sorted(store.keys(), key=lambda k: int(re.sub(r'\D', '', k) or 0))[:num_videos]:
+        task_info = store.metadata(video_key)
+        temp_gt = task_info.get('temp_gt', {})
+        video_path = os.path.join(videos_dir, task_info.get('vid', f"video_{video_key}.mp4"))
+        if 'begin_fid' not in temp_gt or not os.path.exists(video_path):
+            print(f"警告: 跳过视频 {video_key} (缺少视频文件或真值区间)。")
+            continue
+        prompt = task_info.get('target_category') or task_info.get('sentence', {}).get('description', '')
+        frame_ids = np.linspace(temp_gt['begin_fid'], temp_gt.get('end_fid', temp_gt['begin_fid']),
+                                frames_per_video).astype(int)
+        with VideoReader(video_path) as video:
+            for frame_idx in sorted(set(frame_ids.tolist())):
+                frame = video.read_frame(frame_idx)
+                if frame is not None:
+                    samples.append((video_key, frame_idx, frame, f"{prompt}."))
+    return samples
+
+
+def run_detector(detector, samples):
+    """
+    依次检测所有样本，返回 (检测框列表, 每帧耗时列表)。第一帧作为预热不计入耗时。
+    """
+    boxes, latencies = [], []
+    for i, (_, _, frame, prompt) in enumerate(samples):
+        start = time.perf_counter()
+        boxes.append(detector.detect_object(frame, prompt))
+        if i > 0:
+            latencies.append(time.perf_counter() - start)
+    return boxes, latencies
+
+
+def check_parity(args):
+    """
+    在同一批真实帧上运行 PyTorch 与 ONNX Runtime 后端，比较最佳检测框并统计延迟。
+
+    两个后端的最佳框都存在且 IoU >= min_iou，或都未检测到，视为一致。
+
+    Returns:
+        bool: 全部样本一致时为 True。
+    """
+    from detector import Detector
+    from onnx_detector import OnnxDetector
+
+    samples = sample_frames(args.main_json_path, args.videos_dir, args.num_videos, args.frames_per_video)
+    if not samples:
+        print("错误: 没有可用的检测样本。")
+        return False
+    print(f"共 {len(samples)} 帧样本。")
+
+    reference = Detector(**DETECTOR_CONFIG)
+    ref_boxes, ref_latencies = run_detector(reference, samples)
+    del reference
+
+    onnx = OnnxDetector(**DETECTOR_CONFIG, cache_dir=args.onnx_cache_dir, quantize=args.onnx_quantize,
+                        num_threads=args.num_threads)
+    onnx_boxes, onnx_latencies = run_detector(onnx, samples)
+
+    mismatches = []
+    for (video_key, frame_idx, _, prompt), ref_box, onnx_box in zip(samples, ref_boxes, onnx_boxes):
+        if ref_box is None and onnx_box is None:
+            continue
+        iou = 0.0
+        if ref_box is not None and onnx_box is not None:
+            iou = calculate_iou(_corners(ref_box), _corners(onnx_box))
+        if iou < args.min_iou:
+            mismatches.append({"video": video_key, "frame": int(frame_idx), "prompt": prompt,
+                               "torch": list(ref_box) if ref_box else None,
+                               "onnx": list(onnx_box) if onnx_box else None, "iou": iou})
+
+    report = {
+        "backend": "onnx-int8" if args.onnx_quantize else "onnx-fp32",
+        "num_samples": len(samples),
+        "num_mismatches": len(mismatches),
+        "min_iou": args.min_iou,
+        "torch_ms_per_frame": 1000 * float(np.mean(ref_latencies)) if ref_latencies else None,
+        "onnx_ms_per_frame": 1000 * float(np.mean(onnx_latencies)) if onnx_latencies else None,
+        "mismatches": mismatches,
+    }
+    print(json.dumps({k: v for k, v in report.items() if k != "mismatches"}, indent=4, ensure_ascii=False))
+    for m in mismatches:
+        print(f"不一致: 视频 {m['video']} 第 {m['frame']} 帧 '{m['prompt']}': "
+              f"torch={m['torch']} onnx={m['onnx']} IoU={m['iou']:.3f}")
+
+    if args.output:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+        print(f"报告已保存至: {args.output}")
+    return not mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="检查 ONNX Runtime 检测器后端与 PyTorch 后端的检测结果是否一致，并比较延迟。")
+    parser.add_argument('--videos_dir', type=str, default='sample_videos', help='存放输入视频的目录。')
+    parser.add_argument('--main_json_path', type=str, default='sample_video.json', help='包含任务描述和真值的主JSON文件。')
+    parser.add_argument('--num_videos', type=int, default=5, help='抽样的视频数。')
+    parser.add_argument('--frames_per_video', type=int, default=4, help='每个视频在真值区间内抽取的帧数。')
+    parser.add_argument('--min_iou', type=float, default=0.9, help='两个后端最佳框的最小 IoU，低于此值视为不一致。')
+    parser.add_argument('--onnx_quantize', action='store_true', help='检查动态 int8 量化后的模型。')
+    parser.add_argument('--onnx_cache_dir', type=str, default='.cache/onnx', help='导出的 ONNX 模型缓存目录。')
+    parser.add_argument('--num_threads', type=int, default=None, help='ONNX Runtime 的算子内线程数。')
+    parser.add_argument('--output', type=str, default='output/detector_parity.json', help='报告JSON文件路径。')
+
+    args = parser.parse_args()
+    sys.exit(0 if check_parity(args) else 1)
@@ -0,0 +1,87 @@
+# evaluate_runs.py
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from evaluation import load_run, evaluate_run
+from task_store import open_task_store
+
+METRIC_COLUMNS = ('mean_iou', 'viou', 'tiou', 'auc', 'precision')
+
+
+def evaluate_runs(args):
+    """
+    离线评估一个或多个运行结果 (不需要重新推理)，并把各次运行的指标并排比较。
+    """
+    start = time.perf_counter()
+    all_tasks_data = open_task_store(args.main_json_path)
+    runs = {}
+    for path in args.runs:
+        if not os.path.exists(path):
+            print(f"跳过: 结果路径不存在 -> {path}")
+            continue
+        runs[path] = load_run(path)
+    if not runs:
+        print("错误: 没有可评估的运行结果。")
+        return None
+
+    video_keys = None
+    if args.common_only:
+        # 只在所有运行都有结果的视频上比较，保证公平
+        video_keys = set.intersection(*(set(run) for run in runs.values())) & set(all_tasks_data.keys())
+        print(f"共同视频数: {len(video_keys)}")
+
+    thresholds = np.linspace(0.0, 1.0, args.num_thresholds)
+    report = {name: evaluate_run(run, all_tasks_data, video_keys, thresholds, args.pixel_threshold)
+              for name, run in runs.items()}
+
+    print(f"\n{'运行':<40}{'视频数':>8}" + ''.join(f"{name:>11}" for name in METRIC_COLUMNS))
+    for name, result in report.items():
+        row = ''.join(f"{result['mean'].get(metric, 0.0):>11.4f}" for metric in METRIC_COLUMNS)
+        print(f"{name[-40:]:<40}{len(result['videos']):>8}{row}")
+
+    if args.per_video and len(report) > 1:
+        # 逐视频比较 mean_iou，按与第一个运行的差值排序，便于找出变化最大的视频
+        baseline_name, *others = report
+        baseline = report[baseline_name]['videos']
+        print(f"\n逐视频 mean_iou 对比 (基准: {baseline_name}):")
+        for name in others:
+            deltas = sorted(((v['mean_iou'] - baseline[k]['mean_iou'], k) for k, v in report[name]['videos'].items()
+                             if k in baseline))
+            if len(deltas) > 2 * args.per_video:
+                deltas = deltas[:args.per_video] + deltas[-args.per_video:]
+            for delta, video_key in deltas:
+                print(f"  {name[-30:]:<30} 视频 {video_key:>6}: {baseline[video_key]['mean_iou']:.4f} -> "
+                      f"{report[name]['videos'][video_key]['mean_iou']:.4f} ({delta:+.4f})")
+
+    print(f"\n评估 {len(report)} 个运行共耗时 {time.perf_counter() - start:.2f}s")
+    if args.output:
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        print(f"评估结果已保存至 {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="离线评估一个或多个运行结果: mean IoU、vIoU、tIoU、成功率曲线 AUC 与中心距离精度。")
+    parser.add_argument('runs', type=str, nargs='+', help='结果目录 (包含 *_result.json) 或单个结果JSON文件，可给出多个以并排比较。')
+    parser.add_argument('--main_json_path', type=str, default='sample_video.json', help='包含所有任务描述和真值的主JSON文件。')
+    parser.add_argument('--pixel_threshold', type=float, default=20.0, help='中心距离精度的像素阈值。')
+    parser.add_argument('--num_thresholds', type=int, default=21, help='成功率曲线在 [0, 1] 上的 IoU 阈值个数。')
+    parser.add_argument('--common_only', action='store_true', help='只评估所有运行都有结果的视频。')
+    parser.add_argument('--per_video', type=int, default=0, help='多个运行时，列出相对第一个运行 mean_iou 变化最大的前 N 个视频。')
+    parser.add_argument('--output', type=str, default='output/evaluation.json', help='评估结果JSON文件路径。')
+
+    args = parser.parse_args()
+
+    evaluate_runs(args)
@@ -0,0 +1,230 @@
+# render_overlays.py
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from task_store import open_task_store
+from utils import VideoReader
+
+PRED_COLOR = (0, 255, 0)    # 预测框: 绿色，黑字
+GT_COLOR = (0, 0, 255)      # 真值框: 红色，白字
+
+
+def draw_labeled_box(frame, box, label, color, text_color):
+    """
+    在帧上绘制矩形框，并在框的上方绘制带背景的标签。
+    """
+    xmin, ymin, xmax, ymax = (int(v) for v in box)
+    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
+
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.8
+    font_thickness = 2
+    (text_w, text_h), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
+    cv2.rectangle(frame, (xmin, ymin - text_h - 10), (xmin + text_w, ymin - 5), color, -1)
+    cv2.putText(frame, label, (xmin, ymin - 10), font, font_scale, text_color, font_thickness)
+
+
+def load_overlays(video_path, result_json_path=None, main_json_path=None):
+    """
+    读取预测框与真值框，统一为 {帧号: (xmin, ymin, xmax, ymax)}。
+
+    Returns:
+        tuple: (pred_boxes, pred_label, gt_boxes, gt_label)，未提供或读取失败的一方为空字典。
+    """
+    pred_boxes, pred_label, gt_boxes, gt_label = {}, "", {}, ""
+
+    if result_json_path:
+        try:
+            with open(result_json_path, 'r', encoding='utf-8') as f:
+                results_data = json.load(f)
+        except FileNotFoundError:
+            print(f"错误: 结果文件未找到 -> {result_json_path}")
+            results_data = {}
+        except json.JSONDecodeError:
+            print(f"错误: 结果文件格式不正确，无法解析 -> {result_json_path}")
+            results_data = {}
+        if results_data:
+            # 假设JSON文件中只有一个视频键
+            video_key = list(results_data.keys())[0]
+            tracking_info = results_data[video_key]
+            pred_label = tracking_info.get("refined_query", "Unknown Target")
+            for frame_key, bbox in tracking_info.get("pred_bboxs", {}).items():
+                if bbox:
+                    pred_boxes[int(frame_key)] = (bbox['xmin'], bbox['ymin'], bbox['xmax'], bbox['ymax'])
+            print(f"成功加载到视频 '{video_key}' 的预测结果，精炼后的追踪目标: '{pred_label}'")
+
+    if main_json_path:
+        video_filename = os.path.basename(video_path)
+        video_number_match = re.search(r'(\d+)', video_filename)
+        all_tasks_data = open_task_store(main_json_path)
+        if not video_number_match or video_number_match.group(1) not in all_tasks_data:
+            print(f"错误: 在JSON文件中未找到视频 '{video_filename}' 的真值数据。")
+        else:
+            video_key = video_number_match.group(1)
+            task_info = all_tasks_data.metadata(video_key)
+            start_frame = task_info.get("temp_gt", {}).get("begin_fid")
+            gt_label = f"GT: {task_info.get('target_category', 'ground_truth')}"
+            if start_frame is None:
+                print(f"错误: 视频 '{video_key}' 的真值数据不完整 (缺少 'begin_fid')。")
+            else:
+                for i, box in enumerate(all_tasks_data.gt_boxes(video_key)):
+                    gt_boxes[start_frame + i] = tuple(int(v) for v in box)
+                print(f"成功加载视频 '{video_key}' 的真值数据。目标类别: '{gt_label[4:]}'")
+
+    return pred_boxes, pred_label, gt_boxes, gt_label
+
+
+def render_chunk(video_path, chunk_path, start_frame, end_frame, pred_boxes, pred_label, gt_boxes, gt_label,
+                 show_progress=False):
+    """
+    解码 [start_frame, end_frame] 一次，同时绘制预测框与真值框并写入 chunk_path。返回写入的帧数。
+    """
+    with VideoReader(video_path) as video:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(chunk_path, fourcc, video.fps, (video.width, video.height))
+        written = 0
+        try:
+            frames = video.iter_frames(start_frame, end_frame)
+            if show_progress:
+                frames = tqdm(frames, total=end_frame - start_frame + 1, desc="生成可视化视频")
+            for frame_idx, frame in enumerate(frames, start=start_frame):
+                # 真值先画，预测框叠在上层
+                if frame_idx in gt_boxes:
+                    draw_labeled_box(frame, gt_boxes[frame_idx], gt_label, GT_COLOR, (255, 255, 255))
+                if frame_idx in pred_boxes:
+                    draw_labeled_box(frame, pred_boxes[frame_idx], pred_label, PRED_COLOR, (0, 0, 0))
+                out.write(frame)
+                written += 1
+        finally:
+            out.release()
+    return written
+
+
+def _render_chunk_job(job):
+    return render_chunk(*job)
+
+
+def concat_chunks(chunk_paths, output_path, fps, size):
+    """
+    按顺序拼接各分段。有 ffmpeg 时直接复制码流 (不重新编码)，否则用 OpenCV 逐帧重写。
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        list_path = output_path + '.concat.txt'
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in chunk_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                            '-i', list_path, '-c', 'copy', output_path], check=True)
+            return
+        except subprocess.CalledProcessError as e:
+            print(f"警告: ffmpeg 拼接失败 ({e})，改用 OpenCV 重新编码拼接。")
+        finally:
+            os.remove(list_path)
+
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    try:
+        for path in chunk_paths:
+            cap = cv2.VideoCapture(path)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        out.release()
+
+
+def render_overlays(video_path, output_path, result_json_path=None, main_json_path=None, window_only=False,
+                    workers=1, chunk_frames=1500):
+    """
+    只解码一遍视频，把预测框 (绿色) 与真值框 (红色) 画在同一个输出视频上。
+
+    Args:
+        result_json_path: 预测结果JSON (pred_bboxs 格式)，不提供时只画真值。
+        main_json_path: 包含真值的主JSON文件，不提供时只画预测。
+        window_only: 只导出有框的时间窗口 (预测与真值帧号的并集范围)，而不是整段视频。
+        workers: 大于 1 时把帧区间切成每段 chunk_frames 帧，由多个进程并行渲染后按顺序拼接。
+    """
+    print(f"开始可视化处理...")
+    print(f"输入视频: {video_path}")
+    print(f"输出视频: {output_path}")
+
+    pred_boxes, pred_label, gt_boxes, gt_label = load_overlays(video_path, result_json_path, main_json_path)
+
+    try:
+        with VideoReader(video_path) as video:
+            fps, size = video.fps, (video.width, video.height)
+            total_frames = int(video.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    except IOError as e:
+        print(e)
+        return False
+
+    start_frame, end_frame = 0, total_frames - 1
+    if window_only:
+        annotated = list(pred_boxes) + list(gt_boxes)
+        if not annotated:
+            print("错误: 没有任何可绘制的边界框，无法确定时间窗口。")
+            return False
+        start_frame, end_frame = max(0, min(annotated)), min(end_frame, max(annotated))
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    num_frames = end_frame - start_frame + 1
+    if workers <= 1 or num_frames <= chunk_frames:
+        render_chunk(video_path, output_path, start_frame, end_frame, pred_boxes, pred_label, gt_boxes, gt_label,
+                     show_progress=True)
+    else:
+        bounds = [(s, min(end_frame, s + chunk_frames - 1)) for s in range(start_frame, end_frame + 1, chunk_frames)]
+        with tempfile.TemporaryDirectory(prefix='.render-', dir=output_dir or '.') as tmp_dir:
+            jobs = []
+            for i, (s, e) in enumerate(bounds):
+                # 每个分段只携带自己区间内的框，减少进程间传输
+                jobs.append((video_path, os.path.join(tmp_dir, f"chunk_{i:05d}.mp4"), s, e,
+                             {k: v for k, v in pred_boxes.items() if s <= k <= e}, pred_label,
+                             {k: v for k, v in gt_boxes.items() if s <= k <= e}, gt_label))
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+                list(tqdm(executor.map(_render_chunk_job, jobs), total=len(jobs), desc="分段渲染"))
+            concat_chunks([job[1] for job in jobs], output_path, fps, size)
+
+    print("\n可视化视频处理完成！")
+    print(f"输出文件已保存至: {output_path}")
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="一次解码，同时把预测框与真值框可视化到视频上")
+    parser.add_argument('--video_path', type=str, required=True, help='原始输入视频的路径 (例如: sample_videos/video_1.mp4)')
+    parser.add_argument('--json_path', type=str, default=None, help='追踪结果JSON文件的路径 (例如: output_batch/1_result.json)')
+    parser.add_argument('--main_json_path', type=str, default=None, help='包含真值的主JSON文件路径 (例如: sample_video.json)')
+    parser.add_argument('--output_path', type=str, required=True, help='带标注的输出视频路径')
+    parser.add_argument('--window_only', action='store_true', help='只导出有标注框的时间窗口')
+    parser.add_argument('--workers', type=int, default=1, help='并行渲染的进程数 (>1 时按 --chunk_frames 分段渲染再拼接)')
+    parser.add_argument('--chunk_frames', type=int, default=1500, help='每个分段的帧数')
+
+    args = parser.parse_args()
+
+    if not args.json_path and not args.main_json_path:
+        parser.error('至少需要提供 --json_path 或 --main_json_path 之一。')
+
+    render_overlays(args.video_path, args.output_path, args.json_path, args.main_json_path,
+                    args.window_only, args.workers, args.chunk_frames)
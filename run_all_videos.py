@@ -7,8 +7,388 @@ import subprocess
 import argparse
 from tqdm import tqdm
 import re
+import time
+import inspect
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# src 下的模块之间按模块名互相导入 (例如 tracker 依赖 tracing)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+import tracing
+from tracing import add_tracing_arguments, tracing_arguments_to_argv
+import iou_calculator
+from iou_calculator import batch_iou, boxes_to_array
+from disk_cache import hash_key
+from run_manifest import compute_run_hash, read_result_entry
+from detector_backends import add_detector_arguments, detector_arguments_to_argv, detector_config
+from task_store import open_task_store
+from redetect_scheduler import add_redetect_arguments, redetect_arguments_to_argv
+from tracker import add_tracker_arguments, tracker_arguments_to_argv
+
+def append_iou_to_result(result_json_path, video_number_str, all_tasks_data, tags=None):
+    """
+    读取单个视频的结果文件，计算逐帧 IoU 和平均 IoU 并写回该文件。
+    同时写入 scoring_hash (评分代码的哈希)，评分代码改动后增量运行会据此只重算 IoU。
+    缺少真值而无法评分时也写入 scoring_hash 与 tags，增量运行不会因此反复重跑该视频。
+
+    Args:
+        all_tasks_data (TaskStore): 由 open_task_store 打开的任务库。
+        tags (dict, optional): 额外写入该视频条目的字段 (例如 run_hash)。
+    """
+    try:
+        with open(result_json_path, 'r', encoding='utf-8') as f:
+            result_data = json.load(f)
+
+        def write_entry(fields):
+            result_data[video_number_str].update(fields, scoring_hash=scoring_hash())
+            result_data[video_number_str].update(tags or {})
+            with open(result_json_path, 'w', encoding='utf-8') as f:
+                json.dump(result_data, f, indent=4)
+        
+        if video_number_str not in all_tasks_data:
+            print(f"警告: 在主JSON文件中找不到视频 {video_number_str} 的真值数据。")
+            write_entry({})
+            return
+        
+        # --- 这是被修正的关键逻辑 ---
+        # 1. 从任务库获取 'target_bboxs' 真值框数组 (N, 4) xyxy
+        gt_arr = all_tasks_data.gt_boxes(video_number_str)
+        if len(gt_arr) == 0:
+            print(f"警告: 视频 {video_number_str} 的真值数据中没有 'target_bboxs' 字段。")
+            write_entry({})
+            return
+        
+        # 2. 获取开始帧，用于计算偏移量
+        start_frame = all_tasks_data.metadata(video_number_str).get('temp_gt', {}).get('begin_fid')
+        if start_frame is None:
+            print(f"警告: 视频 {video_number_str} 中找不到 'begin_fid'。")
+            write_entry({})
+            return
+        # --------------------------
+
+        pred_bboxs = result_data.get(video_number_str, {}).get('pred_bboxs', {})
+
+        # 只在有预测框且落在真值范围内的帧上计算IoU
+        frame_keys = list(pred_bboxs.keys())
+        pred_arr, pred_mask = boxes_to_array(list(pred_bboxs.values()))
+        gt_index = np.array([int(k) for k in frame_keys], dtype=np.int64) - start_frame
+        valid = pred_mask & (gt_index >= 0) & (gt_index < len(gt_arr))
+        ious = batch_iou(pred_arr[valid], gt_arr[gt_index[valid]])
+
+        frame_ious = {k: float(iou) for k, iou in zip(np.asarray(frame_keys)[valid].tolist(), ious)}
+        total_iou, iou_count = float(ious.sum()), int(valid.sum())
+        
+        average_iou = total_iou / iou_count if iou_count > 0 else 0
+        
+        write_entry({'average_iou': average_iou, 'frame_by_frame_iou': frame_ious})
+        
+        print(f"视频 {video_number_str} 的平均 IoU 为: {average_iou:.4f}")
+        return average_iou
+
+    except Exception as e:
+        print(f"错误: 在为视频 {video_number_str} 计算或追加 IoU 时失败: {e}")
+
+
+def scoring_hash():
+    """
+    评分代码 (append_iou_to_result 与 iou_calculator 模块) 的内容哈希。
+    """
+    return hash_key(inspect.getsource(append_iou_to_result), inspect.getsource(iou_calculator))
+
+
+# 决定推理结果的源码文件 (src 下)，改动后已有结果不能复用
+PIPELINE_SOURCES = ('main_llm.py', 'async_refiner.py', 'data_loader.py', 'utils.py', 'detector.py', 'onnx_detector.py',
+                    'detector_backends.py', 'tracker.py', 'redetect_scheduler.py', 'result_writer.py')
+
+
+@functools.lru_cache(maxsize=None)
+def pipeline_hash():
+    """
+    推理代码 (PIPELINE_SOURCES 中各文件) 的内容哈希。直接读文件而不导入，不需要加载 torch；
+    每个进程只计算一次。
+    """
+    src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+    sources = []
+    for name in PIPELINE_SOURCES:
+        with open(os.path.join(src_dir, name), 'rb') as f:
+            sources.append(f.read())
+    return hash_key(*sources)
+
+
+def run_config(args):
+    """
+    影响单个视频推理结果的全部配置，计入运行哈希。
+
+    精炼短语由实际使用的模型与提示模板决定，两者改动后已有结果不能复用；
+    推理代码本身的改动 (例如修正帧编号) 同样会改变结果，由 pipeline_hash 体现。
+    """
+    # 延迟导入: main_llm 依赖 zhipuai，只在计算运行哈希时才需要加载
+    from main_llm import APIQueryRefiner
+    return {
+        "detector": detector_config(args),
+        "refine_model": args.refine_model,
+        "refine_prompt": APIQueryRefiner.PHRASE_PROMPT,
+        "tracker": tracker_arguments_to_argv(args),
+        "redetect": redetect_arguments_to_argv(args),
+        "pipeline": pipeline_hash(),
+    }
+
+
+def incremental_status(args, video_number_str, video_path, result_json_path, all_tasks_data):
+    """
+    判断视频是否需要重新处理。
+
+    Returns:
+        tuple: (status, run_hash)。status 为 'run' (需要推理)、'rescore' (推理结果可复用，
+        但评分代码变了，只重算 IoU) 或 'skip' (结果完全可复用)。
+    """
+    task_metadata = all_tasks_data.metadata(video_number_str) if video_number_str in all_tasks_data else {}
+    run_hash = compute_run_hash(video_path, task_metadata, run_config(args))
+    if args.force:
+        return 'run', run_hash
+    entry = read_result_entry(result_json_path, video_number_str)
+    if entry.get('run_hash') != run_hash:
+        return 'run', run_hash
+    if entry.get('scoring_hash') != scoring_hash():
+        return 'rescore', run_hash
+    return 'skip', run_hash
+
+
+def reuse_existing_result(status, run_hash, video_number_str, result_json_path, all_tasks_data):
+    """
+    对无需重新推理的视频直接复用结果，必要时重算 IoU。返回该视频的平均 IoU。
+    """
+    if status == 'rescore':
+        print(f"视频 {video_number_str} 的推理结果未变，评分代码已更新，仅重新计算 IoU。")
+        return append_iou_to_result(result_json_path, video_number_str, all_tasks_data, tags={'run_hash': run_hash})
+    print(f"跳过视频 {video_number_str}: 输入与配置均未变化，复用已有结果。")
+    return read_result_entry(result_json_path, video_number_str).get('average_iou')
+
+
+def build_in_process_pipeline(args):
+    """
+    在当前进程中一次性构建查询精炼器、检测器和跟踪器工厂，供所有视频复用。
+    """
+    # 延迟导入: 仅在进程内模式下才需要加载 torch/transformers
+    import main_llm
+    from detector_backends import build_detector
+    from tracker import tracker_factory_from_args
+    from redetect_scheduler import scheduler_factory_from_args
+
+    tracing.configure_tracing_from_args(args)
+    print("进程内模式: 正在加载共享的模型与API客户端...")
+    return {
+        'process_video': main_llm.process_video,
+        'query_refiner': main_llm.build_query_refiner(args.api_key, args.refine_cache_dir, args.refine_cache_mb, args.replay,
+                                                     model=args.refine_model, base_url=args.api_base_url),
+        'detector': build_detector(args),
+        'tracker_factory': tracker_factory_from_args(args),
+        'scheduler_factory': scheduler_factory_from_args(args),
+        'resume': args.resume,
+        'checkpoint_every': args.checkpoint_every,
+        'fast_resume': args.fast_resume,
+    }
+
+
+def run_video_in_process(pipeline, video_path, main_json_path, result_json_path, video_number_str, refined_phrase=None):
+    """
+    使用共享组件在当前进程中处理单个视频。单个视频的异常不会中断整个批处理。
+    """
+    try:
+        ok = pipeline['process_video'](
+            video_path, main_json_path, result_json_path,
+            pipeline['query_refiner'], pipeline['detector'], pipeline['tracker_factory'],
+            refined_phrase=refined_phrase, scheduler_factory=pipeline['scheduler_factory'],
+            resume=pipeline['resume'], checkpoint_every=pipeline['checkpoint_every'],
+            fast_resume=pipeline['fast_resume'])
+    except Exception as e:
+        print(f"错误: 进程内处理视频 {video_number_str} 时失败: {e}")
+        return False
+
+    if not ok:
+        print(f"错误: 视频 {video_number_str} 未生成结果文件。")
+        return False
+    print(f"视频 {video_number_str} 处理完成，结果已保存至 {result_json_path}")
+    return True
+
+
+def finish_video(args, video_number_str, video_path, result_json_path, all_tasks_data, run_hash=None):
+    """
+    单个视频推理完成后的收尾工作：计算并追加 IoU (同时记录运行哈希)，按需生成可视化视频。
+    """
+    # 计算并追加 IoU
+    tags = {'run_hash': run_hash} if run_hash else None
+    average_iou = append_iou_to_result(result_json_path, video_number_str, all_tasks_data, tags=tags)
+
+    if args.visualize:
+        annotated_video_path = os.path.join(args.output_dir, f"{video_number_str}_annotated.mp4")
+        # 预测框与真值框在同一次解码中一起绘制
+        render_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'render_overlays.py')
+        visualize_command = [sys.executable, render_script, '--video_path', video_path, '--json_path', result_json_path,
+                             '--main_json_path', args.main_json_path, '--output_path', annotated_video_path]
+        if args.visualize_window_only:
+            visualize_command.append('--window_only')
+        try:
+            print(f"正在为视频 {video_number_str} 生成可视化结果...")
+            subprocess.run(visualize_command, check=True, capture_output=True, text=True, timeout=300)
+            print(f"可视化视频已生成: {annotated_video_path}")
+        except subprocess.CalledProcessError as e:
+            print(f"错误: 运行可视化脚本处理视频 {video_number_str} 时失败: {e.stderr}")
+
+    return average_iou
+
+
+# --- 多进程模式：每个工作进程加载一次模型，按任务长度从长到短调度 ---
+
+_worker_state = {}
+
+
+def pin_thread_counts(num_threads):
+    """
+    限制当前进程中 torch/OpenCV/BLAS 使用的线程数，避免多个工作进程争抢CPU核心。
+    """
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(num_threads)
+    import cv2
+    cv2.setNumThreads(num_threads)
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+
+
+def _init_worker(args, num_threads):
+    pin_thread_counts(num_threads)
+    _worker_state['args'] = args
+    _worker_state['pipeline'] = build_in_process_pipeline(args)
+    _worker_state['all_tasks_data'] = open_task_store(args.main_json_path)
+
+
+def _process_video_in_worker(video_number_str, video_filename, run_hash=None):
+    args = _worker_state['args']
+    video_path = os.path.join(args.videos_dir, video_filename)
+    result_json_path = os.path.join(args.output_dir, f"{video_number_str}_result.json")
+
+    start_time = time.perf_counter()
+    ok = run_video_in_process(_worker_state['pipeline'], video_path, args.main_json_path, result_json_path, video_number_str)
+    average_iou = finish_video(args, video_number_str, video_path, result_json_path, _worker_state['all_tasks_data'],
+                               run_hash=run_hash) if ok else None
+    return {"ok": ok, "average_iou": average_iou, "wall_time_s": time.perf_counter() - start_time}
+
+
+def process_all_videos_parallel(args, video_files, all_tasks_data):
+    """
+    使用进程池并行处理所有视频。按 end_fid - begin_fid 从长到短提交任务
+    (最长任务优先)，以缩短整批的完成时间，最后输出汇总的平均 IoU 与耗时。
+    """
+    jobs = []
+    per_video = {}
+    for video_filename in video_files:
+        video_number_match = re.search(r'(\d+)', video_filename)
+        if not video_number_match:
+            print(f"跳过: 无法从 {video_filename} 中提取视频编号。")
+            continue
+        video_number_str = video_number_match.group(1)
+        result_json_path = os.path.join(args.output_dir, f"{video_number_str}_result.json")
+        status, run_hash = incremental_status(args, video_number_str, os.path.join(args.videos_dir, video_filename),
+                                              result_json_path, all_tasks_data)
+        if status != 'run':
+            average_iou = reuse_existing_result(status, run_hash, video_number_str, result_json_path, all_tasks_data)
+            per_video[video_number_str] = {"ok": True, "average_iou": average_iou, "wall_time_s": 0.0, "reused": True}
+            continue
+        temp_gt = all_tasks_data.metadata(video_number_str).get('temp_gt', {}) if video_number_str in all_tasks_data else {}
+        length = (temp_gt.get('end_fid') or 0) - (temp_gt.get('begin_fid') or 0)
+        jobs.append((length, video_number_str, video_filename, run_hash))
+    jobs.sort(key=lambda job: job[0], reverse=True)
+
+    num_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    print(f"并行模式: {args.workers} 个工作进程，每个进程 {num_threads} 个线程。")
+
+    batch_start = time.perf_counter()
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(args, num_threads)) as executor:
+        futures = {executor.submit(_process_video_in_worker, video_number_str, video_filename, run_hash): video_number_str
+                   for _, video_number_str, video_filename, run_hash in jobs}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="总处理进度"):
+            video_number_str = futures[future]
+            try:
+                per_video[video_number_str] = future.result()
+            except Exception as e:
+                print(f"错误: 工作进程处理视频 {video_number_str} 时失败: {e}")
+                per_video[video_number_str] = {"ok": False, "average_iou": None, "wall_time_s": None}
+
+    ious = [r["average_iou"] for r in per_video.values() if r["average_iou"] is not None]
+    summary = {
+        "workers": args.workers,
+        "threads_per_worker": num_threads,
+        "num_videos": len(per_video),
+        "num_reused": sum(1 for r in per_video.values() if r.get("reused")),
+        "num_succeeded": sum(1 for r in per_video.values() if r["ok"]),
+        "mean_average_iou": sum(ious) / len(ious) if ious else 0,
+        "total_wall_time_s": time.perf_counter() - batch_start,
+        "videos": dict(sorted(per_video.items(), key=lambda item: int(item[0]))),
+    }
+    summary_path = os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=4)
+    print(f"\n汇总: {summary['num_succeeded']}/{summary['num_videos']} 个视频成功，"
+          f"平均 IoU {summary['mean_average_iou']:.4f}，总耗时 {summary['total_wall_time_s']:.1f}s。汇总已保存至 {summary_path}")
+
+
+def process_all_videos_async_refined(args, pipeline, video_files, all_tasks_data):
+    """
+    先为所有视频并发发起查询精炼请求，再按精炼完成的顺序依次做检测与跟踪，
+    使网络等待与 GPU 推理重叠。
+    """
+    from data_loader import load_video_data
+    from async_refiner import AsyncRefinementStage, RefineJob
+
+    jobs, video_files_by_key, run_hashes = [], {}, {}
+    for video_filename in video_files:
+        video_number_match = re.search(r'(\d+)', video_filename)
+        if not video_number_match:
+            print(f"跳过: 无法从 {video_filename} 中提取视频编号。")
+            continue
+        video_number_str = video_number_match.group(1)
+        try:
+            task_video_path, start_frame, _, complex_query, _ = load_video_data(args.main_json_path, video_filename,
+                                                                                args.videos_dir)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"跳过视频 {video_filename}: {e}")
+            continue
+        result_json_path = os.path.join(args.output_dir, f"{video_number_str}_result.json")
+        status, run_hash = incremental_status(args, video_number_str, task_video_path, result_json_path, all_tasks_data)
+        if status != 'run':
+            reuse_existing_result(status, run_hash, video_number_str, result_json_path, all_tasks_data)
+            continue
+        jobs.append(RefineJob(video_number_str, task_video_path, start_frame, complex_query))
+        video_files_by_key[video_number_str] = video_filename
+        run_hashes[video_number_str] = run_hash
+
+    stage = AsyncRefinementStage(pipeline['query_refiner'], concurrency=args.refine_concurrency,
+                                 rate=args.refine_rate, max_retries=args.refine_retries)
+    for job, refined_phrase in tqdm(stage.stream(jobs), total=len(jobs), desc="总处理进度"):
+        video_number_str = job.video_key
+        video_path = os.path.join(args.videos_dir, video_files_by_key[video_number_str])
+        result_json_path = os.path.join(args.output_dir, f"{video_number_str}_result.json")
+
+        print(f"\n--- 正在处理视频 {video_number_str}: {video_files_by_key[video_number_str]} ---")
+        if not refined_phrase:
+            print(f"错误: 视频 {video_number_str} 的查询精炼失败，跳过。")
+            continue
+        if not run_video_in_process(pipeline, video_path, args.main_json_path, result_json_path,
+                                    video_number_str, refined_phrase=refined_phrase):
+            continue
+
+        finish_video(args, video_number_str, video_path, result_json_path, all_tasks_data,
+                     run_hash=run_hashes[video_number_str])
 
-from src.iou_calculator import calculate_iou
 
 def process_all_videos(args):
     """
@@ -26,8 +406,7 @@ def process_all_videos(args):
     
     os.makedirs(args.output_dir, exist_ok=True)
 
-    with open(args.main_json_path, 'r', encoding='utf-8') as f:
-        all_tasks_data = json.load(f)
+    all_tasks_data = open_task_store(args.main_json_path)
 
     video_files = sorted([f for f in os.listdir(args.videos_dir) if f.endswith('.mp4')])
     
@@ -37,6 +416,21 @@ def process_all_videos(args):
 
     print(f"找到 {len(video_files)} 个视频待处理。")
 
+    if args.async_refine and not args.in_process:
+        print("错误: --async_refine 需要与 --in_process 一起使用。")
+        return
+    if args.workers > 1:
+        if args.async_refine:
+            print("错误: --workers 与 --async_refine 不能同时使用。")
+            return
+        process_all_videos_parallel(args, video_files, all_tasks_data)
+        return
+
+    pipeline = build_in_process_pipeline(args) if args.in_process else None
+    if args.async_refine:
+        process_all_videos_async_refined(args, pipeline, video_files, all_tasks_data)
+        return
+
     for video_filename in tqdm(video_files, desc="总处理进度"):
         
         video_number_match = re.search(r'(\d+)', video_filename)
@@ -48,100 +442,89 @@ def process_all_videos(args):
         video_path = os.path.join(args.videos_dir, video_filename)
         result_json_path = os.path.join(args.output_dir, f"{video_number_str}_result.json")
         
+        status, run_hash = incremental_status(args, video_number_str, video_path, result_json_path, all_tasks_data)
+        if status != 'run':
+            reuse_existing_result(status, run_hash, video_number_str, result_json_path, all_tasks_data)
+            continue
+
         print(f"\n--- 正在处理视频 {video_number_str}: {video_filename} ---")
         
-        main_script_command = [
-            python_executable,
-            'src/main_llm.py',
-            '--video_path', video_path,
-            '--json_path', args.main_json_path,
-            '--api_key', args.api_key,
-            '--output_path', result_json_path
-        ]
-        
-        try:
-            subprocess.run(main_script_command, check=True, capture_output=True, text=True, timeout=300)
-            print(f"视频 {video_number_str} 处理完成，结果已保存至 {result_json_path}")
-        except subprocess.CalledProcessError as e:
-            print(f"错误: 运行主脚本处理视频 {video_number_str} 时失败。")
-            print(f"标准错误: {e.stderr}")
-            continue # 跳过当前视频，继续处理下一个
-
-        # 计算并追加 IoU
-        try:
-            with open(result_json_path, 'r', encoding='utf-8') as f:
-                result_data = json.load(f)
-            
-            if video_number_str not in all_tasks_data:
-                print(f"警告: 在主JSON文件中找不到视频 {video_number_str} 的真值数据。")
-                continue
-            
-            # --- 这是被修正的关键逻辑 ---
-            # 1. 从 'target_bboxs' 获取真值框列表
-            gt_bbox_list = all_tasks_data[video_number_str].get('target_bboxs')
-            if not gt_bbox_list:
-                print(f"警告: 视频 {video_number_str} 的真值数据中没有 'target_bboxs' 字段。")
-                continue
-            
-            # 2. 获取开始帧，用于计算偏移量
-            start_frame = all_tasks_data[video_number_str].get('temp_gt', {}).get('begin_fid')
-            if start_frame is None:
-                print(f"警告: 视频 {video_number_str} 中找不到 'begin_fid'。")
-                continue
-            # --------------------------
-
-            pred_bboxs = result_data.get(video_number_str, {}).get('pred_bboxs', {})
-            total_iou, iou_count, frame_ious = 0, 0, {}
-
-            # 遍历所有有预测结果的帧
-            for frame_idx_str, pred_box in pred_bboxs.items():
-                if pred_box: # 只在有预测框的帧上计算IoU
-                    frame_idx = int(frame_idx_str)
-                    # 计算当前帧在真值列表中的索引
-                    gt_index = frame_idx - start_frame
-                    
-                    # 确保索引有效
-                    if 0 <= gt_index < len(gt_bbox_list):
-                        gt_box = gt_bbox_list[gt_index]
-                        
-                        iou = calculate_iou(pred_box, gt_box)
-                        frame_ious[frame_idx_str] = iou
-                        total_iou += iou
-                        iou_count += 1
-            
-            average_iou = total_iou / iou_count if iou_count > 0 else 0
+        if pipeline is not None:
+            if not run_video_in_process(pipeline, video_path, args.main_json_path, result_json_path, video_number_str):
+                continue # 跳过当前视频，继续处理下一个
+        else:
+            main_script_command = [
+                python_executable,
+                'src/main_llm.py',
+                '--video_path', video_path,
+                '--json_path', args.main_json_path,
+                '--output_path', result_json_path,
+                '--refine_cache_dir', args.refine_cache_dir,
+                '--refine_cache_mb', str(args.refine_cache_mb),
+                '--refine_model', args.refine_model,
+            ]
+            if args.api_key:
+                main_script_command += ['--api_key', args.api_key]
+            if args.replay:
+                main_script_command.append('--replay')
+            if args.api_base_url:
+                main_script_command += ['--api_base_url', args.api_base_url]
+            main_script_command += detector_arguments_to_argv(args)
+            main_script_command += tracker_arguments_to_argv(args)
+            main_script_command += redetect_arguments_to_argv(args)
+            main_script_command += tracing_arguments_to_argv(args)
+            main_script_command += ['--checkpoint_every', str(args.checkpoint_every)]
+            if args.resume:
+                main_script_command.append('--resume')
+            if args.fast_resume:
+                main_script_command.append('--fast_resume')
             
-            result_data[video_number_str]['average_iou'] = average_iou
-            result_data[video_number_str]['frame_by_frame_iou'] = frame_ious
-            
-            with open(result_json_path, 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, indent=4)
-            
-            print(f"视频 {video_number_str} 的平均 IoU 为: {average_iou:.4f}")
-
-        except Exception as e:
-            print(f"错误: 在为视频 {video_number_str} 计算或追加 IoU 时失败: {e}")
-
-        if args.visualize:
-            annotated_video_path = os.path.join(args.output_dir, f"{video_number_str}_annotated.mp4")
-            visualize_command = [python_executable, 'src/visualize_results.py', '--video_path', video_path, '--json_path', result_json_path, '--output_path', annotated_video_path]
             try:
-                print(f"正在为视频 {video_number_str} 生成可视化结果...")
-                subprocess.run(visualize_command, check=True, capture_output=True, text=True, timeout=300)
-                print(f"可视化视频已生成: {annotated_video_path}")
+                subprocess.run(main_script_command, check=True, capture_output=True, text=True, timeout=300)
+                print(f"视频 {video_number_str} 处理完成，结果已保存至 {result_json_path}")
             except subprocess.CalledProcessError as e:
-                print(f"错误: 运行可视化脚本处理视频 {video_number_str} 时失败: {e.stderr}")
+                print(f"错误: 运行主脚本处理视频 {video_number_str} 时失败。")
+                print(f"标准错误: {e.stderr}")
+                continue # 跳过当前视频，继续处理下一个
+
+        finish_video(args, video_number_str, video_path, result_json_path, all_tasks_data, run_hash=run_hash)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="批量处理所有视频，计算IoU并进行可视化。")
     parser.add_argument('--videos_dir', type=str, default='sample_videos', help='存放所有输入视频的目录。')
     parser.add_argument('--main_json_path', type=str, default='sample_video.json', help='包含所有任务描述和真值的主JSON文件。')
-    parser.add_argument('--api_key', type=str, required=True, help='你的智谱AI API密钥。')
+    parser.add_argument('--api_key', type=str, default=None, help='你的智谱AI API密钥 (回放模式下可省略)。')
+    parser.add_argument('--refine_cache_dir', type=str, default='.cache/refine_query', help='查询精炼响应的磁盘缓存目录，传空字符串表示不使用缓存。')
+    parser.add_argument('--refine_cache_mb', type=float, default=64, help='查询精炼缓存的最大容量 (MB)，超出后按LRU淘汰。')
+    parser.add_argument('--replay', action='store_true', help='只从缓存回放精炼结果，不访问网络。')
+    parser.add_argument('--refine_model', type=str, default='glm-4v', help='查询精炼使用的智谱AI模型 (计入运行哈希)。')
+    parser.add_argument('--api_base_url', type=str, default=None, help='覆盖智谱AI API 的 base_url (例如指向本地桩服务 src/stub_api_server.py)。')
+    parser.add_argument('--async_refine', action='store_true', help='(需配合 --in_process) 预先并发精炼所有视频的查询，并按完成顺序流式地做检测与跟踪。')
+    parser.add_argument('--refine_concurrency', type=int, default=8, help='异步精炼时同时在途的请求数上限。')
+    parser.add_argument('--refine_rate', type=float, default=5.0, help='异步精炼时每秒最多发起的请求数 (<=0 表示不限速)。')
+    parser.add_argument('--refine_retries', type=int, default=3, help='异步精炼时单个请求失败后的最大重试次数。')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理视频的工作进程数 (>1 时启用进程池，每个进程各加载一次模型；配合 --detector_service 时共享服务端的一份模型)。')
+    add_detector_arguments(parser)
+    add_tracker_arguments(parser)
+    add_redetect_arguments(parser)
+    add_tracing_arguments(parser)
     parser.add_argument('--output_dir', type=str, default='output_batch', help='存放所有输出结果的目录。')
     parser.add_argument('--visualize', action='store_true', help='是否为每个视频生成带标注的可视化结果。')
+    parser.add_argument('--visualize_window_only', action='store_true', help='可视化时只导出有标注框的时间窗口。')
+    parser.add_argument('--in_process', action='store_true', help='在当前进程中只加载一次模型并复用于所有视频，而不是为每个视频启动子进程。')
+    parser.add_argument('--resume', action='store_true', help='对留有未完成结果日志的视频，从最后一个检查点继续处理 (跟踪器从检查点前最近一次初始化的帧开始重放，除 MIL 外结果与不中断的运行一致；重放区间的帧都要重新解码和跟踪，省下的只是检测器与API调用)。')
+    parser.add_argument('--fast_resume', action='store_true', help='配合 --resume: 不重放，在检查点帧上用检查点的框重新初始化跟踪器；恢复很快，但结果可能与不中断的运行不同。')
+    parser.add_argument('--checkpoint_every', type=int, default=300, help='每隔多少帧写一次检查点。')
+    parser.add_argument('--force', action='store_true', help='忽略已有结果的运行哈希，重新处理所有视频。')
     
     args = parser.parse_args()
     
     process_all_videos(args)
 
+    if args.trace_dir and os.path.isdir(args.trace_dir):
+        trace_summary_path = os.path.join(args.trace_dir, "summary.json")
+        with open(trace_summary_path, 'w', encoding='utf-8') as f:
+            json.dump(tracing.summarize_trace_dir(args.trace_dir), f, indent=4)
+        print(f"追踪指标汇总已保存至 {trace_summary_path}")
+
     print("\n--- 所有任务执行完毕 ---")
\ No newline at end of file
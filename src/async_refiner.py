@@ -0,0 +1,156 @@
+# src/async_refiner.py
+
+import asyncio
+import collections
+import queue
+import random
+import threading
+import time
+
+from PIL import Image
+
+from utils import VideoReader, convert_color, COLOR_BGR, COLOR_RGB
+
+# 一个待精炼的任务: 视频编号、视频路径、start帧编号、原始复杂查询
+RefineJob = collections.namedtuple('RefineJob', ['video_key', 'video_path', 'start_frame', 'query'])
+
+
+def _read_start_frame(video_path, frame_number):
+    """
+    用 VideoReader 读取 start 帧 (RGB)，与逐视频流程读到的是同一帧，失败时返回 None。
+    """
+    try:
+        video = VideoReader(video_path)
+    except IOError as e:
+        print(e)
+        return None
+    with video:
+        frame = video.read_frame(frame_number)
+    return convert_color(frame, COLOR_BGR, COLOR_RGB) if frame is not None else None
+
+
+class TokenBucket:
+    """
+    异步令牌桶限速器：平均每秒放行 rate 个请求，允许最多 capacity 个突发请求。
+    rate <= 0 表示不限速。
+    """
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncRefinementStage:
+    """
+    为整批视频并发地精炼查询，并按完成顺序把结果交给下游的检测/跟踪阶段。
+
+    底层复用 APIQueryRefiner 的缓存与请求逻辑 (同步 SDK 调用放到线程池中执行)，
+    在其之上增加并发上限、令牌桶限速和指数退避重试。
+    """
+    def __init__(self, refiner, concurrency: int = 8, rate: float = 5.0, max_retries: int = 3, backoff: float = 1.0):
+        """
+        Args:
+            refiner (APIQueryRefiner): 查询精炼器。
+            concurrency: 同时在途的 API 请求数上限。
+            rate: 每秒最多发起的 API 请求数 (<= 0 表示不限速)。
+            max_retries: 单个请求失败后的最大重试次数。
+            backoff: 首次重试前的等待秒数，之后每次翻倍并加入随机抖动。
+        """
+        self.refiner = refiner
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def _refine_one(self, job: RefineJob, semaphore: asyncio.Semaphore, bucket: TokenBucket):
+        frame_np = await asyncio.to_thread(_read_start_frame, job.video_path, job.start_frame)
+        if frame_np is None:
+            print(f"错误：无法读取视频 {job.video_key} 用于分析的start帧。")
+            return job, ""
+        base64_image = await asyncio.to_thread(self.refiner._encode_image_to_base64, Image.fromarray(frame_np))
+
+        cached = self.refiner.cached_phrase(base64_image, job.query)
+        if cached is not None:
+            return job, cached
+        if self.refiner.replay:
+            print(f"错误: 回放模式下缓存中没有视频 {job.video_key} 的响应。")
+            return job, ""
+
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await bucket.acquire()
+                try:
+                    refined_phrase = await asyncio.to_thread(self.refiner.request_phrase, base64_image, job.query)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        print(f"调用智谱AI API 精炼视频 {job.video_key} 的查询失败 (已重试 {attempt} 次): {e}")
+                        return job, ""
+                    delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                    print(f"视频 {job.video_key} 的精炼请求失败，{delay:.1f}s 后重试: {e}")
+                    await asyncio.sleep(delay)
+
+        await asyncio.to_thread(self.refiner.store_phrase, base64_image, job.query, refined_phrase)
+        print(f"视频 {job.video_key}: '{job.query}' 被精炼为 -> '{refined_phrase}'")
+        return job, refined_phrase
+
+    async def refine_all(self, jobs):
+        """
+        异步生成器：并发精炼所有任务，按完成顺序产出 (job, refined_phrase)。
+        失败的任务产出空字符串。
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.rate)
+        tasks = [asyncio.create_task(self._refine_one(job, semaphore, bucket)) for job in jobs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stream(self, jobs):
+        """
+        同步生成器：在后台线程的事件循环中运行 refine_all，
+        主线程可以一边拿到已完成的短语一边做检测与跟踪。
+        """
+        results = queue.Queue()
+        done = object()
+
+        async def _produce():
+            async for item in self.refine_all(jobs):
+                results.put(item)
+
+        def _run():
+            try:
+                asyncio.run(_produce())
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(done)
+
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        thread.join()
@@ -1,19 +1,20 @@
 # src/data_loader.py (Corrected version)
 
-import json
 import os
 import re
 
-def load_video_data(json_path: str, video_filename: str):
+from task_store import open_task_store
+
+def load_video_data(json_path: str, video_filename: str, videos_dir: str = "sample_videos"):
     """
     Loads configuration information for a specific video from the JSON task file,
-    including the target category.
+    including the target category. The returned video path is videos_dir/video_filename.
     """
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"Error: JSON task file not found at path: {json_path}")
 
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # 通过编译后的任务库按编号读取，避免每次都解析整个JSON文件
+    data = open_task_store(json_path)
 
     match = re.search(r'(\d+)', video_filename)
     if not match:
@@ -23,7 +24,7 @@ def load_video_data(json_path: str, video_filename: str):
     if video_key not in data:
         raise ValueError(f"Error: Key '{video_key}' matching video '{video_filename}' not found in JSON file '{os.path.basename(json_path)}'.")
 
-    task_info = data[video_key]
+    task_info = data.metadata(video_key)
 
     # Extract all necessary fields
     start_frame = task_info.get('temp_gt', {}).get('begin_fid')
@@ -35,7 +36,46 @@ def load_video_data(json_path: str, video_filename: str):
         raise ValueError(f"Error: Task information for video '{video_key}' is incomplete. Please ensure the JSON contains 'begin_fid', 'end_fid', 'description', and 'target_category'.")
 
     # The video path comes from the command-line arguments, not the JSON
-    video_path = os.path.join("sample_videos", video_filename)
+    video_path = os.path.join(videos_dir, video_filename)
 
     # Return all 5 values
-    return video_path, start_frame, end_frame, query, target_category
\ No newline at end of file
+    return video_path, start_frame, end_frame, query, target_category
+
+
+def load_video_tasks(json_path: str, video_filename: str, videos_dir: str = "sample_videos", task_keys=None):
+    """
+    Loads every task that refers to the same video, so that several queries can share one decode.
+
+    By default these are all tasks whose 'vid' field equals video_filename; when none match, the task
+    whose key is the numeric ID in the filename is used (as in load_video_data). task_keys selects the
+    tasks explicitly instead.
+
+    Returns:
+        tuple: (video_path, tasks), where tasks is a list of (task_key, start_frame, end_frame, query, target_category).
+    """
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"Error: JSON task file not found at path: {json_path}")
+
+    data = open_task_store(json_path)
+    if task_keys is None:
+        task_keys = data.keys_for_vid(video_filename)
+        if not task_keys:
+            match = re.search(r'(\d+)', video_filename)
+            task_keys = [match.group(1)] if match else []
+    if not task_keys:
+        raise ValueError(f"Error: No task in JSON file '{os.path.basename(json_path)}' refers to video '{video_filename}'.")
+
+    tasks = []
+    for task_key in task_keys:
+        if task_key not in data:
+            raise ValueError(f"Error: Task key '{task_key}' not found in JSON file '{os.path.basename(json_path)}'.")
+        task_info = data.metadata(task_key)
+        start_frame = task_info.get('temp_gt', {}).get('begin_fid')
+        end_frame = task_info.get('temp_gt', {}).get('end_fid')
+        query = task_info.get('sentence', {}).get('description')
+        target_category = task_info.get('target_category')
+        if any(info is None for info in [start_frame, end_frame, query, target_category]):
+            raise ValueError(f"Error: Task information for task '{task_key}' is incomplete. Please ensure the JSON contains 'begin_fid', 'end_fid', 'description', and 'target_category'.")
+        tasks.append((task_key, start_frame, end_frame, query, target_category))
+
+    return os.path.join(videos_dir, video_filename), tasks
@@ -0,0 +1,182 @@
+# src/detection_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import tracing
+from disk_cache import hash_key
+from run_manifest import file_digest
+from utils import best_box, redetect_window
+
+
+class DetectionCache:
+    """
+    按 (视频内容哈希、帧号、短语、模型、阈值、检测区域) 持久化保存逐帧检测的全部候选框与置信度。
+
+    存储为一个 SQLite 数据库 (WAL 模式)，多个进程/线程可以同时读写。每条记录把 K 个候选
+    打包为 K*5 个 float32 (xmin, ymin, xmax, ymax, score)，即每个候选 20 字节。
+    超出 max_bytes 时按最近使用时间 (LRU) 删除旧记录；为减少写入，命中时最多每 touch_interval 秒刷新一次使用时间。
+    删除后的空间由 SQLite 复用，数据库文件本身不会缩小。
+    """
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, touch_interval=60.0, evict_batch=1000):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'detections.sqlite')
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.evict_batch = evict_batch
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS detections ('
+                           'key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used)')
+        # 本进程写入的字节数达到上限的 1/20 时，才重新统计总大小并按需淘汰
+        self._unchecked_bytes = max_bytes
+
+    @staticmethod
+    def key(video_digest, frame_idx, text_prompt, model_id, box_threshold, text_threshold, region=None,
+            input_size=None):
+        """
+        region 为检测区域 (x0, y0, x1, y1)，整帧检测时为 None；input_size 为送入模型的最短边像素数。
+        """
+        return hash_key(video_digest, frame_idx, text_prompt, model_id, box_threshold, text_threshold, region, input_size)
+
+    def get(self, key):
+        """
+        返回缓存的 (boxes, scores)，未命中时返回 None。
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT data, last_used FROM detections WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.touch_interval:
+                self._conn.execute('UPDATE detections SET last_used = ? WHERE key = ?', (now, key))
+        packed = np.frombuffer(row[0], dtype=np.float32).reshape(-1, 5)
+        return packed[:, :4], packed[:, 4]
+
+    def put(self, key, candidates):
+        boxes, scores = candidates
+        data = np.concatenate([np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+                               np.asarray(scores, dtype=np.float32).reshape(-1, 1)], axis=1).tobytes()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO detections (key, data, size, last_used) VALUES (?, ?, ?, ?)',
+                               (key, data, len(data) + len(key), time.time()))
+            self._unchecked_bytes += len(data) + len(key)
+            if self._unchecked_bytes >= self.max_bytes / 20:
+                self._unchecked_bytes = 0
+                self._evict()
+
+    def _evict(self):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 一次淘汰到上限的 90%，避免每次写入都触发；每批最多 evict_batch 条、各自一个短事务，
+        # 不会长时间持有写锁阻塞其他进程
+        excess = total - int(self.max_bytes * 0.9)
+        while excess > 0:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                removed, count = self._conn.execute(
+                    'SELECT COALESCE(SUM(size), 0), COUNT(*) FROM '
+                    '(SELECT size FROM detections ORDER BY last_used LIMIT ?)', (self.evict_batch,)).fetchone()
+                self._conn.execute('DELETE FROM detections WHERE key IN '
+                                   '(SELECT key FROM detections ORDER BY last_used LIMIT ?)', (self.evict_batch,))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            if count == 0:
+                break
+            excess -= removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachingDetector:
+    """
+    在检测器外包一层 DetectionCache，接口与 Detector 相同；被包装的检测器需提供
+    detect_candidates (以及可选的 detect_prompt_candidates)。其他属性与方法直接转发给被包装的检测器。
+
+    缓存键需要视频与帧号：调用方处理每个视频前调用 begin_video(video_path)，
+    每帧开始时设置 frame_idx。frame_idx 为 None 时 (例如检测服务中) 不使用缓存。
+    """
+    def __init__(self, detector, cache):
+        self.detector = detector
+        self.cache = cache
+        self.model_id = f"{type(detector).__name__}:{detector.model_path}:quantize={getattr(detector, 'quantize', False)}"
+        self.video_digest = None
+        self.frame_idx = None
+
+    def __getattr__(self, name):
+        return getattr(self.detector, name)
+
+    def begin_video(self, video_path):
+        self.video_digest = file_digest(video_path)
+        self.frame_idx = None
+
+    def _key(self, text_prompt, region=None, input_size=None):
+        return DetectionCache.key(self.video_digest, self.frame_idx, text_prompt, self.model_id,
+                                  self.detector.box_threshold, self.detector.text_threshold, region, input_size)
+
+    def _cached(self, frame, text_prompt, color_space, region=None, input_size=None):
+        """
+        返回一个区域的检测候选，未命中时调用检测器并写入缓存。
+        """
+        if self.frame_idx is None or self.video_digest is None:
+            return self.detector.detect_candidates([frame], text_prompt, color_space, input_size=input_size)[0]
+        key = self._key(text_prompt, region, input_size)
+        candidates = self.cache.get(key)
+        if candidates is not None:
+            tracing.count("detection_cache_hits")
+            return candidates
+        tracing.count("detection_cache_misses")
+        candidates = self.detector.detect_candidates([frame], text_prompt, color_space, input_size=input_size)[0]
+        self.cache.put(key, candidates)
+        return candidates
+
+    @tracing.traced("detector.detect_object")
+    def detect_object(self, frame, text_prompt, color_space="BGR"):
+        return best_box(self._cached(frame, text_prompt, color_space))
+
+    def detect_prompts(self, frame, text_prompts, color_space="BGR"):
+        """
+        只对未命中的短语做一次合并检测 (detect_prompt_candidates)，命中的直接取缓存。
+        """
+        if self.frame_idx is None or self.video_digest is None:
+            return self.detector.detect_prompts(frame, text_prompts, color_space)
+        keys = [self._key(text_prompt) for text_prompt in text_prompts]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, candidates in enumerate(results) if candidates is None]
+        tracing.count("detection_cache_hits", len(text_prompts) - len(missing))
+        if missing:
+            tracing.count("detection_cache_misses", len(missing))
+            if len(missing) > 1 and hasattr(self.detector, 'detect_prompt_candidates'):
+                fresh = self.detector.detect_prompt_candidates(frame, [text_prompts[i] for i in missing], color_space)
+            else:
+                fresh = [self.detector.detect_candidates([frame], text_prompts[i], color_space)[0] for i in missing]
+            for i, candidates in zip(missing, fresh):
+                self.cache.put(keys[i], candidates)
+                results[i] = candidates
+        return [best_box(candidates) for candidates in results]
+
+    @tracing.traced("detector.redetect")
+    def redetect(self, frame, text_prompt, bbox_hint, color_space="BGR", expand=2.0, input_size=400):
+        """
+        与 Detector.redetect 相同：窗口检测与整帧检测分别按各自的区域缓存。
+        """
+        window = redetect_window(frame.shape, bbox_hint, expand) if bbox_hint is not None else None
+        if window is not None:
+            x0, y0, x1, y1 = window
+            local_bbox = best_box(self._cached(frame[y0:y1, x0:x1], text_prompt, color_space, window, input_size))
+            if local_bbox is not None:
+                lcx, lcy, lw, lh = local_bbox
+                return (lcx + x0, lcy + y0, lw, lh)
+        return self.detect_object(frame, text_prompt, color_space)
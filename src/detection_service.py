@@ -0,0 +1,395 @@
+# src/detection_service.py
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import tracing
+from utils import redetect_window
+
+
+class _Request:
+    __slots__ = ('frame', 'key', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, frame, key):
+        self.frame = frame
+        self.key = key
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """
+    把来自多个客户端的单帧检测请求合并成批次，交给同一个常驻的检测器。
+
+    后台线程取出队首请求后，最多再等待 max_wait_ms (从队首请求入队时算起) 凑够 max_batch 个请求；
+    队列中已有积压时不再等待。批次内按 (短语, 颜色空间, 输入尺寸) 分组，每组调用一次 detect_objects。
+    """
+    def __init__(self, detector, max_batch=8, max_wait_ms=10.0, latency_window=2048):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = collections.Counter()
+        self._queue_wait = collections.deque(maxlen=latency_window)
+        self._inference = collections.deque(maxlen=latency_window)
+        self._total = collections.deque(maxlen=latency_window)
+        self._thread = threading.Thread(target=self._run, name='detection-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, text_prompt, color_space="BGR", input_size=None, timeout=None):
+        """
+        提交一帧并阻塞等待结果。
+
+        Returns:
+            (cx, cy, w, h) 或 None。
+        """
+        request = _Request(frame, (text_prompt, color_space, input_size))
+        self._queue.put(request)
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        if not request.done.wait(timeout):
+            raise TimeoutError("检测请求等待超时")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """
+        取出一个批次；收到关闭信号时返回 None。
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                # 先处理完手上的批次，再让下一轮退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = collections.defaultdict(list)
+            for request in batch:
+                groups[request.key].append(request)
+
+            for (text_prompt, color_space, input_size), requests in groups.items():
+                start = time.perf_counter()
+                try:
+                    with tracing.span("service.batch", size=len(requests)):
+                        results = self.detector.detect_objects([r.frame for r in requests], text_prompt,
+                                                               color_space, input_size=input_size)
+                except Exception as e:
+                    results, error = [None] * len(requests), e
+                else:
+                    error = None
+                end = time.perf_counter()
+
+                for request, result in zip(requests, results):
+                    request.result, request.error = result, error
+                    request.frame = None
+                    request.done.set()
+                with self._lock:
+                    self._requests += len(requests)
+                    self._batches += 1
+                    self._errors += len(requests) if error is not None else 0
+                    self._batch_sizes[len(requests)] += 1
+                    self._inference.append(end - start)
+                    for request in requests:
+                        self._queue_wait.append(start - request.enqueued)
+                        self._total.append(end - request.enqueued)
+
+    def metrics(self):
+        """
+        返回队列深度、批次大小分布与延迟分位数 (毫秒，基于最近的请求)。
+        """
+        def summary(values):
+            if not values:
+                return None
+            arr = np.asarray(values) * 1000
+            return {"mean": float(arr.mean()), "p50": float(np.percentile(arr, 50)),
+                    "p95": float(np.percentile(arr, 95)), "p99": float(np.percentile(arr, 99)),
+                    "max": float(arr.max())}
+
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self._started,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "errors": self._errors,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_sizes": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_wait_ms": summary(list(self._queue_wait)),
+                "inference_ms": summary(list(self._inference)),
+                "latency_ms": summary(list(self._total)),
+            }
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect?prompt=..&height=..&width=..&channels=..[&color_space=..&input_size=..]
+        请求体为帧的原始 uint8 像素 (行优先)，返回 {"bbox": [cx, cy, w, h] 或 null}。
+    GET /metrics   返回 DynamicBatcher.metrics()。
+    GET /health    返回检测器配置。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path.rstrip('/')
+        if path == '/metrics':
+            self._reply(200, self.server.batcher.metrics())
+        elif path == '/health':
+            self._reply(200, self.server.service_info)
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path.rstrip('/') != '/detect':
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+        try:
+            params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+            shape = (int(params['height']), int(params['width']), int(params.get('channels', 3)))
+            frame = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+            input_size = int(params['input_size']) if params.get('input_size') else None
+            prompt = params['prompt']
+        except (KeyError, ValueError) as e:
+            self._reply(400, {"error": f"bad request: {e}"})
+            return
+
+        try:
+            bbox = self.server.batcher.submit(frame, prompt, params.get('color_space', 'BGR'), input_size)
+        except Exception as e:
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, {"bbox": list(bbox) if bbox is not None else None})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的 listen 队列 (5) 在很多客户端同时连接时会拒绝连接
+    request_queue_size = 128
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        # BaseHTTPRequestHandler 期望 client_address 是 (host, port)
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def start_detection_service(detector, address='127.0.0.1:8765', max_batch=8, max_wait_ms=10.0, service_info=None):
+    """
+    在后台线程中启动检测服务，返回 server。用完后调用 server.shutdown() 与 server.batcher.close()。
+
+    Args:
+        address: 'host:port' 监听本机 TCP 端口 (端口为 0 时自动分配)；'unix:/path/to.sock' 监听 Unix 套接字。
+        service_info: /health 返回的附加信息 (例如检测器配置)。
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            os.remove(path)
+        server = _UnixHTTPServer(path, _ServiceHandler)
+        server.address = address
+    else:
+        host, port = address.rsplit(':', 1)
+        server = _TCPHTTPServer((host, int(port)), _ServiceHandler)
+        server.address = f"{server.server_address[0]}:{server.server_address[1]}"
+    server.batcher = DynamicBatcher(detector, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    server.service_info = dict(service_info or {}, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class RemoteDetector:
+    """
+    检测服务的客户端，接口与 Detector 相同 (detect_object / detect_objects / redetect)，
+    可以直接传给 process_video。本身不加载模型，也不依赖 torch。
+
+    每个线程保持一条长连接；detect_objects 的多帧会并发提交，由服务端合并成批次。
+    """
+    def __init__(self, address='127.0.0.1:8765', timeout=300.0):
+        if address.startswith('http://'):
+            address = address[len('http://'):].rstrip('/')
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pool = None
+        self.info = self._request('GET', '/health')
+        print(f"已连接检测服务 {address}: {self.info}")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.address.startswith('unix:'):
+                conn = _UnixHTTPConnection(self.address[len('unix:'):], timeout=self.timeout)
+            else:
+                host, port = self.address.rsplit(':', 1)
+                conn = http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, body=None):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body,
+                             headers={'Content-Type': 'application/octet-stream'} if body is not None else {})
+                response = conn.getresponse()
+                payload = json.loads(response.read())
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # 服务端关闭了空闲连接: 重连一次
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"检测服务返回错误 {response.status}: {payload.get('error')}")
+        return payload
+
+    def metrics(self):
+        return self._request('GET', '/metrics')
+
+    @tracing.traced("detector.detect_object")
+    def detect_object(self, frame, text_prompt, color_space="BGR", input_size=None):
+        if not isinstance(text_prompt, str) or not text_prompt:
+            print(f"警告: 传入了无效的文本提示 '{text_prompt}'，跳过检测。")
+            return None
+        tracing.count("detector_calls")
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        params = {"prompt": text_prompt, "color_space": color_space,
+                  "height": frame.shape[0], "width": frame.shape[1],
+                  "channels": frame.shape[2] if frame.ndim == 3 else 1}
+        if input_size:
+            params["input_size"] = input_size
+        payload = self._request('POST', '/detect?' + urllib.parse.urlencode(params), body=frame.tobytes())
+        bbox = payload.get('bbox')
+        return tuple(bbox) if bbox is not None else None
+
+    def detect_objects(self, frames, text_prompt, color_space="BGR", input_size=None):
+        if len(frames) <= 1:
+            return [self.detect_object(frame, text_prompt, color_space, input_size) for frame in frames]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='remote-detector')
+        return list(self._pool.map(lambda frame: self.detect_object(frame, text_prompt, color_space, input_size),
+                                   frames))
+
+    @tracing.traced("detector.redetect")
+    def redetect(self, frame, text_prompt, bbox_hint, color_space="BGR", expand=2.0, input_size=400):
+        """
+        与 Detector.redetect 相同：先在提示框周围的窗口内以较小输入尺寸检测，失败再整帧检测。
+        """
+        window = redetect_window(frame.shape, bbox_hint, expand) if bbox_hint is not None else None
+        if window is not None:
+            x0, y0, x1, y1 = window
+            local_bbox = self.detect_object(frame[y0:y1, x0:x1], text_prompt, color_space, input_size=input_size)
+            if local_bbox is not None:
+                lcx, lcy, lw, lh = local_bbox
+                return (lcx + x0, lcy + y0, lw, lh)
+        return self.detect_object(frame, text_prompt, color_space)
+
+
+if __name__ == '__main__':
+    from detector_backends import add_detector_arguments, build_detector, detector_config
+
+    parser = argparse.ArgumentParser(description="常驻的 Grounding DINO 检测服务: 多个客户端共享一份已加载的模型，并发请求动态合并成批次。")
+    parser.add_argument('--address', type=str, default='127.0.0.1:8765',
+                        help="监听地址: 'host:port' (本机 HTTP) 或 'unix:/path/to.sock' (Unix 套接字)")
+    parser.add_argument('--max_batch', type=int, default=8, help='每个批次最多合并的请求数')
+    parser.add_argument('--max_wait_ms', type=float, default=10.0, help='凑批次时队首请求最多等待的毫秒数')
+    parser.add_argument('--metrics_every', type=float, default=60.0, help='每隔多少秒打印一次队列与延迟指标 (<=0 表示不打印)')
+    add_detector_arguments(parser)
+
+    args = parser.parse_args()
+    if args.detector_service:
+        parser.error('检测服务本身不能再使用 --detector_service。')
+
+    detector = build_detector(args)
+    server = start_detection_service(detector, args.address, args.max_batch, args.max_wait_ms,
+                                     service_info={"detector": detector_config(args)})
+    print(f"检测服务已启动: {server.address} (max_batch={args.max_batch}, max_wait_ms={args.max_wait_ms})")
+    try:
+        while True:
+            time.sleep(args.metrics_every if args.metrics_every > 0 else 3600)
+            if args.metrics_every > 0:
+                print(json.dumps(server.batcher.metrics(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        print("\n正在关闭检测服务...")
+    finally:
+        server.shutdown()
+        server.batcher.close()
@@ -3,75 +3,294 @@
 import torch
 from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
 from PIL import Image
-import supervision as sv
 import numpy as np
 import cv2
+from collections import OrderedDict
+from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
+
+import tracing
+from utils import best_box, empty_candidates, redetect_window
+
+
+class _CachedTextBackbone(torch.nn.Module):
+    """
+    包装 Grounding DINO 的文本编码器 (BERT)，按 token 序列缓存其输出。
+    同一短语在整段视频中保持不变，命中缓存后每帧只需运行图像分支。
+    """
+    def __init__(self, backbone: torch.nn.Module, max_size: int):
+        super().__init__()
+        self.backbone = backbone
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None, position_ids=None, **kwargs):
+        # 只有整个批次共用同一短语时才能复用缓存
+        if not bool((input_ids == input_ids[:1]).all()):
+            return self.backbone(input_ids, attention_mask, token_type_ids, position_ids, **kwargs)
+
+        key = tuple(input_ids[0].tolist())
+
+        hidden = self._cache.get(key)
+        if hidden is None:
+            outputs = self.backbone(input_ids[:1],
+                                    None if attention_mask is None else attention_mask[:1],
+                                    None if token_type_ids is None else token_type_ids[:1],
+                                    None if position_ids is None else position_ids[:1],
+                                    **kwargs)
+            hidden = outputs[0].detach()
+            self._cache[key] = hidden
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+
+        return BaseModelOutputWithPoolingAndCrossAttentions(
+            last_hidden_state=hidden.expand(input_ids.shape[0], -1, -1))
+
+
+class _SharedImageBackbone(torch.nn.Module):
+    """
+    包装 Grounding DINO 的图像骨干网络 (Swin + 位置编码)。
+    批次内所有图像相同 (同一帧配多个短语，见 Detector.detect_prompts) 时只计算一次，再沿批次维复制。
+    """
+    def __init__(self, backbone: torch.nn.Module):
+        super().__init__()
+        self.backbone = backbone
+
+    def __getattr__(self, name):
+        # 模型还会直接访问骨干网络的子模块 (例如额外特征层用到的 position_embedding)
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.backbone, name)
+
+    def forward(self, pixel_values, pixel_mask):
+        batch = pixel_values.shape[0]
+        if batch == 1 or not bool((pixel_values == pixel_values[:1]).all() and (pixel_mask == pixel_mask[:1]).all()):
+            return self.backbone(pixel_values, pixel_mask)
+        return _repeat_batch(self.backbone(pixel_values[:1], pixel_mask[:1]), batch)
+
+
+def _repeat_batch(value, batch):
+    """
+    把 (嵌套的 list/tuple 中的) 张量沿批次维复制 batch 份。
+    """
+    if isinstance(value, torch.Tensor):
+        return value.repeat(batch, *([1] * (value.dim() - 1)))
+    if isinstance(value, (list, tuple)):
+        return type(value)(_repeat_batch(v, batch) for v in value)
+    return value
+
 
 class Detector:
-    def __init__(self, model_path='IDEA-Research/grounding-dino-base'):
+    def __init__(self, model_path='IDEA-Research/grounding-dino-base', text_cache_size=32,
+                 box_threshold=0.3, text_threshold=0.3):
         """
         使用Hugging Face Transformers库初始化Grounding DINO模型。
+
+        Args:
+            model_path: Hugging Face 模型名称或本地路径。
+            text_cache_size: 按短语缓存的分词结果与文本特征的最大条目数 (LRU)。
+            box_threshold: 框置信度阈值，低于该值的检测结果被丢弃。
+            text_threshold: 文本匹配阈值。
+        """
+        self.model_path = model_path
+        self.box_threshold = box_threshold
+        self.text_threshold = text_threshold
+        self.text_cache_size = text_cache_size
+        self._text_inputs_cache = OrderedDict()
+        self._load_model()
+
+    def _load_model(self):
+        """
+        加载处理器与模型 (其他后端重写此方法)。
         """
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         print(f"Grounding DINO 检测器将在 {self.device} 上运行。")
         
         try:
-            self.processor = AutoProcessor.from_pretrained(model_path)
-            self.model = AutoModelForZeroShotObjectDetection.from_pretrained(model_path).to(self.device)
+            self.processor = AutoProcessor.from_pretrained(self.model_path)
+            self.model = AutoModelForZeroShotObjectDetection.from_pretrained(self.model_path).to(self.device)
             print("Grounding DINO 模型初始化完成。")
         except Exception as e:
-            print(f"错误：加载Grounding DINO模型失败。请检查网络连接和模型路径 '{model_path}'。")
+            print(f"错误：加载Grounding DINO模型失败。请检查网络连接和模型路径 '{self.model_path}'。")
             print(f"详细错误: {e}")
             raise
 
-    def detect_object(self, frame: np.ndarray, text_prompt: str) -> tuple[int, int, int, int] | None:
+        grounding_model = getattr(self.model, 'model', None)
+        if grounding_model is not None and hasattr(grounding_model, 'text_backbone'):
+            grounding_model.text_backbone = _CachedTextBackbone(grounding_model.text_backbone, self.text_cache_size)
+        if grounding_model is not None and hasattr(grounding_model, 'backbone'):
+            grounding_model.backbone = _SharedImageBackbone(grounding_model.backbone)
+
+    def _encode_text(self, text_prompt: str) -> dict:
+        """
+        返回短语的分词结果 (已放到目标设备上)，按短语做 LRU 缓存。
+        """
+        text_inputs = self._text_inputs_cache.get(text_prompt)
+        if text_inputs is None:
+            text_inputs = dict(self.processor(text=text_prompt, return_tensors="pt").to(self.device))
+            self._text_inputs_cache[text_prompt] = text_inputs
+            if len(self._text_inputs_cache) > self.text_cache_size:
+                self._text_inputs_cache.popitem(last=False)
+        else:
+            self._text_inputs_cache.move_to_end(text_prompt)
+        return text_inputs
+
+    @tracing.traced("detector.detect_object")
+    def detect_object(self, frame: np.ndarray, text_prompt: str, color_space: str = "BGR") -> tuple[int, int, int, int] | None:
         """
         使用 Grounding DINO 检测与文本短语匹配的物体。
         """
-        # print(text_prompt)
-        text_prompt=" a red ukulele"
+        return self.detect_objects([frame], text_prompt, color_space)[0]
+
+    def detect_objects(self, frames: list[np.ndarray], text_prompt: str, color_space: str = "BGR",
+                       input_size: int | None = None) -> list[tuple[int, int, int, int] | None]:
+        """
+        批量检测，返回每帧的最佳框 (参数见 detect_candidates)。
+
+        Returns:
+            与 frames 一一对应的列表，每个元素为 (cx, cy, w, h) 或 None。
+        """
+        return [best_box(candidates) for candidates in self.detect_candidates(frames, text_prompt, color_space, input_size)]
+
+    def detect_candidates(self, frames: list[np.ndarray], text_prompt: str, color_space: str = "BGR",
+                          input_size: int | None = None) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        批量检测：将 N 帧堆叠为一个填充后的张量，只做一次前向推理，再统一后处理。
+
+        Args:
+            frames: 待检测的帧列表，尺寸可以不同（处理器会填充到同一大小）。
+            text_prompt: 所有帧共用的文本短语。
+            color_space: 输入帧的颜色空间 ("BGR" 或 "RGB")，只有 BGR 帧才会被转换一次。
+            input_size: 送入模型的最短边像素数，默认使用处理器配置 (800)；较小的值推理更快。
+
+        Returns:
+            与 frames 一一对应的列表，每个元素为超过阈值的全部候选 (boxes, scores)：
+            boxes 为 (K, 4) 的 (xmin, ymin, xmax, ymax)，scores 为 (K,)，均为 float32，保持后处理输出的顺序。
+        """
+        if not frames:
+            return []
         if not isinstance(text_prompt, str) or not text_prompt:
             print(f"警告: 传入了无效的文本提示 '{text_prompt}'，跳过检测。")
-            return None
-            
-        image_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        inputs = self.processor(images=image_pil, text=text_prompt, return_tensors="pt").to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            
+            return [empty_candidates() for _ in frames]
+        tracing.count("detector_calls")
+
+        if color_space == "BGR":
+            images_pil = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in frames]
+        else:
+            images_pil = [Image.fromarray(frame) for frame in frames]
+        size_kwargs = {"size": {"shortest_edge": input_size, "longest_edge": input_size * 1333 // 800}} if input_size else {}
+        inputs = dict(self.processor.image_processor(images=images_pil, return_tensors="pt", **size_kwargs).to(self.device))
+        for name, tensor in self._encode_text(text_prompt).items():
+            inputs[name] = tensor.expand(len(images_pil), -1)
+
+        outputs = self._forward(inputs)
+
         results = self.processor.post_process_grounded_object_detection(
             outputs,
-            inputs.input_ids,
-            box_threshold=0.3,
-            text_threshold=0.3,
-            target_sizes=[image_pil.size[::-1]]
-        )[0] # 取出第一张（也是唯一一张）图片的结果
-        
-        # 确保有检测结果，results["scores"]的元素数量不为0
-        if results["scores"].nelement() == 0:
-            return None
-
-        # --- 核心修改：手动从 results 字典中提取数据来创建 Detections 对象 ---
-        # 将 PyTorch Tensors 转换为 NumPy 数组
-        boxes = results["boxes"].cpu().numpy()
-        scores = results["scores"].cpu().numpy()
-        
-        # 使用这些NumPy数组直接创建 Detections 对象，绕过不兼容的 from_transformers 函数
-        detections = sv.Detections(xyxy=boxes, confidence=scores)
-        # -----------------------------------------------------------------
-
-        if len(detections) > 0:
-            # supervision 会根据置信度自动排序，我们取第一个
-            best_box_xyxy = detections.xyxy[0]
-            
-            # 将 xyxy 格式 [xmin, ymin, xmax, ymax] 转换为中心点 xywh 格式
-            xmin, ymin, xmax, ymax = best_box_xyxy
-            width = xmax - xmin
-            height = ymax - ymin
-            x_center = xmin + width / 2
-            y_center = ymin + height / 2
-            
-            return (int(x_center), int(y_center), int(width), int(height))
-            
-        return None
\ No newline at end of file
+            inputs["input_ids"],
+            box_threshold=self.box_threshold,
+            text_threshold=self.text_threshold,
+            target_sizes=[image_pil.size[::-1] for image_pil in images_pil]
+        )
+
+        return [self._candidates(result) for result in results]
+
+    def detect_prompts(self, frame: np.ndarray, text_prompts: list[str],
+                       color_space: str = "BGR") -> list[tuple[int, int, int, int] | None]:
+        """
+        在同一帧上同时检测多个短语，返回每个短语的最佳框 (见 detect_prompt_candidates)。
+
+        Returns:
+            与 text_prompts 一一对应的列表，每个元素为 (cx, cy, w, h) 或 None。
+        """
+        return [best_box(candidates) for candidates in self.detect_prompt_candidates(frame, text_prompts, color_space)]
+
+    def detect_prompt_candidates(self, frame: np.ndarray, text_prompts: list[str],
+                                 color_space: str = "BGR") -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        在同一帧上同时检测多个短语：图像沿批次维复制、各短语的分词结果补齐到同一长度后只做一次前向推理，
+        其中图像骨干网络只计算一次 (见 _SharedImageBackbone)。
+
+        Returns:
+            与 text_prompts 一一对应的候选 (boxes, scores) 列表，格式同 detect_candidates。
+        """
+        if not text_prompts:
+            return []
+        if any(not isinstance(p, str) or not p for p in text_prompts):
+            print(f"警告: 传入了无效的文本提示 {text_prompts}，跳过检测。")
+            return [empty_candidates() for _ in text_prompts]
+        tracing.count("detector_calls")
+
+        if color_space == "BGR":
+            image_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        else:
+            image_pil = Image.fromarray(frame)
+        num_prompts = len(text_prompts)
+        inputs = dict(self.processor.image_processor(images=[image_pil], return_tensors="pt").to(self.device))
+        for name, tensor in inputs.items():
+            inputs[name] = tensor.expand(num_prompts, *tensor.shape[1:])
+
+        # 补齐的位置不属于任何短语，attention_mask 为 0，不影响其他 token 的文本特征与检测结果
+        text_inputs = [self._encode_text(text_prompt) for text_prompt in text_prompts]
+        max_len = max(t["input_ids"].shape[1] for t in text_inputs)
+        for name in text_inputs[0]:
+            pad_value = self.processor.tokenizer.pad_token_id if name == "input_ids" else 0
+            inputs[name] = torch.cat([torch.nn.functional.pad(t[name], (0, max_len - t[name].shape[1]), value=pad_value)
+                                      for t in text_inputs])
+
+        outputs = self._forward(inputs)
+
+        results = self.processor.post_process_grounded_object_detection(
+            outputs,
+            inputs["input_ids"],
+            box_threshold=self.box_threshold,
+            text_threshold=self.text_threshold,
+            target_sizes=[image_pil.size[::-1]] * num_prompts
+        )
+
+        return [self._candidates(result) for result in results]
+
+    def _forward(self, inputs: dict):
+        """
+        运行一次前向推理，返回带 logits 与 pred_boxes 的模型输出 (其他后端重写此方法)。
+        """
+        with torch.no_grad():
+            return self.model(**inputs)
+
+    @tracing.traced("detector.redetect")
+    def redetect(self, frame: np.ndarray, text_prompt: str, bbox_hint: tuple[int, int, int, int] | None,
+                 color_space: str = "BGR", expand: float = 2.0, input_size: int = 400) -> tuple[int, int, int, int] | None:
+        """
+        跟踪失败后的重检：先在提示框 (上一次位置或运动预测位置) 周围的扩展窗口内、
+        以较小的输入尺寸检测；窗口内没有超过 box_threshold 的结果时再退回整帧检测。
+
+        Args:
+            bbox_hint: 提示框 (cx, cy, w, h)，为 None 时直接整帧检测。
+            expand: 窗口在提示框四周各扩展的框尺寸倍数。
+            input_size: 窗口检测时送入模型的最短边像素数。
+
+        Returns:
+            原始帧坐标系下的 (cx, cy, w, h)，或 None。
+        """
+        # 窗口已接近整帧时 redetect_window 返回 None，直接整帧检测
+        window = redetect_window(frame.shape, bbox_hint, expand) if bbox_hint is not None else None
+        if window is not None:
+            x0, y0, x1, y1 = window
+            crop = frame[y0:y1, x0:x1]
+            local_bbox = self.detect_objects([crop], text_prompt, color_space, input_size=input_size)[0]
+            if local_bbox is not None:
+                lcx, lcy, lw, lh = local_bbox
+                return (lcx + x0, lcy + y0, lw, lh)
+
+        return self.detect_object(frame, text_prompt, color_space)
+
+    @staticmethod
+    def _candidates(results) -> tuple[np.ndarray, np.ndarray]:
+        """
+        把单张图片的后处理结果转换为 (boxes, scores) 两个 float32 数组。
+        """
+        boxes = results["boxes"].detach().cpu().numpy().astype(np.float32).reshape(-1, 4)
+        scores = results["scores"].detach().cpu().numpy().astype(np.float32).reshape(-1)
+        return boxes, scores
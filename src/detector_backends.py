@@ -0,0 +1,68 @@
+# src/detector_backends.py
+
+from run_manifest import DETECTOR_CONFIG
+
+# 检测器后端: torch 为 PyTorch (有 GPU 时使用 GPU)，onnx 为 CPU 上的 ONNX Runtime
+DETECTOR_BACKENDS = ('torch', 'onnx')
+
+
+def add_detector_arguments(parser):
+    """
+    注册检测器后端相关的命令行参数 (main_llm.py 与 run_all_videos.py 共用)。
+    """
+    parser.add_argument('--detector_backend', type=str, default='torch', choices=DETECTOR_BACKENDS,
+                        help='检测器后端: torch 为 PyTorch (有 GPU 时使用 GPU); onnx 为 CPU 上的 ONNX Runtime')
+    parser.add_argument('--onnx_quantize', action='store_true', help='onnx 后端使用动态 int8 量化的模型')
+    parser.add_argument('--onnx_cache_dir', type=str, default='.cache/onnx', help='导出的 ONNX 模型缓存目录')
+    parser.add_argument('--detector_service', type=str, default=None,
+                        help="使用常驻检测服务 (src/detection_service.py) 而不在本进程加载模型，"
+                             "例如 127.0.0.1:8765 或 unix:/tmp/detector.sock")
+    parser.add_argument('--detection_cache_dir', type=str, default='.cache/detections',
+                        help='逐帧检测结果的磁盘缓存目录 (按视频内容、帧号、短语、模型与阈值索引)，传空字符串表示不使用缓存')
+    parser.add_argument('--detection_cache_mb', type=float, default=256, help='检测缓存的最大容量 (MB)，超出后按LRU淘汰')
+
+
+def detector_arguments_to_argv(args):
+    """
+    把已解析的检测器参数还原为命令行参数列表，用于转发给子进程。
+    """
+    argv = ['--detector_backend', args.detector_backend, '--onnx_cache_dir', args.onnx_cache_dir]
+    if args.onnx_quantize:
+        argv.append('--onnx_quantize')
+    if args.detector_service:
+        argv += ['--detector_service', args.detector_service]
+    argv += ['--detection_cache_dir', args.detection_cache_dir, '--detection_cache_mb', str(args.detection_cache_mb)]
+    return argv
+
+
+def detector_config(args):
+    """
+    影响检测结果的检测器配置 (计入运行哈希)。使用检测服务时以服务端的后端为准，这里只记录使用了服务。
+    """
+    if args.detector_service:
+        return dict(DETECTOR_CONFIG, backend='service')
+    config = dict(DETECTOR_CONFIG, backend=args.detector_backend)
+    if args.detector_backend == 'onnx':
+        config['quantize'] = args.onnx_quantize
+    return config
+
+
+def build_detector(args):
+    """
+    按命令行参数构建检测器。延迟导入，只有真正需要时才加载 torch/onnxruntime。
+    设置了 --detection_cache_dir 时，本地检测器外包一层 CachingDetector (检测服务的结果不在客户端缓存)。
+    """
+    if args.detector_service:
+        from detection_service import RemoteDetector
+        return RemoteDetector(args.detector_service)
+    if args.detector_backend == 'onnx':
+        from onnx_detector import OnnxDetector
+        detector = OnnxDetector(**DETECTOR_CONFIG, cache_dir=args.onnx_cache_dir, quantize=args.onnx_quantize)
+    else:
+        from detector import Detector
+        detector = Detector(**DETECTOR_CONFIG)
+    if args.detection_cache_dir:
+        from detection_cache import CachingDetector, DetectionCache
+        detector = CachingDetector(detector, DetectionCache(args.detection_cache_dir,
+                                                            max_bytes=int(args.detection_cache_mb * 1024 * 1024)))
+    return detector
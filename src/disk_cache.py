@@ -0,0 +1,92 @@
+# src/disk_cache.py
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+def hash_key(*parts) -> str:
+    """
+    将若干字符串/字节片段哈希为缓存键 (SHA-256 十六进制)。
+    各片段之间带长度前缀，避免不同切分方式拼出相同的键。
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        h.update(len(data).to_bytes(8, 'little'))
+        h.update(data)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    基于目录的持久化 JSON 缓存，每个键一个文件，按总大小做 LRU 淘汰。
+
+    最近使用时间记录在文件的 mtime 上：命中时刷新 mtime，
+    超出 max_bytes 时从最久未使用的条目开始删除。
+    read_only=True 时为回放模式，只读不写，也不修改任何文件。
+    """
+    def __init__(self, cache_dir: str, max_bytes: int = 64 * 1024 * 1024, read_only: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        """
+        返回缓存的值，未命中时返回 None。
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not self.read_only:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return value
+
+    def put(self, key: str, value) -> None:
+        """
+        写入一个条目 (先写临时文件再原子替换)，然后按需淘汰旧条目。
+        """
+        if self.read_only:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
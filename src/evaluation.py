@@ -0,0 +1,134 @@
+# src/evaluation.py
+
+import glob
+import json
+import os
+
+import numpy as np
+
+from iou_calculator import batch_iou, boxes_to_array
+
+# 成功率曲线的 IoU 阈值 (0, 0.05, ..., 1.0)
+DEFAULT_IOU_THRESHOLDS = np.linspace(0.0, 1.0, 21)
+
+
+def load_run(path):
+    """
+    读取一次运行的所有结果。
+
+    Args:
+        path (str): 结果目录 (读取其中的 *_result.json) 或单个结果JSON文件。
+
+    Returns:
+        dict: {video_key: pred_bboxs}
+    """
+    files = sorted(glob.glob(os.path.join(path, '*_result.json'))) if os.path.isdir(path) else [path]
+    run = {}
+    for result_path in files:
+        try:
+            with open(result_path, 'r', encoding='utf-8') as f:
+                results_data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"警告: 无法读取结果文件 {result_path}: {e}")
+            continue
+        for video_key, entry in results_data.items():
+            if isinstance(entry, dict) and 'pred_bboxs' in entry:
+                run[video_key] = entry['pred_bboxs']
+    return run
+
+
+def _align(run, all_tasks_data, video_keys):
+    """
+    把所有视频的预测框按真值帧对齐并拼接成一张大表，每个视频占连续的一段行。
+
+    Returns:
+        tuple: (keys, offsets, pred, has_pred, gt, outside)。outside 为每个视频落在真值区间之外的预测帧数。
+    """
+    keys, offsets, gt_chunks, outside = [], [], [], []
+    pred_rows, pred_boxes = [], []
+    total = 0
+    for video_key in video_keys:
+        gt = all_tasks_data.gt_boxes(video_key)
+        begin_fid = all_tasks_data.metadata(video_key).get('temp_gt', {}).get('begin_fid')
+        if len(gt) == 0 or begin_fid is None:
+            continue
+        pred_bboxs = run.get(video_key, {})
+        frame_idx = np.fromiter((int(k) for k in pred_bboxs), dtype=np.int64, count=len(pred_bboxs)) - begin_fid
+        arr, mask = boxes_to_array(list(pred_bboxs.values()))
+        inside = mask & (frame_idx >= 0) & (frame_idx < len(gt))
+
+        keys.append(video_key)
+        offsets.append(total)
+        gt_chunks.append(gt)
+        outside.append(int((mask & ~inside).sum()))
+        pred_rows.append(frame_idx[inside] + total)
+        pred_boxes.append(arr[inside])
+        total += len(gt)
+
+    gt_all = np.concatenate(gt_chunks).astype(np.float64) if gt_chunks else np.zeros((0, 4))
+    pred_all = np.zeros_like(gt_all)
+    has_pred = np.zeros(len(gt_all), dtype=bool)
+    if pred_rows:
+        rows = np.concatenate(pred_rows)
+        pred_all[rows] = np.concatenate(pred_boxes)
+        has_pred[rows] = True
+    return keys, np.asarray(offsets, dtype=np.int64), pred_all, has_pred, gt_all, np.asarray(outside, dtype=np.int64)
+
+
+def evaluate_run(run, all_tasks_data, video_keys=None, iou_thresholds=DEFAULT_IOU_THRESHOLDS, pixel_threshold=20.0):
+    """
+    对一次运行的全部视频一次性向量化地计算指标。
+
+    每个视频的指标:
+        mean_iou:        有预测框的真值帧上的平均 IoU (与 run_all_videos 的 average_iou 一致)。
+        viou:            预测帧与真值帧并集上的 IoU 之和 / 并集帧数 (缺失或多余的帧计 0)。
+        tiou:            预测帧与真值帧的时间交并比。
+        success:         各 IoU 阈值下 IoU 超过阈值的真值帧比例 (缺失预测计为失败)；auc 为其平均值。
+        precision:       预测框中心与真值框中心距离不超过 pixel_threshold 像素的真值帧比例。
+
+    Args:
+        run (dict): load_run() 的返回值。
+        all_tasks_data (TaskStore): 任务库。
+        video_keys (iterable, optional): 参与评估的视频，默认评估 run 中所有在任务库里的视频。
+
+    Returns:
+        dict: {"videos": {video_key: 指标}, "mean": 各指标在视频间的平均, "success_curve": {...}}
+    """
+    if video_keys is None:
+        video_keys = [k for k in run if k in all_tasks_data]
+    keys, offsets, pred, has_pred, gt, outside = _align(run, all_tasks_data, sorted(video_keys, key=str))
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    if not keys:
+        return {"videos": {}, "mean": {}, "success_curve": {"thresholds": thresholds.tolist(), "success": []}}
+
+    ious = batch_iou(pred, gt, has_pred)
+    pred_center = (pred[:, :2] + pred[:, 2:]) / 2
+    gt_center = (gt[:, :2] + gt[:, 2:]) / 2
+    close = has_pred & (np.linalg.norm(pred_center - gt_center, axis=1) <= pixel_threshold)
+    success = ious[:, None] > thresholds[None, :]
+
+    # 每个视频占连续的一段行，用 reduceat 一次求出所有视频的分段和
+    num_gt = np.diff(np.append(offsets, len(gt)))
+    num_pred = np.add.reduceat(has_pred.astype(np.int64), offsets)
+    iou_sum = np.add.reduceat(ious, offsets)
+    success_rate = np.add.reduceat(success.astype(np.float64), offsets, axis=0) / num_gt[:, None]
+    precision = np.add.reduceat(close.astype(np.float64), offsets) / num_gt
+    union_frames = num_gt + outside
+
+    metrics = {
+        "mean_iou": np.divide(iou_sum, num_pred, out=np.zeros_like(iou_sum), where=num_pred > 0),
+        "viou": iou_sum / union_frames,
+        "tiou": num_pred / union_frames,
+        "auc": success_rate.mean(axis=1),
+        "precision": precision,
+    }
+    videos = {}
+    for i, video_key in enumerate(keys):
+        videos[video_key] = {name: float(values[i]) for name, values in metrics.items()}
+        videos[video_key]["gt_frames"] = int(num_gt[i])
+        videos[video_key]["pred_frames"] = int(num_pred[i] + outside[i])
+    return {
+        "videos": videos,
+        "mean": {name: float(values.mean()) for name, values in metrics.items()},
+        "success_curve": {"thresholds": thresholds.tolist(), "success": success_rate.mean(axis=0).tolist()},
+    }
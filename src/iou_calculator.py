@@ -1,5 +1,7 @@
 # src/iou_calculator.py
 
+import numpy as np
+
 def calculate_iou(boxA, boxB):
     """
     计算两个边界框的交并比 (IoU)。
@@ -32,4 +34,79 @@ def calculate_iou(boxA, boxB):
     iou = interArea / unionArea
     
     # 返回交并比
-    return iou
\ No newline at end of file
+    return iou
+
+# --- 向量化版本：基于 NumPy 数组一次性计算整段视频/整个数据集的 IoU ---
+
+def boxes_to_array(boxes):
+    """
+    将边界框字典列表转换为 (N, 4) 的 xyxy 数组和有效性掩码。
+
+    Args:
+        boxes (list): 每个元素为 {'xmin':, 'ymin':, 'xmax':, 'ymax':}，
+            空字典或 None 表示该帧没有预测框。
+
+    Returns:
+        tuple: (arr, mask)，arr 为 float64 的 (N, 4) 数组 (无效行填 0)，mask 为 (N,) 布尔数组。
+    """
+    arr = np.zeros((len(boxes), 4), dtype=np.float64)
+    mask = np.zeros(len(boxes), dtype=bool)
+    for i, box in enumerate(boxes):
+        if box:
+            arr[i] = (box['xmin'], box['ymin'], box['xmax'], box['ymax'])
+            mask[i] = True
+    return arr, mask
+
+
+def batch_iou(pred, gt, mask=None):
+    """
+    逐行计算两组边界框的 IoU (第 i 个预测框对第 i 个真值框)。
+
+    Args:
+        pred (np.ndarray): (N, 4) 的 xyxy 预测框数组。
+        gt (np.ndarray): (N, 4) 的 xyxy 真值框数组。
+        mask (np.ndarray, optional): (N,) 布尔数组，False 的行 (缺失预测) 结果为 0。
+
+    Returns:
+        np.ndarray: (N,) 的 IoU 数组，范围在 0.0 到 1.0 之间。
+    """
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 4)
+    gt = np.asarray(gt, dtype=np.float64).reshape(-1, 4)
+
+    inter_w = np.clip(np.minimum(pred[:, 2], gt[:, 2]) - np.maximum(pred[:, 0], gt[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(pred[:, 3], gt[:, 3]) - np.maximum(pred[:, 1], gt[:, 1]), 0, None)
+    inter = inter_w * inter_h
+
+    area_pred = (pred[:, 2] - pred[:, 0]) * (pred[:, 3] - pred[:, 1])
+    area_gt = (gt[:, 2] - gt[:, 0]) * (gt[:, 3] - gt[:, 1])
+    union = area_pred + area_gt - inter
+
+    iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    if mask is not None:
+        iou = np.where(mask, iou, 0.0)
+    return iou
+
+
+def pairwise_iou(boxes_a, boxes_b):
+    """
+    计算两组边界框之间两两的 IoU 矩阵，用于候选框匹配。
+
+    Args:
+        boxes_a (np.ndarray): (N, 4) 的 xyxy 数组。
+        boxes_b (np.ndarray): (M, 4) 的 xyxy 数组。
+
+    Returns:
+        np.ndarray: (N, M) 的 IoU 矩阵。
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)[None, :, :]
+
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
@@ -9,22 +9,54 @@ from tqdm import tqdm
 import re
 
 # 从其他模块导入
-from data_loader import load_video_data
-from detector import Detector
-from tracker import Tracker
-from utils import read_video_frames, save_results_to_json, read_single_frame
+from data_loader import load_video_data, load_video_tasks
+from tracker import add_tracker_arguments, interpolate_bbox, tracker_factory_from_args
+from utils import PrefetchingFrameReader, VideoReader, convert_color, COLOR_RGB
+from disk_cache import DiskCache, hash_key
+from result_writer import StreamingResultWriter
+from detector_backends import add_detector_arguments, build_detector
+from redetect_scheduler import RedetectionScheduler, add_redetect_arguments, scheduler_factory_from_args
+import tracing
+from tracing import add_tracing_arguments, configure_tracing_from_args
 
 class APIQueryRefiner:
     """
     使用智谱AI官方SDK，生成一个精确的、带有指代信息的英文短语。
+
+    可选的磁盘缓存以 (start帧编码、查询、模型名、提示模板) 的哈希为键，
+    replay=True 时只从缓存回放，不创建客户端、不访问网络。
     """
-    def __init__(self, api_key: str):
+    PHRASE_PROMPT = (
+        "You are a visual grounding assistant. "
+        "Given a question and an image, output **exactly one** concise noun phrase "
+        "that uniquely identifies the single subject to track. "
+        "- Do NOT include verbs, prepositions, or full sentences. "
+        "- Format must be '<color> <object>'. "
+        "- Return only that one phrase and nothing else.\n\n"
+        "Example:\n"
+        "Question: 'there is a dog biting a white cat beside the desk.'\n"
+        "=> 'the brown dog'\n\n"
+    )
+
+    def __init__(self, api_key: str, model: str = "glm-4v", cache: DiskCache | None = None, replay: bool = False,
+                 base_url: str | None = None):
+        self.model = model
+        self.cache = cache
+        self.replay = replay
+        if replay:
+            if cache is None:
+                raise ValueError("错误: 回放模式需要提供响应缓存目录。")
+            self.client = None
+            print("智谱AI API 处于回放模式，只使用本地缓存的响应。")
+            return
+
         print("开始初始化智谱AI API (官方SDK模式)...")
         if not api_key:
             raise ValueError("错误: 未提供智谱AI API 密钥。")
         
         # --- 关键修改点 2：使用官方库进行初始化 ---
-        self.client = ZhipuAI(api_key=api_key)
+        # base_url 可指向本地的桩服务 (见 stub_api_server.py)，用于离线测试
+        self.client = ZhipuAI(api_key=api_key, base_url=base_url) if base_url else ZhipuAI(api_key=api_key)
         # ----------------------------------------
         print("智谱AI API 初始化完成。")
 
@@ -33,157 +65,533 @@ class APIQueryRefiner:
         frame.save(buffered, format="JPEG")
         return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
+    def cached_phrase(self, base64_image: str, complex_query: str) -> str | None:
+        """
+        查询磁盘缓存，未启用缓存或未命中时返回 None。
+        """
+        if self.cache is None:
+            return None
+        cached = self.cache.get(hash_key(base64_image, complex_query, self.model, self.PHRASE_PROMPT))
+        return None if cached is None else cached['refined_phrase']
+
+    def store_phrase(self, base64_image: str, complex_query: str, refined_phrase: str) -> None:
+        if self.cache is not None and refined_phrase:
+            self.cache.put(hash_key(base64_image, complex_query, self.model, self.PHRASE_PROMPT),
+                           {"query": complex_query, "model": self.model, "refined_phrase": refined_phrase})
+
+    def request_phrase(self, base64_image: str, complex_query: str) -> str:
+        """
+        实际发起一次 API 请求并返回清洗后的短语；出错时直接抛出异常，由调用方决定是否重试。
+        """
+        # --- 关键修改点 3：API调用结构保持不变，因为官方库兼容OpenAI格式 ---
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": f"{self.PHRASE_PROMPT}Now, create the phrase for this question and image.\nQuestion: '{complex_query}' ->"},
+                    {
+                        "type": "image_url",
+                        "image_url": { "url": f"data:image/jpeg;base64,{base64_image}" }
+                    }
+                ]
+            }],
+            max_tokens=40,
+            temperature=0.0,
+        )
+        return response.choices[0].message.content.strip().replace("'", "").replace('"', '')
+
+    @tracing.traced("refine_query")
     def refine_query(self, frame: Image.Image, complex_query: str) -> str:
         base64_image = self._encode_image_to_base64(frame)
+
+        cached = self.cached_phrase(base64_image, complex_query)
+        if cached is not None:
+            print(f"复杂查询 '{complex_query}' 命中缓存 -> 指代短语: '{cached}'")
+            return cached
+        if self.replay:
+            print(f"错误: 回放模式下缓存中没有查询 '{complex_query}' 的响应。")
+            return ""
         
-        phrase_prompt = (
-            "You are a visual grounding assistant. "
-            "Given a question and an image, output **exactly one** concise noun phrase "
-            "that uniquely identifies the single subject to track. "
-            "- Do NOT include verbs, prepositions, or full sentences. "
-            "- Format must be '<color> <object>'. "
-            "- Return only that one phrase and nothing else.\n\n"
-            "Example:\n"
-            "Question: 'there is a dog biting a white cat beside the desk.'\n"
-            "=> 'the brown dog'\n\n"
-        )
-        
-        print("正在调用智谱AI API (glm-4v) 生成指代短语...")
+        print(f"正在调用智谱AI API ({self.model}) 生成指代短语...")
         try:
-            # --- 关键修改点 3：API调用结构保持不变，因为官方库兼容OpenAI格式 ---
-            response = self.client.chat.completions.create(
-                model="glm-4v",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"{phrase_prompt}Now, create the phrase for this question and image.\nQuestion: '{complex_query}' ->"},
-                        {
-                            "type": "image_url",
-                            "image_url": { "url": f"data:image/jpeg;base64,{base64_image}" }
-                        }
-                    ]
-                }],
-                max_tokens=40,
-                temperature=0.0,
-            )
-            
-            refined_phrase = response.choices[0].message.content.strip().replace("'", "").replace('"', '')
+            refined_phrase = self.request_phrase(base64_image, complex_query)
             print(f"复杂查询 '{complex_query}' 被精炼为 -> 指代短语: '{refined_phrase}'")
+            self.store_phrase(base64_image, complex_query, refined_phrase)
             return refined_phrase
             
         except Exception as e:
             print(f"调用智谱AI API 时发生错误: {e}")
             return ""
 
-# (main 函数和 __main__ 部分无需修改，但为保证完整性，全部贴出)
-def main(args):
-    """主执行函数"""
-    print(f"开始处理视频: {args.video_path}")
-    print(f"使用JSON任务文件: {args.json_path}")
 
-    try:
-        query_refiner = APIQueryRefiner(api_key=args.api_key)
-    except ValueError as e:
-        print(e)
+def build_query_refiner(api_key, cache_dir=None, cache_mb=64, replay=False, model="glm-4v", base_url=None):
+    """
+    按命令行参数构建 APIQueryRefiner；cache_dir 为空时不使用缓存。
+    """
+    cache = DiskCache(cache_dir, max_bytes=int(cache_mb * 1024 * 1024), read_only=replay) if cache_dir else None
+    return APIQueryRefiner(api_key=api_key, model=model, cache=cache, replay=replay, base_url=base_url)
+
+
+def _video_key_from_filename(video_filename):
+    video_key, _ = os.path.splitext(video_filename)
+    match = re.search(r'(\d+)', video_key)
+    return match.group(1) if match else video_key
+
+
+def process_video(video_path_arg, json_path, output_path, query_refiner, detector, tracker_factory, refined_phrase=None,
+                  scheduler_factory=None, resume=False, checkpoint_every=300, fast_resume=False):
+    """
+    使用已构建好的组件处理单个视频，返回是否成功写出结果文件。
+    开启追踪时，其中的所有耗时与计数都归入该视频的指标。
+
+    Args:
+        video_path_arg (str): 输入视频文件的路径。
+        json_path (str): 包含任务描述的JSON文件路径。
+        output_path (str): 输出结果JSON文件的路径。
+        query_refiner (APIQueryRefiner): 查询精炼器，可在多个视频间复用。
+        detector (Detector): Grounding DINO 检测器，可在多个视频间复用。
+        tracker_factory (callable): 无参调用时返回一个新的 Tracker 实例。
+        refined_phrase (str, optional): 已提前精炼好的短语 (例如来自异步精炼阶段)，
+            提供时跳过对 API 的调用。
+        scheduler_factory (callable, optional): 以视频 fps 为参数返回 RedetectionScheduler，
+            默认仅在跟踪失败时重检。
+        resume (bool): 存在未完成的结果日志时，从其最后一个检查点继续，而不是从头处理 (见 QueryTrack.resume_state)。
+            跟踪器需要从检查点前最近一次初始化的帧重放到检查点，重放区间的帧要重新解码和跟踪。
+        checkpoint_every (int): 每隔多少帧写一次检查点。
+        fast_resume (bool): 恢复时不重放，直接在检查点帧上用检查点的框重新初始化跟踪器；
+            恢复很快，但之后的结果可能与不中断的运行不同。
+    """
+    with tracing.video(_video_key_from_filename(os.path.basename(video_path_arg))):
+        return _process_video(video_path_arg, json_path, output_path, query_refiner, detector, tracker_factory,
+                              refined_phrase, scheduler_factory, resume, checkpoint_every, fast_resume)
+
+
+def _box_from_center(bbox):
+    cx, cy, w, h = bbox
+    return {"xmin": cx - w // 2, "ymin": cy - h // 2, "xmax": cx + w // 2, "ymax": cy + h // 2}
+
+
+def _detect_prompts(detector, frame, text_prompts, color_space):
+    """
+    在同一帧上检测多个短语，相同短语只检测一次。检测器提供 detect_prompts 时多个短语共享一次图像编码，
+    否则逐个调用 detect_object。
+    """
+    unique_prompts = list(dict.fromkeys(text_prompts))
+    if len(unique_prompts) > 1 and hasattr(detector, 'detect_prompts'):
+        boxes = dict(zip(unique_prompts, detector.detect_prompts(frame, unique_prompts, color_space)))
+    else:
+        boxes = {p: detector.detect_object(frame, p, color_space) for p in unique_prompts}
+    return [boxes[p] for p in text_prompts]
+
+
+class QueryTrack:
+    """
+    单个查询的检测与跟踪状态 (跟踪器、重检调度器、结果日志)，在自己的 [begin_frame, end_frame] 区间内独立跟踪。
+    多个查询共用一次解码时 (见 process_video_tasks)，每个查询各有一个 QueryTrack。
+
+    status: pending (尚未到达第一帧) -> tracking -> done；出错时为 failed。
+    """
+    def __init__(self, video_key, complex_query, start_frame, end_frame, output_path, refined_phrase=None,
+                 resume=False, checkpoint_every=300, fast_resume=False):
+        self.video_key = video_key
+        self.complex_query = complex_query
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.output_path = output_path
+        self.refined_phrase = refined_phrase
+        self.writer = StreamingResultWriter(output_path, checkpoint_every=checkpoint_every)
+        self.tracker = None
+        self.scheduler = None
+        self.success, self.bbox = False, None
+        self.status = 'pending'
+        # 稀疏跟踪: 上一个写出的关键帧 (帧号, 框) 与之后被跳过、等待插值的帧
+        self.last_keyframe = None
+        self.skipped = []
+        self.num_skipped = 0
+
+        # 跟踪器最近一次 (重新) 初始化的 (帧号, 框)，写入检查点供恢复时重放
+        self.init_point = None
+        self.replay_until = None
+        self.fast_resume = fast_resume
+
+        checkpoint = self.writer.resume() if resume else None
+        if checkpoint is not None and (checkpoint["video"] != video_key or checkpoint["query"] != complex_query
+                                       or not start_frame <= checkpoint["frame"] <= end_frame
+                                       or "scheduler" not in checkpoint):
+            print("警告: 未完成的结果日志与当前任务不匹配，将从头处理。")
+            self.writer.close()
+            checkpoint = None
+        self.checkpoint = checkpoint
+        self.begin_frame = start_frame
+        if checkpoint is not None:
+            self.refined_phrase = checkpoint["refined_query"]
+            self.replay_until = checkpoint["frame"]
+            if checkpoint["init"] and not fast_resume:
+                self.begin_frame = checkpoint["init"][0]
+                how = f"跟踪器从第 {self.begin_frame} 帧重放"
+            else:
+                self.begin_frame = checkpoint["frame"]
+                how = "跟踪器在检查点帧上重新初始化，不重放"
+            print(f"从第 {checkpoint['frame']} 帧的检查点恢复 ({how})，沿用精炼短语 '{self.refined_phrase}'。")
+
+    def fail(self, message):
+        print(message)
+        self.writer.close()
+        self.status = 'failed'
+
+    def start(self, frame, initial_bbox, tracker, scheduler):
+        """
+        在 begin_frame 上用初始检测框初始化跟踪器，并写出第一帧的结果。
+        从检查点恢复时忽略 initial_bbox，改为恢复检查点中的状态 (见 resume_state)。
+        """
+        self.tracker, self.scheduler = tracker, scheduler
+        self.status = 'tracking'
+        if self.checkpoint is not None:
+            self._restore(frame)
+            return
+        if initial_bbox:
+            tracker.initialize(frame, initial_bbox)
+            self.init_point = (self.start_frame, initial_bbox)
+            scheduler.reset(frame, initial_bbox)
+            scheduler.observe(self.start_frame, initial_bbox)
+            first_box = _box_from_center(initial_bbox)
+            self.writer.write(self.start_frame, first_box)
+            print(f"目标已找到，边界框: {first_box}，开始追踪...")
+        else:
+            self.writer.write(self.start_frame, {})
+            print("警告：在第一帧未找到目标。")
+        self.last_keyframe = (self.start_frame, initial_bbox or None)
+        self.writer.checkpoint(self.start_frame, self.resume_state())
+
+    def resume_state(self):
+        """
+        写入检查点的恢复状态 (检查点总是写在关键帧上，此时没有等待插值的帧)。
+
+        OpenCV 跟踪器的内部模型无法序列化，但它只取决于最近一次初始化的帧与框以及之后的各帧，
+        因此检查点保存初始化点；恢复时在该帧上重新初始化，只运行跟踪器重放到检查点帧。
+        跟踪器本身是确定性的时，恢复后的结果与不中断的运行一致；MIL 使用 OpenCV 的全局随机数，重放无法复现。
+        fast_resume 时不重放，改为在检查点帧上用检查点的框重新初始化。
+        """
+        def box(bbox):
+            return [int(v) for v in bbox] if bbox is not None else None
+
+        return {
+            "bbox": box(self.bbox),
+            "success": self.success,
+            "keyframe_bbox": box(self.last_keyframe[1]),
+            "init": [self.init_point[0], box(self.init_point[1])] if self.init_point else None,
+            "scheduler": self.scheduler.state_dict(),
+            "num_skipped": self.num_skipped,
+        }
+
+    def _restore(self, frame):
+        checkpoint = self.checkpoint
+        if self.fast_resume:
+            # 检查点帧上跟踪失败时不初始化，交给之后的重检
+            if checkpoint["success"] and checkpoint["bbox"]:
+                self.init_point = (checkpoint["frame"], tuple(checkpoint["bbox"]))
+                self.tracker.initialize(frame, self.init_point[1])
+        elif checkpoint["init"]:
+            self.init_point = (checkpoint["init"][0], tuple(checkpoint["init"][1]))
+            self.tracker.initialize(frame, self.init_point[1])
+        self.scheduler.load_state_dict(checkpoint["scheduler"])
+        self.success = checkpoint["success"]
+        self.bbox = tuple(checkpoint["bbox"]) if checkpoint["bbox"] else None
+        keyframe_bbox = checkpoint["keyframe_bbox"]
+        self.last_keyframe = (checkpoint["frame"], tuple(keyframe_bbox) if keyframe_bbox else None)
+        self.num_skipped = checkpoint["num_skipped"]
+
+    def _is_keyframe(self, frame_idx, frame):
+        # 稀疏跟踪时 (跟踪器提供 needs_update)，区间的最后一帧总是关键帧
+        needs_update = getattr(self.tracker, 'needs_update', None)
+        return needs_update is None or frame_idx >= self.end_frame or needs_update(frame)
+
+    def update(self, frame_idx, frame, detector, color_space):
+        """
+        跟踪一帧。局部重检在这里直接完成；需要整帧重检时返回 True，由调用方把同一帧上
+        多个查询的整帧重检合并后再调用 apply_redetection。
+
+        稀疏跟踪时非关键帧既不跟踪也不重检。从检查点恢复时，检查点帧及之前的帧只重放跟踪器。
+        """
+        if self.replay_until is not None and frame_idx <= self.replay_until:
+            if self._is_keyframe(frame_idx, frame):
+                self.tracker.update(frame)
+            return False
+        if not self._is_keyframe(frame_idx, frame):
+            self.skipped.append(frame_idx)
+            return False
+        self.success, self.bbox = self.tracker.update(frame)
+        if not self.scheduler.should_redetect(frame_idx, frame, self.success, self.bbox):
+            return False
+        hint = self.scheduler.predicted_box(frame_idx) if self.scheduler.local_redetect else None
+        if hint is None:
+            return True
+        redetected_bbox = detector.redetect(frame, self.refined_phrase, hint, color_space,
+                                            expand=self.scheduler.local_expand,
+                                            input_size=self.scheduler.local_input_size)
+        self.apply_redetection(frame_idx, frame, redetected_bbox)
+        return False
+
+    def apply_redetection(self, frame_idx, frame, redetected_bbox):
+        self.scheduler.record_detection(frame_idx, found=bool(redetected_bbox))
+        tracing.count("redetections")
+        if redetected_bbox:
+            tracing.count("re_inits")
+            self.tracker.initialize(frame, redetected_bbox)
+            self.init_point = (frame_idx, redetected_bbox)
+            self.scheduler.reset(frame, redetected_bbox)
+            self.success, self.bbox = True, redetected_bbox
+
+    def write(self, frame_idx):
+        if self.replay_until is not None and frame_idx <= self.replay_until:
+            return  # 重放的帧已在结果日志中
+        if self.skipped and self.skipped[-1] == frame_idx:
+            return  # 跳过的帧等到下一个关键帧再插值写出
+        keyframe_bbox = self.bbox if self.success else None
+        self._write_skipped(frame_idx, keyframe_bbox)
+
+        current_bbox_for_json = {}
+        if self.success:
+            self.scheduler.observe(frame_idx, self.bbox)
+            current_bbox_for_json = _box_from_center(self.bbox)
+        self.writer.write(frame_idx, current_bbox_for_json)
+        self.last_keyframe = (frame_idx, keyframe_bbox)
+        if self.writer.checkpoint_due(frame_idx):
+            self.writer.checkpoint(frame_idx, self.resume_state())
+
+    def _write_skipped(self, frame_idx, keyframe_bbox):
+        """
+        按上一个关键帧与当前关键帧的框线性插值，补写中间被跳过的帧。
+        当前关键帧丢失目标 (或视频提前结束，frame_idx 为 None) 时沿用上一个关键帧的框。
+        """
+        if not self.skipped:
+            return
+        last_idx, last_bbox = self.last_keyframe
+        for skipped_idx in self.skipped:
+            filled = last_bbox
+            if last_bbox is not None and keyframe_bbox is not None:
+                filled = interpolate_bbox(last_bbox, keyframe_bbox, (skipped_idx - last_idx) / (frame_idx - last_idx))
+            self.writer.write(skipped_idx, _box_from_center(filled) if filled else {})
+        self.num_skipped += len(self.skipped)
+        self.skipped = []
+
+    def finish(self):
+        self._write_skipped(None, None)
+        print(f"任务 {self.video_key} 共调用检测器 {self.scheduler.detector_calls} 次 (重检策略: {self.scheduler.mode})。")
+        if self.num_skipped:
+            print(f"稀疏跟踪跳过了 {self.num_skipped} 帧 (由相邻关键帧插值)。")
+        self.writer.finalize()
+        self.status = 'done'
+        print(f"\n处理完成，结果已保存至 {self.output_path}")
+
+
+def _start_tracks(tracks, frame, color_space, fps, query_refiner, detector, tracker_factory, scheduler_factory):
+    """
+    在各查询的第一帧上精炼短语、做初始检测并初始化跟踪器。同一帧上开始的多个查询合并为一次检测。
+    """
+    frame_for_api_pil = None
+    for track in tracks:
+        if track.refined_phrase is None:
+            if frame_for_api_pil is None:
+                frame_for_api_pil = Image.fromarray(convert_color(frame, color_space, COLOR_RGB))
+            track.refined_phrase = query_refiner.refine_query(frame_for_api_pil, track.complex_query)
+        if not track.refined_phrase:
+            track.fail(f"错误: API未能从查询 '{track.complex_query}' 中提炼出有效的指代短语，跳过该任务。")
+
+    ready = [track for track in tracks if track.status == 'pending']
+    if not ready:
         return
+    print("\n--- 开始目标检测与追踪流程 ---")
+    fresh = [track for track in ready if track.checkpoint is None]
+    for track in fresh:
+        track.writer.start(track.video_key, track.complex_query, track.refined_phrase)
+        print(f"正在第一帧使用短语 '{track.refined_phrase}' 进行初始目标检测...")
+    initial_bboxes = _detect_prompts(detector, frame, [track.refined_phrase for track in fresh], color_space)
+    initial_bboxes = dict(zip(map(id, fresh), initial_bboxes))
+
+    for track in ready:
+        scheduler = scheduler_factory(fps) if scheduler_factory else RedetectionScheduler(fps=fps)
+        initial_bbox = None
+        if track.checkpoint is None:
+            initial_bbox = initial_bboxes[id(track)]
+            scheduler.record_detection(track.start_frame)
+        track.start(frame, initial_bbox, tracker_factory(), scheduler)
+
+
+def _track_queries(video, tracks, query_refiner, detector, tracker_factory, scheduler_factory):
+    """
+    只解码一遍所有查询帧区间的并集，把每一帧依次交给各个查询的跟踪状态。
+    同一帧上需要整帧检测 (初始检测或重检) 的多个查询合并为一次检测，共享图像编码。
+    """
+    first_frame = min(track.begin_frame for track in tracks)
+    last_frame = max(track.end_frame for track in tracks)
+    frame_reader = PrefetchingFrameReader(video, first_frame, last_frame)
+    color_space = frame_reader.color_space
+    # 检测缓存 (CachingDetector 及转发它的包装) 按 (视频内容, 帧号, ...) 索引
+    caching = hasattr(detector, 'begin_video')
+    if caching:
+        detector.begin_video(video.video_path)
+    try:
+        frames = tqdm(frame_reader, total=last_frame - first_frame + 1, desc="追踪进度")
+        for frame_idx, frame in enumerate(frames, start=first_frame):
+            if caching:
+                detector.frame_idx = frame_idx
+            starting = [t for t in tracks if t.status == 'pending' and t.begin_frame == frame_idx]
+            if starting:
+                _start_tracks(starting, frame, color_space, video.fps, query_refiner, detector,
+                              tracker_factory, scheduler_factory)
 
-    video_filename = os.path.basename(args.video_path)
+            ongoing = [t for t in tracks if t.status == 'tracking' and t.begin_frame < frame_idx <= t.end_frame]
+            full_frame = [t for t in ongoing if t.update(frame_idx, frame, detector, color_space)]
+            if full_frame:
+                redetected = _detect_prompts(detector, frame, [t.refined_phrase for t in full_frame], color_space)
+                for track, redetected_bbox in zip(full_frame, redetected):
+                    track.apply_redetection(frame_idx, frame, redetected_bbox)
+            for track in ongoing:
+                track.write(frame_idx)
+
+            for track in tracks:
+                if track.status == 'tracking' and track.end_frame == frame_idx:
+                    track.finish()
+            if all(track.status in ('done', 'failed') for track in tracks):
+                break
+    finally:
+        frame_reader.close()
+
+    # 视频在某些查询的区间结束前就读完了
+    for track in tracks:
+        if track.status == 'tracking':
+            track.finish()
+        elif track.status == 'pending':
+            track.fail(f"错误：任务 {track.video_key} 的视频帧区间为空或无法读取第一帧。")
+
+
+def _process_video(video_path_arg, json_path, output_path, query_refiner, detector, tracker_factory, refined_phrase,
+                   scheduler_factory, resume, checkpoint_every, fast_resume):
+    print(f"开始处理视频: {video_path_arg}")
+    print(f"使用JSON任务文件: {json_path}")
+
+    video_filename = os.path.basename(video_path_arg)
     
     try:
-        video_path, start_frame, end_frame, complex_query, _ = load_video_data(args.json_path, video_filename)
+        video_path, start_frame, end_frame, complex_query, _ = load_video_data(
+            json_path, video_filename, os.path.dirname(video_path_arg) or "sample_videos")
         print(f"任务加载成功: 在 {start_frame}-{end_frame} 帧之间寻找与 '{complex_query}' 相关的内容。")
     except (ValueError, FileNotFoundError) as e:
         print(f"错误: {e}")
-        return
+        return False
 
-    
-    frame_for_api_np = read_single_frame(video_path, start_frame)
-    
-    if frame_for_api_np is None:
-        print("错误：无法读取用于分析的start帧，程序终止。")
-        return
-        
-    frame_for_api_pil = Image.fromarray(frame_for_api_np)
-    
-    refined_phrase = query_refiner.refine_query(frame_for_api_pil, complex_query)
-    
-    if not refined_phrase:
-        print("错误: API未能从查询中提炼出有效的指代短语。程序终止。")
-        return
+    track = QueryTrack(_video_key_from_filename(video_filename), complex_query, start_frame, end_frame, output_path,
+                       refined_phrase, resume, checkpoint_every, fast_resume)
 
-    print("\n--- 开始目标检测与追踪流程 ---")
-    detector = Detector(model_path='IDEA-Research/grounding-dino-base')
-    tracker = Tracker(tracker_type='CSRT')
-
-    frame_generator = read_video_frames(video_path, start_frame, end_frame)
+    # 只打开一次视频：start帧既用于 API 分析，也是检测与跟踪的第一帧
     try:
-        first_frame_np = next(frame_generator)
-    except StopIteration:
-        print("错误：视频帧区间为空或无法读取第一帧。")
-        return
+        video = VideoReader(video_path)
+    except IOError as e:
+        track.fail(e)
+        return False
+    try:
+        _track_queries(video, [track], query_refiner, detector, tracker_factory, scheduler_factory)
+    finally:
+        video.close()
+    return track.status == 'done'
 
-    print(f"正在第一帧使用短语 '{refined_phrase}' 进行初始目标检测...")
-    initial_bbox = detector.detect_object(first_frame_np, refined_phrase)
-    all_bboxes = {}
-    
-    if initial_bbox:
-        tracker.initialize(first_frame_np, initial_bbox)
-        cx, cy, w, h = initial_bbox
-        x_min, y_min, x_max, y_max = cx - w // 2, cy - h // 2, cx + w//2,cy + h//2
-        all_bboxes[str(start_frame)] = {"xmin": x_min, "ymin": y_min, "xmax": x_max, "ymax": y_max}
-        print(f"目标已找到，边界框: {all_bboxes[str(start_frame)]}，开始追踪...")
-    else:
-        all_bboxes[str(start_frame)] = {}
-        print("警告：在第一帧未找到目标。")
-
-    frame_count = end_frame - start_frame
-    for i, frame in enumerate(tqdm(frame_generator, total=max(0, frame_count), desc="追踪进度")):
-        if i == 0 and frame_count >= 0: continue
-        frame_idx = start_frame + i
-        success, new_bbox = tracker.update(frame)
-        
-        current_bbox_for_json = {} 
-        if success:
-            cx, cy, w, h = new_bbox
-            x_min, y_min, x_max, y_max = cx - w // 2, cy - h // 2, cx + w //2, cy + h //2 
-            current_bbox_for_json = {"xmin": x_min, "ymin": y_min, "xmax": x_max, "ymax": y_max}
+
+def process_video_tasks(video_path_arg, json_path, output_dir, query_refiner, detector, tracker_factory,
+                        task_keys=None, scheduler_factory=None, resume=False, checkpoint_every=300, fast_resume=False):
+    """
+    多查询模式：同一个视频上的 N 个任务只解码一遍 (各任务帧区间的并集)，每一帧分别交给 N 个独立的跟踪状态；
+    同一帧上多个查询的整帧检测合并为一次，共享图像编码。
+
+    Args:
+        output_dir (str): 每个任务的结果写入 <output_dir>/<任务编号>_result.json (与 run_all_videos.py 相同)。
+        task_keys (list, optional): 要处理的任务编号，默认为任务文件中 'vid' 指向该视频的全部任务。
+        其余参数与 process_video 相同。
+
+    Returns:
+        dict: {任务编号: 是否成功写出结果文件}
+    """
+    with tracing.video(_video_key_from_filename(os.path.basename(video_path_arg))):
+        print(f"开始处理视频: {video_path_arg}")
+        video_filename = os.path.basename(video_path_arg)
+        try:
+            video_path, tasks = load_video_tasks(json_path, video_filename,
+                                                 os.path.dirname(video_path_arg) or "sample_videos", task_keys)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"错误: {e}")
+            return {}
+        for task_key, start_frame, end_frame, complex_query, _ in tasks:
+            print(f"任务 {task_key}: 在 {start_frame}-{end_frame} 帧之间寻找与 '{complex_query}' 相关的内容。")
+
+        tracks = [QueryTrack(task_key, complex_query, start_frame, end_frame,
+                             os.path.join(output_dir, f"{task_key}_result.json"),
+                             resume=resume, checkpoint_every=checkpoint_every, fast_resume=fast_resume)
+                  for task_key, start_frame, end_frame, complex_query, _ in tasks]
+        try:
+            video = VideoReader(video_path)
+        except IOError as e:
+            for track in tracks:
+                track.fail(e)
         else:
-            redetected_bbox = detector.detect_object(frame, refined_phrase)
-            if redetected_bbox:
-                tracker.initialize(frame, redetected_bbox)
-                cx, cy, w, h = redetected_bbox
-                x_min, y_min, x_max, y_max = cx - w // 2, cy - h // 2, cx + w //2, cy + h //2
-                current_bbox_for_json = {"xmin": x_min, "ymin": y_min, "xmax": x_max, "ymax": y_max}
-        
-        all_bboxes[str(frame_idx)] = current_bbox_for_json
+            try:
+                _track_queries(video, tracks, query_refiner, detector, tracker_factory, scheduler_factory)
+            finally:
+                video.close()
+        return {track.video_key: track.status == 'done' for track in tracks}
 
-    video_key, _ = os.path.splitext(video_filename)
-    match = re.search(r'(\d+)', video_key)
-    if match:
-        video_key = match.group(1)
-
-    final_output = {
-        video_key: {
-            "query": complex_query,
-            "refined_query": refined_phrase,
-            "pred_bboxs": all_bboxes
-        }
-    }
-    save_results_to_json(final_output, args.output_path)
-    print(f"\n处理完成，结果已保存至 {args.output_path}")
+
+def main(args):
+    """主执行函数"""
+    configure_tracing_from_args(args)
+    try:
+        query_refiner = build_query_refiner(args.api_key, args.refine_cache_dir, args.refine_cache_mb, args.replay,
+                                            model=args.refine_model, base_url=args.api_base_url)
+    except ValueError as e:
+        print(e)
+        return
+
+    # build_detector 延迟导入: process_video 本身不依赖 torch/transformers，可以配合其他检测器使用
+    detector = build_detector(args)
+    if args.multi_query or args.task_keys:
+        process_video_tasks(args.video_path, args.json_path, args.output_dir,
+                            query_refiner, detector, tracker_factory_from_args(args),
+                            task_keys=args.task_keys, scheduler_factory=scheduler_factory_from_args(args),
+                            resume=args.resume, checkpoint_every=args.checkpoint_every,
+                            fast_resume=args.fast_resume)
+        return
+    process_video(args.video_path, args.json_path, args.output_path,
+                  query_refiner, detector, tracker_factory_from_args(args),
+                  scheduler_factory=scheduler_factory_from_args(args),
+                  resume=args.resume, checkpoint_every=args.checkpoint_every, fast_resume=args.fast_resume)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="集成智谱AI API和Grounding DINO的视频时空定位脚本")
     parser.add_argument('--video_path', type=str, required=True, help='输入视频文件的路径')
     parser.add_argument('--json_path', type=str, required=True, help='包含任务描述的JSON文件路径')
-    parser.add_argument('--api_key', type=str, required=True, help='你的智谱AI API 密钥')
+    parser.add_argument('--api_key', type=str, default=None, help='你的智谱AI API 密钥 (回放模式下可省略)')
+    parser.add_argument('--refine_cache_dir', type=str, default='.cache/refine_query', help='查询精炼响应的磁盘缓存目录，传空字符串表示不使用缓存')
+    parser.add_argument('--refine_cache_mb', type=float, default=64, help='查询精炼缓存的最大容量 (MB)，超出后按LRU淘汰')
+    parser.add_argument('--replay', action='store_true', help='只从缓存回放精炼结果，不访问网络')
+    parser.add_argument('--refine_model', type=str, default='glm-4v', help='查询精炼使用的智谱AI模型')
+    parser.add_argument('--api_base_url', type=str, default=None, help='覆盖智谱AI API 的 base_url (例如指向本地桩服务)')
     parser.add_argument('--output_path', type=str, default='output/results_zhipu_api.json', help='输出结果JSON文件的路径')
+    parser.add_argument('--multi_query', action='store_true', help='一次解码处理任务文件中指向该视频的全部任务，结果分别写入 --output_dir')
+    parser.add_argument('--task_keys', type=str, nargs='+', default=None, help='(多查询模式) 指定要处理的任务编号，隐含 --multi_query')
+    parser.add_argument('--output_dir', type=str, default='output_batch', help='(多查询模式) 存放 <任务编号>_result.json 的目录')
+    parser.add_argument('--resume', action='store_true', help='若存在未完成的结果日志 (<output_path>.partial.jsonl)，从最后一个检查点继续；跟踪器从检查点前最近一次初始化的帧开始重放，除 MIL 外结果与不中断的运行一致。重放区间的帧都要重新解码和跟踪 (on_failure 模式下没有失败时即从区间起点开始)，省下的只是检测器与API调用')
+    parser.add_argument('--fast_resume', action='store_true', help='配合 --resume: 不重放，直接在检查点帧上用检查点的框重新初始化跟踪器；恢复很快，但之后的结果可能与不中断的运行不同')
+    parser.add_argument('--checkpoint_every', type=int, default=300, help='每隔多少帧写一次检查点')
+    add_detector_arguments(parser)
+    add_tracker_arguments(parser)
+    add_redetect_arguments(parser)
+    add_tracing_arguments(parser)
     
     args = parser.parse_args()
     
-    output_dir = os.path.dirname(args.output_path)
-    if not os.path.exists(output_dir):
+    output_dir = args.output_dir if args.multi_query or args.task_keys else os.path.dirname(args.output_path)
+    if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
     main(args)
\ No newline at end of file
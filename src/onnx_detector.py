@@ -0,0 +1,173 @@
+# src/onnx_detector.py
+
+import inspect
+import os
+
+import numpy as np
+import onnxruntime as ort
+import torch
+import transformers
+from PIL import Image
+from transformers import AutoProcessor, AutoModelForZeroShotObjectDetection
+from transformers.models.grounding_dino import modeling_grounding_dino
+from transformers.models.grounding_dino.modeling_grounding_dino import (
+    GroundingDinoObjectDetectionOutput, generate_masks_with_special_tokens_and_transfer_map)
+
+from detector import Detector
+from disk_cache import hash_key
+
+_INPUT_NAMES = ['pixel_values', 'input_ids', 'token_type_ids', 'attention_mask', 'pixel_mask',
+                'text_self_attention_masks', 'position_ids']
+# 导出图的输入输出发生变化时递增，使旧的缓存模型失效
+_EXPORT_VERSION = 2
+_OUTPUT_NAMES = ['logits', 'pred_boxes']
+
+
+class _ExportWrapper(torch.nn.Module):
+    """
+    把 Grounding DINO 的前向推理包装成固定的位置参数与 (logits, pred_boxes) 输出，便于导出。
+
+    文本自注意力掩码与 position_ids 由 generate_masks_with_special_tokens_and_transfer_map 按特殊 token
+    (句号等) 的位置生成，其中的 Python 循环与依赖数据的索引在跟踪导出时会被固化为示例短语的结果。
+    因此导出时把该函数替换为直接返回图的两个输入，由 OnnxDetector 在图外按实际短语计算。
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values, input_ids, token_type_ids, attention_mask, pixel_mask, text_self_attention_masks,
+                position_ids):
+        def precomputed_masks(_input_ids):
+            return text_self_attention_masks, position_ids
+
+        generate_masks = modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map
+        modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map = precomputed_masks
+        try:
+            outputs = self.model(pixel_values=pixel_values, input_ids=input_ids, token_type_ids=token_type_ids,
+                                 attention_mask=attention_mask, pixel_mask=pixel_mask, return_dict=True)
+        finally:
+            modeling_grounding_dino.generate_masks_with_special_tokens_and_transfer_map = generate_masks
+        return outputs.logits, outputs.pred_boxes
+
+
+def _text_masks(input_ids):
+    """
+    在图外计算文本自注意力掩码与 position_ids (见 _ExportWrapper)。
+    """
+    text_self_attention_masks, position_ids = generate_masks_with_special_tokens_and_transfer_map(input_ids)
+    return {'text_self_attention_masks': text_self_attention_masks, 'position_ids': position_ids}
+
+
+def export_onnx(model_path, cache_dir='.cache/onnx', opset=17, quantize=False):
+    """
+    将 Grounding DINO 导出为 ONNX 并缓存到本地，可选地对 MatMul/Gemm (线性层) 做动态 int8 量化。
+
+    缓存目录以 (模型、opset、导出格式、torch 与 transformers 版本) 的哈希命名，已存在时直接复用。
+
+    Returns:
+        str: 可供 ONNX Runtime 加载的模型文件路径。
+    """
+    export_dir = os.path.join(cache_dir, hash_key(model_path, opset, _EXPORT_VERSION, torch.__version__,
+                                                     transformers.__version__)[:16])
+    fp32_path = os.path.join(export_dir, 'model.onnx')
+    int8_path = os.path.join(export_dir, 'model.int8.onnx')
+    os.makedirs(export_dir, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        print(f"正在将 '{model_path}' 导出为 ONNX (只需一次)，保存至 {fp32_path} ...")
+        processor = AutoProcessor.from_pretrained(model_path)
+        model = AutoModelForZeroShotObjectDetection.from_pretrained(model_path).eval()
+        dummy = dict(processor(images=Image.new('RGB', (640, 480)), text="a cat. a remote control.",
+                               return_tensors="pt"))
+        dummy.update(_text_masks(dummy['input_ids']))
+        tmp_path = fp32_path + '.tmp'
+        # 新版 torch 默认使用基于 torch.export 的导出器 (需要 onnxscript)；这里的 dynamic_axes 与
+        # _ExportWrapper 的掩码替换都基于 TorchScript 跟踪，因此显式使用旧导出器
+        legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        with torch.no_grad():
+            torch.onnx.export(
+                _ExportWrapper(model),
+                tuple(dummy[name] for name in _INPUT_NAMES),
+                tmp_path,
+                input_names=_INPUT_NAMES,
+                output_names=_OUTPUT_NAMES,
+                dynamic_axes={
+                    'pixel_values': {0: 'batch', 2: 'height', 3: 'width'},
+                    'input_ids': {0: 'batch', 1: 'tokens'},
+                    'token_type_ids': {0: 'batch', 1: 'tokens'},
+                    'attention_mask': {0: 'batch', 1: 'tokens'},
+                    'pixel_mask': {0: 'batch', 1: 'height', 2: 'width'},
+                    'text_self_attention_masks': {0: 'batch', 1: 'tokens', 2: 'tokens'},
+                    'position_ids': {0: 'batch', 1: 'tokens'},
+                    'logits': {0: 'batch', 2: 'tokens'},
+                    'pred_boxes': {0: 'batch'},
+                },
+                opset_version=opset,
+                **legacy,
+            )
+        os.replace(tmp_path, fp32_path)
+        del model
+
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print(f"正在对 ONNX 模型做动态 int8 量化，保存至 {int8_path} ...")
+        tmp_path = int8_path + '.tmp'
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8, op_types_to_quantize=['MatMul', 'Gemm'])
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxDetector(Detector):
+    """
+    在 CPU 上用 ONNX Runtime 运行 Grounding DINO 的检测器后端，适用于没有 GPU 的节点。
+
+    预处理 (分词、图像缩放) 与后处理沿用 Hugging Face 处理器，只有模型前向推理交给 ONNX Runtime。
+    与 PyTorch 后端的检测结果是否一致 (尤其是 int8 量化后)，需用 check_detector_parity.py 在真实帧上检查。
+    """
+    def __init__(self, model_path='IDEA-Research/grounding-dino-base', text_cache_size=32,
+                 box_threshold=0.3, text_threshold=0.3, cache_dir='.cache/onnx', quantize=False, num_threads=None):
+        """
+        Args:
+            cache_dir: 导出的 ONNX 模型缓存目录。
+            quantize: 是否使用动态 int8 量化后的模型。
+            num_threads: ONNX Runtime 的算子内线程数，默认由 ONNX Runtime 决定。
+            其余参数与 Detector 相同。
+        """
+        self.cache_dir = cache_dir
+        self.quantize = quantize
+        self.num_threads = num_threads
+        super().__init__(model_path, text_cache_size, box_threshold, text_threshold)
+
+    def _load_model(self):
+        self.device = 'cpu'
+        print(f"Grounding DINO 检测器将使用 ONNX Runtime 在 CPU 上运行 (int8 量化: {'是' if self.quantize else '否'})。")
+
+        try:
+            self.processor = AutoProcessor.from_pretrained(self.model_path)
+            onnx_path = export_onnx(self.model_path, self.cache_dir, quantize=self.quantize)
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+            self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+            print("Grounding DINO ONNX 模型初始化完成。")
+        except Exception as e:
+            print(f"错误：加载Grounding DINO ONNX模型失败。请检查模型路径 '{self.model_path}' 与 onnxruntime 安装。")
+            print(f"详细错误: {e}")
+            raise
+
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def _forward(self, inputs: dict):
+        inputs = dict(inputs, **_text_masks(inputs['input_ids']))
+        # 文本张量是按批次 expand 出来的视图，需要转成连续数组
+        feeds = {name: np.ascontiguousarray(tensor.cpu().numpy()) for name, tensor in inputs.items()
+                 if name in self._input_names}
+        # 处理器可能省略 token_type_ids，此时按 BERT 的默认值补零
+        if 'token_type_ids' in self._input_names and 'token_type_ids' not in feeds:
+            feeds['token_type_ids'] = np.zeros_like(feeds['input_ids'])
+        logits, pred_boxes = self.session.run(_OUTPUT_NAMES, feeds)
+        return GroundingDinoObjectDetectionOutput(logits=torch.from_numpy(logits),
+                                                  pred_boxes=torch.from_numpy(pred_boxes))
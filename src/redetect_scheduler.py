@@ -0,0 +1,231 @@
+# src/redetect_scheduler.py
+
+import base64
+import collections
+
+import cv2
+import numpy as np
+
+REDETECT_MODES = ('on_failure', 'periodic', 'health')
+
+
+class RedetectionScheduler:
+    """
+    决定在哪些帧上重新运行 Grounding DINO 检测。
+
+    模式:
+        on_failure: 仅在跟踪器报告失败时重检 (原有行为)。
+        periodic:   跟踪失败时，以及距上次检测每满 interval 帧时重检。
+        health:     跟踪失败时，以及健康度评分提示可能漂移时重检。健康度由两部分组成：
+                    当前框内图像与初始化时模板的归一化相关系数 (低于 health_threshold 视为漂移)，
+                    以及相邻两帧框面积的相对跳变 (超过 max_size_jump 视为漂移)。
+                    重检没有找到目标时模板不会更新，漂移会一直存在，因此之后的健康度重检按指数退避:
+                    间隔从 1 帧起每次连续落空翻倍，最多 interval 帧；重检成功后恢复。
+
+    max_calls_per_second 限制每秒视频内的检测次数 (按 fps 换算成帧窗口)，
+    超出上限时即使请求重检也会被拒绝。
+
+    local_redetect 为 True 时，重检先在预测位置周围的局部窗口内以较小输入尺寸运行
+    (见 Detector.redetect)，预测位置由最近两次成功跟踪的框按匀速运动外推。
+    """
+    def __init__(self, mode='on_failure', interval=30, health_threshold=0.5, max_size_jump=0.5,
+                 max_calls_per_second=None, fps=30.0, template_size=32,
+                 local_redetect=False, local_expand=2.0, local_input_size=400):
+        if mode not in REDETECT_MODES:
+            raise ValueError(f"未知的重检模式 '{mode}'，可选: {', '.join(REDETECT_MODES)}")
+        self.mode = mode
+        self.interval = interval
+        self.health_threshold = health_threshold
+        self.max_size_jump = max_size_jump
+        self.max_calls_per_second = max_calls_per_second
+        self.window = max(1, int(round(fps or 30.0)))
+        self.template_size = template_size
+        self.local_redetect = local_redetect
+        self.local_expand = local_expand
+        self.local_input_size = local_input_size
+
+        self.detector_calls = 0
+        self.last_health = None
+        self._recent_calls = collections.deque()
+        self._last_detection_frame = None
+        self._template = None
+        self._prev_area = None
+        self._track = collections.deque(maxlen=2)  # 最近两次成功跟踪的 (frame_idx, bbox)
+        self._backoff = 0  # health 模式下连续落空后的退避帧数
+        self._backoff_until = None
+
+    def state_dict(self):
+        """
+        可 JSON 序列化的内部状态 (计数、外观模板、最近的观测)，写入检查点以便恢复后与不中断的运行一致。
+        """
+        template = None
+        if self._template is not None:
+            template = base64.b64encode(self._template.astype(np.float32).tobytes()).decode('ascii')
+        return {
+            "detector_calls": self.detector_calls,
+            "last_health": self.last_health,
+            "recent_calls": list(self._recent_calls),
+            "last_detection_frame": self._last_detection_frame,
+            "template": template,
+            "prev_area": self._prev_area,
+            "track": [[frame_idx, [int(v) for v in bbox]] for frame_idx, bbox in self._track],
+            "backoff": self._backoff,
+            "backoff_until": self._backoff_until,
+        }
+
+    def load_state_dict(self, state):
+        self.detector_calls = state["detector_calls"]
+        self.last_health = state["last_health"]
+        self._recent_calls = collections.deque(state["recent_calls"])
+        self._last_detection_frame = state["last_detection_frame"]
+        self._template = None
+        if state["template"] is not None:
+            self._template = np.frombuffer(base64.b64decode(state["template"]), dtype=np.float32).reshape(
+                self.template_size, self.template_size)
+        self._prev_area = state["prev_area"]
+        self._track = collections.deque(((frame_idx, tuple(bbox)) for frame_idx, bbox in state["track"]), maxlen=2)
+        self._backoff = state["backoff"]
+        self._backoff_until = state["backoff_until"]
+
+    def _patch(self, frame, bbox):
+        cx, cy, w, h = bbox
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, int(cx - w // 2)), max(0, int(cy - h // 2))
+        x1, y1 = min(width, int(cx + w // 2)), min(height, int(cy + h // 2))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        gray = cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        patch = cv2.resize(gray, (self.template_size, self.template_size), interpolation=cv2.INTER_AREA)
+        patch = patch.astype(np.float32)
+        patch -= patch.mean()
+        norm = np.linalg.norm(patch)
+        return patch / norm if norm > 0 else None
+
+    def reset(self, frame, bbox):
+        """
+        跟踪器用新框 (cx, cy, w, h) 初始化后调用，记录外观模板与框面积。
+        """
+        if self.mode == 'health':
+            self._template = self._patch(frame, bbox)
+            self._backoff, self._backoff_until = 0, None
+        self._prev_area = max(1, bbox[2] * bbox[3])
+
+    def observe(self, frame_idx, bbox):
+        """
+        记录一帧成功跟踪 (或检测) 得到的框 (cx, cy, w, h)，用于运动预测。
+        """
+        self._track.append((frame_idx, bbox))
+
+    def predicted_box(self, frame_idx):
+        """
+        按最近两次观测的匀速运动外推 frame_idx 处的框；没有观测时返回 None。
+        """
+        if not self._track:
+            return None
+        last_idx, (cx, cy, w, h) = self._track[-1]
+        if len(self._track) == 2:
+            prev_idx, (pcx, pcy, _, _) = self._track[0]
+            steps = (frame_idx - last_idx) / max(1, last_idx - prev_idx)
+            cx += (cx - pcx) * steps
+            cy += (cy - pcy) * steps
+        return (int(cx), int(cy), w, h)
+
+    def record_detection(self, frame_idx, found=True):
+        """
+        每次实际运行检测器后调用，用于周期计数和速率限制。found 为 False 表示检测没有找到目标，
+        health 模式下据此延长退避。
+        """
+        self.detector_calls += 1
+        self._last_detection_frame = frame_idx
+        self._recent_calls.append(frame_idx)
+        if self.mode == 'health' and not found:
+            self._backoff = min(max(1, self.interval), max(1, self._backoff * 2))
+            self._backoff_until = frame_idx + self._backoff
+
+    def _within_budget(self, frame_idx):
+        if self.max_calls_per_second is None:
+            return True
+        while self._recent_calls and self._recent_calls[0] <= frame_idx - self.window:
+            self._recent_calls.popleft()
+        return len(self._recent_calls) < self.max_calls_per_second
+
+    def _suspect_drift(self, frame, bbox):
+        area = max(1, bbox[2] * bbox[3])
+        size_jump = abs(area - self._prev_area) / self._prev_area if self._prev_area else 0.0
+        self._prev_area = area
+        if size_jump > self.max_size_jump:
+            return True
+
+        if self._template is None:
+            return False
+        patch = self._patch(frame, bbox)
+        self.last_health = float((patch * self._template).sum()) if patch is not None else -1.0
+        return self.last_health < self.health_threshold
+
+    def should_redetect(self, frame_idx, frame, success, bbox):
+        """
+        根据本帧的跟踪结果判断是否需要重检。
+
+        Args:
+            frame_idx: 当前帧编号。
+            frame: 当前帧 (BGR)。
+            success: 跟踪器本帧是否成功。
+            bbox: 跟踪器输出的 (cx, cy, w, h)，失败时为 None。
+        """
+        if not success:
+            wanted = True
+        elif self.mode == 'periodic':
+            wanted = self._last_detection_frame is None or frame_idx - self._last_detection_frame >= self.interval
+        elif self.mode == 'health':
+            wanted = self._suspect_drift(frame, bbox)
+            if self._backoff_until is not None and frame_idx < self._backoff_until:
+                wanted = False
+        else:
+            wanted = False
+        return wanted and self._within_budget(frame_idx)
+
+
+def add_redetect_arguments(parser):
+    """
+    注册重检调度相关的命令行参数 (main_llm.py 与 run_all_videos.py 共用)。
+    """
+    parser.add_argument('--redetect_mode', type=str, default='on_failure', choices=REDETECT_MODES,
+                        help='重检策略: on_failure 仅在跟踪失败时重检; periodic 每隔固定帧数重检; health 根据跟踪健康度判断漂移后重检')
+    parser.add_argument('--redetect_interval', type=int, default=30,
+                        help='periodic 模式下两次检测之间的帧数; health 模式下重检落空后退避的最大帧数')
+    parser.add_argument('--health_threshold', type=float, default=0.5, help='health 模式下外观相似度低于该值视为漂移')
+    parser.add_argument('--max_size_jump', type=float, default=0.5, help='health 模式下相邻帧框面积相对变化超过该值视为漂移')
+    parser.add_argument('--max_detections_per_second', type=float, default=None, help='每秒视频内最多运行检测器的次数 (默认不限制)')
+    parser.add_argument('--local_redetect', action='store_true', help='重检时先在预测位置周围的局部窗口内检测，找不到再整帧检测')
+    parser.add_argument('--local_expand', type=float, default=2.0, help='局部重检窗口在预测框四周扩展的框尺寸倍数')
+    parser.add_argument('--local_input_size', type=int, default=400, help='局部重检时送入检测模型的最短边像素数')
+
+
+def redetect_arguments_to_argv(args):
+    """
+    把已解析的重检参数还原为命令行参数列表，用于转发给子进程。
+    """
+    argv = ['--redetect_mode', args.redetect_mode,
+            '--redetect_interval', str(args.redetect_interval),
+            '--health_threshold', str(args.health_threshold),
+            '--max_size_jump', str(args.max_size_jump)]
+    if args.max_detections_per_second is not None:
+        argv += ['--max_detections_per_second', str(args.max_detections_per_second)]
+    if args.local_redetect:
+        argv += ['--local_redetect',
+                 '--local_expand', str(args.local_expand),
+                 '--local_input_size', str(args.local_input_size)]
+    return argv
+
+
+def scheduler_factory_from_args(args):
+    """
+    返回一个以 fps 为参数、创建 RedetectionScheduler 的工厂函数。
+    """
+    def factory(fps):
+        return RedetectionScheduler(mode=args.redetect_mode, interval=args.redetect_interval,
+                                    health_threshold=args.health_threshold, max_size_jump=args.max_size_jump,
+                                    max_calls_per_second=args.max_detections_per_second, fps=fps,
+                                    local_redetect=args.local_redetect, local_expand=args.local_expand,
+                                    local_input_size=args.local_input_size)
+    return factory
@@ -0,0 +1,129 @@
+# src/result_writer.py
+
+import json
+import os
+
+import tracing
+from utils import save_results_to_json
+
+
+class StreamingResultWriter:
+    """
+    边跟踪边把逐帧结果追加到 <output_path>.partial.jsonl，处理结束后再生成原有 pred_bboxs 格式的结果文件。
+
+    日志格式 (每行一个 JSON 值):
+        第一行:  {"video": 编号, "query": 原始查询, "refined_query": 精炼短语}
+        逐帧:    [帧号, xmin, ymin, xmax, ymax]，该帧没有结果时为 [帧号]
+        检查点:  {"checkpoint": 帧号, 以及调用方提供的恢复状态 (见 QueryTrack.resume_state)}
+
+    调用方在每个可恢复的帧写完后用 checkpoint_due 询问，每 checkpoint_every 帧写一个检查点并 fsync。
+    """
+    def __init__(self, output_path, checkpoint_every=300):
+        self.output_path = output_path
+        self.log_path = output_path + '.partial.jsonl'
+        self.checkpoint_every = checkpoint_every
+        self.header = None
+        self._file = None
+        self._last_checkpoint = None
+
+    def start(self, video_key, query, refined_query):
+        """
+        开始一个新的结果日志 (覆盖已有的未完成日志)。
+        """
+        output_dir = os.path.dirname(self.output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.header = {"video": video_key, "query": query, "refined_query": refined_query}
+        self._file = open(self.log_path, 'w', encoding='utf-8')
+        self._file.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+
+    def resume(self):
+        """
+        读取未完成的日志，丢弃最后一个检查点之后的记录并以追加方式重新打开。
+
+        Returns:
+            dict | None: 日志头 ("video", "query", "refined_query")、检查点帧号 "frame" 与检查点中的恢复状态，
+            没有可用的日志或检查点时返回 None。
+        """
+        if not os.path.exists(self.log_path):
+            return None
+        header, checkpoint, keep_bytes = None, None, 0
+        with open(self.log_path, 'rb') as f:
+            offset = 0
+            for raw_line in f:
+                offset += len(raw_line)
+                try:
+                    record = json.loads(raw_line)
+                except ValueError:
+                    break  # 崩溃时写了一半的行
+                if header is None:
+                    if not isinstance(record, dict) or 'video' not in record:
+                        return None
+                    header = record
+                elif isinstance(record, dict) and 'checkpoint' in record:
+                    checkpoint, keep_bytes = record, offset
+        if checkpoint is None:
+            return None
+
+        with open(self.log_path, 'r+b') as f:
+            f.truncate(keep_bytes)
+        self.header = header
+        self._file = open(self.log_path, 'a', encoding='utf-8')
+        self._last_checkpoint = checkpoint['checkpoint']
+        state = {k: v for k, v in checkpoint.items() if k != 'checkpoint'}
+        return dict(header, frame=checkpoint['checkpoint'], **state)
+
+    def write(self, frame_idx, box):
+        """
+        追加一帧的结果。
+
+        Args:
+            box: {"xmin", "ymin", "xmax", "ymax"} 或空字典。
+        """
+        if box:
+            record = [frame_idx, box["xmin"], box["ymin"], box["xmax"], box["ymax"]]
+        else:
+            record = [frame_idx]
+        self._file.write(json.dumps(record) + '\n')
+
+    def checkpoint_due(self, frame_idx):
+        return self._last_checkpoint is None or frame_idx - self._last_checkpoint >= self.checkpoint_every
+
+    def checkpoint(self, frame_idx, state):
+        """
+        写一个检查点。state 为可 JSON 序列化的恢复状态，恢复时原样返回 (见 resume)。
+        """
+        with tracing.span("checkpoint"):
+            self._file.write(json.dumps({"checkpoint": frame_idx, **state}) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._last_checkpoint = frame_idx
+
+    def finalize(self):
+        """
+        关闭日志，生成与原来相同格式的结果文件，然后删除日志。
+        """
+        self.close()
+        pred_bboxs = {}
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            next(f)
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, list):
+                    frame_idx, box = record[0], record[1:]
+                    pred_bboxs[str(frame_idx)] = dict(zip(("xmin", "ymin", "xmax", "ymax"), box))
+
+        final_output = {
+            self.header["video"]: {
+                "query": self.header["query"],
+                "refined_query": self.header["refined_query"],
+                "pred_bboxs": pred_bboxs
+            }
+        }
+        save_results_to_json(final_output, self.output_path)
+        os.remove(self.log_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
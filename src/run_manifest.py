@@ -0,0 +1,64 @@
+# src/run_manifest.py
+
+import hashlib
+import json
+import os
+
+from disk_cache import DiskCache, hash_key
+
+# 检测器配置 (main_llm.py 与 run_all_videos.py 构建 Detector 时使用同一份)，也计入运行哈希
+DETECTOR_CONFIG = {
+    'model_path': 'IDEA-Research/grounding-dino-base',
+    'box_threshold': 0.3,
+    'text_threshold': 0.3,
+}
+
+
+def file_digest(path, cache_dir='.cache/file_hash', chunk_size=8 * 1024 * 1024):
+    """
+    返回文件内容的 SHA-256。结果按 (绝对路径、大小、修改时间) 缓存到磁盘，文件未改动时不再重新读取。
+    """
+    stat = os.stat(path)
+    key = hash_key(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    cache = DiskCache(cache_dir, max_bytes=4 * 1024 * 1024) if cache_dir else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if cache is not None:
+        cache.put(key, digest)
+    return digest
+
+
+def compute_run_hash(video_path, task_metadata, config):
+    """
+    计算一次视频推理的内容哈希: 视频文件内容、该视频的任务条目 (不含真值框)，以及影响推理结果的配置。
+
+    精炼短语由 (start帧、查询、精炼模型与提示模板) 决定并被缓存，这些输入已分别包含在视频内容、
+    任务条目与 config 中，因此这里不需要先调用 API 拿到短语。
+
+    Args:
+        task_metadata (dict): TaskStore.metadata() 返回的任务条目。
+        config (dict): 检测器阈值、跟踪器与重检参数等，值需可 JSON 序列化。
+    """
+    return hash_key(file_digest(video_path),
+                    json.dumps(task_metadata, sort_keys=True),
+                    json.dumps(config, sort_keys=True))
+
+
+def read_result_entry(result_json_path, video_key):
+    """
+    读取已有结果文件中某个视频的条目 (含 run_hash、scoring_hash、average_iou 等)；
+    文件不存在或无法解析时返回空字典。
+    """
+    try:
+        with open(result_json_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get(video_key, {})
+    except (OSError, ValueError, AttributeError):
+        return {}
@@ -0,0 +1,97 @@
+# src/stub_api_server.py
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """
+    模拟智谱AI 的 chat/completions 接口，按配置的延迟和失败率返回固定短语。
+    """
+    def do_POST(self):
+        config = self.server.stub_config
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with config['lock']:
+            config['requests'] += 1
+        time.sleep(config['latency'])
+
+        if random.random() < config['failure_rate']:
+            self._reply(429, {"error": {"code": "1302", "message": "stub: rate limited"}})
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._reply(404, {"error": {"message": f"stub: unknown path {self.path}"}})
+            return
+
+        try:
+            model = json.loads(body).get('model', 'glm-4v')
+        except json.JSONDecodeError:
+            model = 'glm-4v'
+        self._reply(200, {
+            "id": uuid.uuid4().hex,
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": config['phrase']},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host='127.0.0.1', port=0, phrase='the target object', latency=0.0, failure_rate=0.0):
+    """
+    在后台线程中启动桩服务，返回 (server, base_url)。用完后调用 server.shutdown()。
+
+    APIQueryRefiner 使用 base_url=<返回的地址> 即可对接；智谱SDK要求密钥形如 'id.secret'，
+    桩服务不做校验，任意此格式的字符串 (例如 'stub.stub') 均可。
+    server.stub_config['requests'] 记录收到的请求数。
+    """
+    server = ThreadingHTTPServer((host, port), _StubHandler)
+    server.daemon_threads = True
+    server.stub_config = {
+        'phrase': phrase,
+        'latency': latency,
+        'failure_rate': failure_rate,
+        'requests': 0,
+        'lock': threading.Lock(),
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}/api/paas/v4"
+    return server, base_url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地智谱AI API 桩服务，用于离线测试查询精炼流程")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--phrase', type=str, default='the target object', help='所有请求返回的短语')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟网络延迟 (秒)')
+    parser.add_argument('--failure_rate', type=float, default=0.0, help='随机返回 429 错误的概率')
+
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.host, args.port, args.phrase, args.latency, args.failure_rate)
+    print(f"桩服务已启动: --api_base_url {base_url} --api_key stub.stub")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
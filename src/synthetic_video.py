@@ -0,0 +1,106 @@
+# src/synthetic_video.py
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+# 合成视频中的目标与干扰物: (名称, BGR 颜色)。目标固定为第一个
+SYNTHETIC_OBJECTS = [
+    ('red rectangle', (40, 40, 220)),
+    ('green rectangle', (60, 200, 60)),
+    ('blue rectangle', (220, 120, 40)),
+    ('yellow rectangle', (40, 220, 230)),
+]
+
+
+def generate_synthetic_video(video_path, width=640, height=480, num_frames=120, fps=30.0, num_distractors=2, seed=0):
+    """
+    生成一段有若干彩色矩形在纹理背景上匀速运动 (碰到边缘反弹) 的视频。
+
+    第一个矩形为目标，其余为干扰物；背景是固定的随机噪声纹理，便于跟踪器提取特征。
+
+    Returns:
+        np.ndarray: 形状 (num_frames, 4) 的 int32 数组，每帧目标的 (xmin, ymin, xmax, ymax)。
+    """
+    rng = np.random.default_rng(seed)
+    output_dir = os.path.dirname(video_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    background = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (5, 5), 0)
+    num_objects = min(len(SYNTHETIC_OBJECTS), 1 + num_distractors)
+    sizes = rng.uniform(0.08, 0.2, (num_objects, 2)) * (width, height)
+    positions = rng.uniform(0, 1, (num_objects, 2)) * ((width, height) - sizes)
+    velocities = rng.uniform(-1, 1, (num_objects, 2)) * max(width, height) / 150.0
+
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"错误: 无法创建视频文件 {video_path}")
+
+    gt_boxes = np.zeros((num_frames, 4), dtype=np.int32)
+    try:
+        for frame_idx in range(num_frames):
+            frame = background.copy()
+            # 目标最后绘制，始终位于最上层
+            for obj in reversed(range(num_objects)):
+                x0, y0 = positions[obj].astype(int)
+                x1, y1 = (positions[obj] + sizes[obj]).astype(int)
+                cv2.rectangle(frame, (x0, y0), (x1, y1), SYNTHETIC_OBJECTS[obj][1], thickness=-1)
+                if obj == 0:
+                    gt_boxes[frame_idx] = (x0, y0, x1, y1)
+            writer.write(frame)
+
+            positions += velocities
+            for axis, limit in enumerate((width, height)):
+                out = (positions[:, axis] < 0) | (positions[:, axis] + sizes[:, axis] > limit)
+                velocities[out, axis] *= -1
+                positions[:, axis] = np.clip(positions[:, axis], 0, limit - sizes[:, axis])
+    finally:
+        writer.release()
+    return gt_boxes
+
+
+def write_synthetic_tasks(videos_dir, json_path, segments, width=640, height=480, fps=30.0, lead_in=5, seed=0):
+    """
+    为每个 (video_key, 帧数) 生成一段合成视频，并写出与 sample_video.json 同格式的任务文件。
+
+    每个任务的 temp_gt 从第 lead_in 帧开始，覆盖 帧数 帧；目标是红色矩形。
+
+    Args:
+        videos_dir: 合成视频的输出目录 (文件名为 video_<key>.mp4)。
+        json_path: 任务JSON文件的输出路径。
+        segments: [(video_key, 帧数), ...]。
+
+    Returns:
+        dict: 写出的任务数据。
+    """
+    tasks = {}
+    for i, (video_key, length) in enumerate(segments):
+        video_name = f"video_{video_key}.mp4"
+        total_frames = lead_in + length
+        gt_boxes = generate_synthetic_video(os.path.join(videos_dir, video_name), width, height,
+                                            total_frames, fps, seed=seed + i)
+        tasks[str(video_key)] = {
+            'vid': video_name,
+            'fps': fps,
+            'width': width,
+            'height': height,
+            'frame_count': total_frames,
+            'temp_gt': {'begin_fid': lead_in, 'end_fid': total_frames - 1},
+            'id': str(video_key),
+            'qtype': 'declar',
+            'sentence': {'description': f"there is a {SYNTHETIC_OBJECTS[0][0]} moving around.",
+                         'type': 'object', 'target_id': 0},
+            'target_category': SYNTHETIC_OBJECTS[0][0],
+            'target_bboxs': [{'xmin': int(x0), 'ymin': int(y0), 'xmax': int(x1), 'ymax': int(y1)}
+                             for x0, y0, x1, y1 in gt_boxes[lead_in:]],
+        }
+
+    output_dir = os.path.dirname(json_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(tasks, f)
+    return tasks
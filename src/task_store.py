@@ -0,0 +1,290 @@
+# src/task_store.py
+
+import json
+import mmap
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# 编译后的任务库目录结构:
+#   CURRENT        当前版本子目录的名字；重新编译时写入新的版本目录后原子地替换该文件，
+#                  其他进程不会看到缺失或写了一半的任务库
+#   v-*/           各版本的任务库，内容如下:
+#   manifest.json  源JSON文件的大小与修改时间，用于判断是否需要重新编译
+#   keys.npy       视频编号数组 (定长 Unicode，宽度取最长编号，不会截断)
+#   order.npy      keys.npy 的排序下标，查找时配合 np.searchsorted 做二分
+#   vids.npy       与 keys.npy 逐行对应的 'vid' 字段 (没有时为空串)，宽度同样取最长值
+#   vid_order.npy  vids.npy 的排序下标，用于按视频文件名找出引用它的全部任务
+#   index.npy      与 keys.npy 逐行对应: 元数据偏移/长度、真值框偏移/长度
+#   meta.bin       各视频除 target_bboxs 以外的元数据 (UTF-8 JSON，首尾相接)
+#   bboxes.npy     所有视频的真值框，连续存放的 (N, 4) int32 xyxy 数组
+_INDEX_DTYPE = np.dtype([
+    ('meta_off', 'i8'), ('meta_len', 'i8'),
+    ('bbox_off', 'i8'), ('bbox_len', 'i8'),
+])
+# 库格式版本，写入 manifest；格式变化后旧库会被自动重新编译
+_STORE_FORMAT = 4
+_POINTER = 'CURRENT'
+
+# 已打开的任务库，按库目录缓存，避免每次调用都重新打开
+_open_stores = {}
+
+
+def _bbox_to_xyxy(bbox):
+    """
+    兼容两种真值框格式: {'xmin':, 'ymin':, 'xmax':, 'ymax':} 或 [x, y, w, h]。
+    """
+    if isinstance(bbox, dict) and 'xmin' in bbox:
+        return (bbox['xmin'], bbox['ymin'], bbox['xmax'], bbox['ymax'])
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        x, y, w, h = bbox
+        return (x, y, x + w, y + h)
+    raise ValueError(f"无法识别的真值框格式: {bbox!r}")
+
+
+def _fixed_width(values, what):
+    """
+    把字符串列表存为宽度恰好容纳最长值的定长 Unicode 数组，并确认没有被截断或改写。
+    """
+    array = np.array(values, dtype=f"U{max([len(v) for v in values] + [1])}")
+    if array.tolist() != values:
+        raise ValueError(f"{what}无法无损地存入定长 Unicode 数组 (含结尾空字符?)")
+    return array
+
+
+def _source_signature(json_path):
+    st = os.stat(json_path)
+    return {'source_size': st.st_size, 'source_mtime_ns': st.st_mtime_ns, 'format': _STORE_FORMAT}
+
+
+def _read_manifest(version_dir):
+    try:
+        with open(os.path.join(version_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _current_version(store_dir):
+    """
+    CURRENT 指向的版本目录，没有时返回 None。
+    """
+    try:
+        with open(os.path.join(store_dir, _POINTER), 'r', encoding='utf-8') as f:
+            return os.path.join(store_dir, f.read().strip())
+    except OSError:
+        return None
+
+
+def _remove_stale_versions(store_dir, signature):
+    """
+    删除与当前源文件不符的旧版本 (以及旧格式留下的文件)。与当前源文件一致的版本都保留，
+    并发编译的进程不会删掉彼此的结果；正在编译的 .build-* 目录也不动。
+    已经打开旧版本的进程仍可通过内存映射继续读取它 (内容自洽，只是对应旧的源文件)。
+    """
+    for name in os.listdir(store_dir):
+        path = os.path.join(store_dir, name)
+        if name == _POINTER or name.startswith('.build-') or name.startswith('.pointer-'):
+            continue
+        if name.startswith('v-') and _read_manifest(path) == signature:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def compile_task_store(json_path, store_dir):
+    """
+    将任务JSON一次性编译为带偏移索引的二进制任务库。
+
+    Args:
+        json_path (str): 原始任务/真值JSON文件路径。
+        store_dir (str): 输出目录。编译写入新的版本子目录，完成后原子地替换 CURRENT 指针，
+                         中途失败不会留下半成品，也不会影响正在读取旧版本的进程。
+
+    Returns:
+        str: 新版本目录的路径。
+    """
+    # 先取签名再读文件: 读取期间源文件若被改动，下次打开时会按新签名重新编译
+    signature = _source_signature(json_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    keys = _fixed_width(list(data.keys()), "视频编号")
+    vids = _fixed_width([v if isinstance(v := task_info.get('vid'), str) else '' for task_info in data.values()],
+                        "视频文件名")
+    index = np.zeros(len(data), dtype=_INDEX_DTYPE)
+    meta_chunks, bbox_chunks = [], []
+    meta_off = bbox_off = 0
+    for i, task_info in enumerate(data.values()):
+        meta = {k: v for k, v in task_info.items() if k != 'target_bboxs'}
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        boxes = [_bbox_to_xyxy(b) for b in task_info.get('target_bboxs') or []]
+
+        index[i] = (meta_off, len(meta_bytes), bbox_off, len(boxes))
+        meta_chunks.append(meta_bytes)
+        bbox_chunks.extend(boxes)
+        meta_off += len(meta_bytes)
+        bbox_off += len(boxes)
+
+    bboxes = np.asarray(bbox_chunks, dtype=np.int32).reshape(-1, 4)
+
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.build-', dir=store_dir)
+    try:
+        np.save(os.path.join(tmp_dir, 'keys.npy'), keys)
+        np.save(os.path.join(tmp_dir, 'order.npy'), np.argsort(keys, kind='stable'))
+        np.save(os.path.join(tmp_dir, 'vids.npy'), vids)
+        np.save(os.path.join(tmp_dir, 'vid_order.npy'), np.argsort(vids, kind='stable'))
+        np.save(os.path.join(tmp_dir, 'index.npy'), index)
+        np.save(os.path.join(tmp_dir, 'bboxes.npy'), bboxes)
+        with open(os.path.join(tmp_dir, 'meta.bin'), 'wb') as f:
+            f.write(b''.join(meta_chunks))
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(signature, f)
+        version_dir = os.path.join(store_dir, 'v-' + os.path.basename(tmp_dir)[len('.build-'):])
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    fd, pointer_path = tempfile.mkstemp(prefix='.pointer-', dir=store_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(pointer_path, os.path.join(store_dir, _POINTER))
+    _remove_stale_versions(store_dir, signature)
+    return version_dir
+
+
+class TaskStore:
+    """
+    只读、按需加载的任务库。编号、索引与真值框都通过内存映射读取，
+    打开库不需要把索引读入内存；按视频编号查找是在排序后的编号上二分，O(log N)。
+
+    同时提供与原始 JSON 字典兼容的 `in` / `[]` / `.get()` 接口，
+    取出的任务字典与 json.load 得到的内容一致。
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._keys = np.load(os.path.join(store_dir, 'keys.npy'), mmap_mode='r')
+        self._order = np.load(os.path.join(store_dir, 'order.npy'), mmap_mode='r')
+        self._vids = np.load(os.path.join(store_dir, 'vids.npy'), mmap_mode='r')
+        self._vid_order = np.load(os.path.join(store_dir, 'vid_order.npy'), mmap_mode='r')
+        self._index = np.load(os.path.join(store_dir, 'index.npy'), mmap_mode='r')
+        self._bboxes = np.load(os.path.join(store_dir, 'bboxes.npy'), mmap_mode='r')
+
+        meta_path = os.path.join(store_dir, 'meta.bin')
+        self._meta_file = open(meta_path, 'rb')
+        self._meta = mmap.mmap(self._meta_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(meta_path) else b''
+
+    def _row(self, video_key):
+        """
+        二分查找视频编号所在的行号，不存在时返回 None。
+        """
+        if not isinstance(video_key, str) or not len(self._keys):
+            return None
+        pos = int(np.searchsorted(self._keys, video_key, sorter=self._order))
+        if pos < len(self._order):
+            row = int(self._order[pos])
+            if self._keys[row] == video_key:
+                return row
+        return None
+
+    def _entry(self, video_key):
+        row = self._row(video_key)
+        if row is None:
+            raise KeyError(video_key)
+        entry = self._index[row]
+        return (int(entry['meta_off']), int(entry['meta_len']),
+                int(entry['bbox_off']), int(entry['bbox_len']))
+
+    def __contains__(self, video_key):
+        return self._row(video_key) is not None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        """
+        按原始JSON中的顺序逐个返回视频编号。
+        """
+        return (str(key) for key in self._keys)
+
+    def keys_for_vid(self, vid):
+        """
+        返回 'vid' 字段等于 vid 的全部任务编号 (按原始JSON中的顺序)，不需要解析任何元数据。
+        """
+        if not isinstance(vid, str) or not vid:
+            return []
+        lo = int(np.searchsorted(self._vids, vid, side='left', sorter=self._vid_order))
+        hi = int(np.searchsorted(self._vids, vid, side='right', sorter=self._vid_order))
+        return [str(self._keys[row]) for row in np.sort(self._vid_order[lo:hi])]
+
+    def metadata(self, video_key):
+        """
+        返回视频的元数据字典 (不含 target_bboxs)。
+        """
+        meta_off, meta_len, _, _ = self._entry(video_key)
+        return json.loads(bytes(self._meta[meta_off:meta_off + meta_len]).decode('utf-8'))
+
+    def gt_boxes(self, video_key):
+        """
+        返回该视频的真值框，(N, 4) int32 xyxy 数组 (只读内存映射视图)。
+        """
+        _, _, bbox_off, bbox_len = self._entry(video_key)
+        return self._bboxes[bbox_off:bbox_off + bbox_len]
+
+    def __getitem__(self, video_key):
+        task_info = self.metadata(video_key)
+        task_info['target_bboxs'] = [
+            {'xmin': int(x1), 'ymin': int(y1), 'xmax': int(x2), 'ymax': int(y2)}
+            for x1, y1, x2, y2 in self.gt_boxes(video_key)
+        ]
+        return task_info
+
+    def get(self, video_key, default=None):
+        return self[video_key] if video_key in self else default
+
+    def close(self):
+        if isinstance(self._meta, mmap.mmap):
+            self._meta.close()
+        self._meta_file.close()
+
+
+def open_task_store(json_path, store_dir=None):
+    """
+    打开与任务JSON对应的任务库；不存在或源文件已改变时先自动编译。
+    同一目录的任务库在进程内只打开一次，之后直接复用。
+
+    Args:
+        json_path (str): 原始任务/真值JSON文件路径。
+        store_dir (str, optional): 任务库目录，默认为 `<json_path>.store`。
+    """
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"Error: JSON task file not found at path: {json_path}")
+    store_dir = os.path.abspath(store_dir or f"{json_path}.store")
+    for attempt in range(3):
+        signature = _source_signature(json_path)
+        cached = _open_stores.get(store_dir)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        try:
+            version_dir = _current_version(store_dir)
+            if version_dir is None or _read_manifest(version_dir) != signature:
+                version_dir = compile_task_store(json_path, store_dir)
+            store = TaskStore(version_dir)
+            break
+        except FileNotFoundError:
+            # 源文件在此期间又被改动，该版本已被另一个进程的编译清理掉，按新签名重试
+            if attempt == 2:
+                raise
+    if cached is not None:
+        cached[1].close()  # 源文件已改变，释放旧版本的内存映射与文件句柄
+    _open_stores[store_dir] = (signature, store)
+    return store
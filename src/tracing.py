@@ -0,0 +1,226 @@
+# src/tracing.py
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# 全局追踪器；为 None 时所有埋点都直接返回，不做任何记录
+_tracer = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+    """
+    记录耗时区间 (span) 与计数器，按视频汇总各阶段耗时，并导出 Chrome trace 格式
+    (可直接在 chrome://tracing 或 https://ui.perfetto.dev 中打开)。
+
+    output_dir 不为 None 时，每个视频结束 (见 video()) 都会写出
+    video_<key>.trace.json 与 video_<key>.metrics.json，然后清空该视频的事件，内存占用不随视频数增长。
+    """
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        self.events = []
+        self.metrics = {}
+        self._video_key = None
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _current(self):
+        return self.metrics.setdefault(self._video_key, {
+            "counters": collections.Counter(),
+            "stage_seconds": collections.defaultdict(float),
+            "stage_calls": collections.Counter(),
+        })
+
+    def record(self, name, start, end, args=None):
+        event = {"name": name, "ph": "X", "pid": self._pid, "tid": threading.get_ident(),
+                 "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            current = self._current()
+            current["stage_seconds"][name] += end - start
+            current["stage_calls"][name] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._current()["counters"][name] += n
+
+    def span(self, name, **args):
+        return _Span(self, name, args)
+
+    def video_metrics(self, video_key):
+        """
+        返回某个视频的指标汇总: 计数器、各阶段总耗时 (秒) 与调用次数。
+        """
+        current = self.metrics.get(video_key)
+        if current is None:
+            return {"counters": {}, "stage_seconds": {}, "stage_calls": {}}
+        return {"counters": dict(current["counters"]),
+                "stage_seconds": dict(current["stage_seconds"]),
+                "stage_calls": dict(current["stage_calls"])}
+
+    def export_chrome_trace(self, path, events=None):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events if events is None else events,
+                       "displayTimeUnit": "ms"}, f)
+
+    @contextlib.contextmanager
+    def video(self, video_key):
+        previous, self._video_key = self._video_key, str(video_key)
+        first_event = len(self.events)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.record("process_video", start, time.perf_counter(), {"video": str(video_key)})
+            if self.output_dir is not None:
+                with self._lock:
+                    events = self.events[first_event:]
+                    del self.events[first_event:]
+                    metrics = self.video_metrics(str(video_key))
+                    self.metrics.pop(str(video_key), None)
+                self.export_chrome_trace(os.path.join(self.output_dir, f"video_{video_key}.trace.json"), events)
+                with open(os.path.join(self.output_dir, f"video_{video_key}.metrics.json"), 'w', encoding='utf-8') as f:
+                    json.dump(metrics, f, indent=4)
+            self._video_key = previous
+
+
+def enable_tracing(output_dir=None):
+    """
+    开启全局追踪并返回 Tracer。
+    """
+    global _tracer
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    _tracer = Tracer(output_dir)
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **args):
+    """
+    用法: with tracing.span("stage"): ...  未开启追踪时返回一个空操作的上下文管理器。
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def count(name, n=1):
+    if _tracer is not None:
+        _tracer.count(name, n)
+
+
+def video(video_key):
+    """
+    把其中发生的所有 span 与计数归入某个视频；未开启追踪时为空操作。
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.video(video_key)
+
+
+def traced(name):
+    """
+    函数装饰器：开启追踪时把每次调用记录为名为 name 的 span。
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summarize_trace_dir(trace_dir):
+    """
+    合并目录下所有 video_<key>.metrics.json，返回 {video_key: 指标} 以及全部视频的合计。
+    """
+    per_video = {}
+    totals = {"counters": collections.Counter(), "stage_seconds": collections.defaultdict(float),
+              "stage_calls": collections.Counter()}
+    for filename in sorted(os.listdir(trace_dir)):
+        if not (filename.startswith('video_') and filename.endswith('.metrics.json')):
+            continue
+        video_key = filename[len('video_'):-len('.metrics.json')]
+        with open(os.path.join(trace_dir, filename), 'r', encoding='utf-8') as f:
+            metrics = json.load(f)
+        per_video[video_key] = metrics
+        totals["counters"].update(metrics["counters"])
+        totals["stage_calls"].update(metrics["stage_calls"])
+        for stage, seconds in metrics["stage_seconds"].items():
+            totals["stage_seconds"][stage] += seconds
+    return {"videos": per_video,
+            "total": {key: dict(value) for key, value in totals.items()}}
+
+
+def add_tracing_arguments(parser):
+    """
+    注册追踪相关的命令行参数 (main_llm.py 与 run_all_videos.py 共用)。
+    """
+    parser.add_argument('--trace_dir', type=str, default=None,
+                        help='开启追踪，并把每个视频的 Chrome trace 与指标汇总写入该目录 (默认关闭)')
+
+
+def tracing_arguments_to_argv(args):
+    """
+    把已解析的追踪参数还原为命令行参数列表，用于转发给子进程。
+    """
+    return ['--trace_dir', args.trace_dir] if args.trace_dir else []
+
+
+def configure_tracing_from_args(args):
+    """
+    按命令行参数开启追踪；未指定 --trace_dir 时保持关闭。
+    """
+    if getattr(args, 'trace_dir', None):
+        return enable_tracing(args.trace_dir)
+    return None
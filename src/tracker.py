@@ -1,18 +1,213 @@
 # tracker.py
+import os
 import cv2
 
+import tracing
+
+
+# 跟踪器后端注册表: 名称 -> (速度档位, cv2 中的构造函数路径)
+# 速度档位仅作粗略参考: fastest > fast > medium > slow。
+# Nano/Vit 为基于 DNN 的跟踪器，需要在 model_dir 中提供对应的 ONNX 模型文件。
+TRACKER_BACKENDS = {
+    'MOSSE': ('fastest', 'legacy.TrackerMOSSE_create'),
+    'KCF': ('fast', 'TrackerKCF_create'),
+    'Nano': ('fast', 'TrackerNano_create'),
+    'MIL': ('medium', 'TrackerMIL_create'),
+    'Vit': ('medium', 'TrackerVit_create'),
+    'CSRT': ('slow', 'TrackerCSRT_create'),
+}
+
+
+def _resolve(path):
+    obj = cv2
+    for part in path.split('.'):
+        obj = getattr(obj, part, None)
+        if obj is None:
+            return None
+    return obj
+
+
+def available_backends():
+    """
+    返回当前 OpenCV 构建中可用的跟踪器后端名称 (按速度从快到慢)。
+    """
+    return [name for name, (_, path) in TRACKER_BACKENDS.items() if _resolve(path) is not None]
+
+
+def _create_backend(tracker_type, model_dir):
+    constructor = _resolve(TRACKER_BACKENDS[tracker_type][1])
+    if tracker_type == 'Nano':
+        params = cv2.TrackerNano_Params()
+        params.backbone = os.path.join(model_dir, 'nanotrack_backbone_sim.onnx')
+        params.neckhead = os.path.join(model_dir, 'nanotrack_head_sim.onnx')
+        return constructor(params)
+    if tracker_type == 'Vit':
+        params = cv2.TrackerVit_Params()
+        params.net = os.path.join(model_dir, 'object_tracking_vittrack_2023sep.onnx')
+        return constructor(params)
+    return constructor()
+
+
+SCALE_MODES = ('none', 'downscale', 'roi')
+
+
+class MotionGate:
+    """
+    稀疏跟踪的关键帧选择：估计目标自上一个关键帧以来的位移，以目标框尺寸为单位。
+
+    每帧把上一个关键帧目标框内的区域缩小成 patch_size×patch_size 的灰度小图，与前一帧同一区域的小图比较，
+    灰度差超过 pixel_threshold 的像素比例即为这一帧的位移估计：目标平移 (dx, dy) 时，
+    框内发生变化的面积约为 |dx|/w + |dy|/h。逐帧估计相加得到累计位移，匀速运动不会在阈值以下悄悄累积。
+
+    累计位移超过 motion_threshold (框尺寸的比例)，或距上一个关键帧已有 max_skip 帧时，当前帧是关键帧 (需要运行跟踪器)；
+    否则跳过该帧，其结果由前后两个关键帧插值得到。每帧位移超过阈值的快速运动因此逐帧跟踪。
+    没有参考小图 (尚未初始化或跟踪失败) 时每帧都是关键帧。
+    """
+    def __init__(self, max_skip=8, motion_threshold=0.02, patch_size=64, pixel_threshold=20):
+        self.max_skip = max_skip
+        self.motion_threshold = motion_threshold
+        self.patch_size = patch_size
+        self.pixel_threshold = pixel_threshold
+        self._roi = None
+        self._prev = None
+        self._since_key = 0
+        self._displacement = 0.0
+
+    def _patch(self, frame):
+        x0, y0, x1, y1 = self._roi
+        small = cv2.resize(frame[y0:y1, x0:x1], (self.patch_size, self.patch_size), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def reset(self, frame, bbox):
+        """
+        以当前帧 (关键帧) 与目标框作为新的参考。
+        """
+        cx, cy, w, h = bbox
+        frame_h, frame_w = frame.shape[:2]
+        x0, y0 = max(0, int(cx - w / 2)), max(0, int(cy - h / 2))
+        x1, y1 = min(frame_w, int(cx + w / 2) + 1), min(frame_h, int(cy + h / 2) + 1)
+        self._since_key = 0
+        self._displacement = 0.0
+        if x1 <= x0 or y1 <= y0:
+            self.clear()
+            return
+        self._roi = (x0, y0, x1, y1)
+        self._prev = self._patch(frame)
+
+    def clear(self):
+        self._roi = None
+        self._prev = None
+        self._since_key = 0
+        self._displacement = 0.0
+
+    def is_keyframe(self, frame):
+        if self._prev is None:
+            return True
+        self._since_key += 1
+        patch = self._patch(frame)
+        self._displacement += float((cv2.absdiff(patch, self._prev) > self.pixel_threshold).mean())
+        self._prev = patch
+        return self._since_key >= self.max_skip or self._displacement > self.motion_threshold
+
+
+def interpolate_bbox(bbox0, bbox1, t):
+    """
+    两个 (cx, cy, w, h) 框之间的线性插值，t 在 [0, 1] 内。
+    """
+    return tuple(int(round(a + (b - a) * t)) for a, b in zip(bbox0, bbox1))
+
+
 class Tracker:
     """
-    OpenCV CSRT 跟踪器的封装。
+    OpenCV 跟踪器的封装，具体算法由 tracker_type 从 TRACKER_BACKENDS 中选择 (默认 CSRT)。
+
+    scale_mode 控制送入跟踪器的图像:
+        none:      原始分辨率整帧 (原有行为)。
+        downscale: 整帧按比例缩小后跟踪。
+        roi:       只取目标周围 (四周各留 roi_margin 倍框尺寸) 的固定大小窗口，并按比例缩小后跟踪；
+                   目标接近窗口边缘时以当前位置为中心重新取窗口并重新初始化跟踪器。
+    缩放比例在每次初始化时根据目标大小自适应选择，使目标长边约为 target_size 像素 (不放大)。
+    输入输出的框始终是原始分辨率下的 (cx, cy, w, h)。
+
+    max_skip > 1 时启用稀疏跟踪：调用方每帧先询问 needs_update()，只有关键帧 (见 MotionGate) 才调用 update()，
+    跳过的帧由调用方在前后两个关键帧之间插值。
     """
-    def __init__(self, tracker_type='CSRT'):
+    def __init__(self, tracker_type='CSRT', model_dir='models', scale_mode='none', target_size=96, roi_margin=2.0,
+                 max_skip=1, motion_threshold=0.02):
         """
         初始化跟踪器。
+
+        Args:
+            tracker_type: 跟踪器后端名称，见 TRACKER_BACKENDS。
+            model_dir: DNN 跟踪器 (Nano/Vit) 的 ONNX 模型所在目录。
+            scale_mode: 'none'、'downscale' 或 'roi'。
+            target_size: 缩放后目标长边的期望像素数。
+            roi_margin: roi 模式下窗口在目标四周各扩展的框尺寸倍数。
+            max_skip: 稀疏跟踪时两个关键帧之间最多相隔的帧数，1 表示每帧都跟踪。
+            motion_threshold: 稀疏跟踪时自上一个关键帧以来允许的累计位移 (目标框尺寸的比例)。
         """
+        if tracker_type not in TRACKER_BACKENDS:
+            raise ValueError(f"未知的跟踪器类型 '{tracker_type}'，可选: {', '.join(TRACKER_BACKENDS)}")
+        if tracker_type not in available_backends():
+            raise ValueError(f"当前 OpenCV 构建不支持跟踪器 '{tracker_type}' (需要 opencv-contrib-python)。")
+        if scale_mode not in SCALE_MODES:
+            raise ValueError(f"未知的缩放模式 '{scale_mode}'，可选: {', '.join(SCALE_MODES)}")
         self.tracker_type = tracker_type
+        self.model_dir = model_dir
+        self.scale_mode = scale_mode
+        self.target_size = target_size
+        self.roi_margin = roi_margin
+        self.speed_tier, constructor_path = TRACKER_BACKENDS[tracker_type]
+        self._legacy = constructor_path.startswith('legacy.')
         self.tracker = None
+        self._scale = 1.0
+        self._roi = None  # (x0, y0, w, h)，原始分辨率坐标
+        self.gate = MotionGate(max_skip, motion_threshold) if max_skip > 1 else None
         print(f"跟踪器已初始化，类型为：{self.tracker_type}")
 
+    def _prepare(self, frame):
+        """
+        按当前窗口与缩放比例生成送入跟踪器的图像。
+        """
+        if self._roi is not None:
+            x0, y0, w, h = self._roi
+            frame = frame[y0:y0 + h, x0:x0 + w]
+        if self._scale != 1.0:
+            frame = cv2.resize(frame, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        return frame
+
+    def _choose_roi(self, frame, bbox):
+        cx, cy, w, h = bbox
+        frame_h, frame_w = frame.shape[:2]
+        roi_w = min(frame_w, int(w * (1 + 2 * self.roi_margin)) + 16)
+        roi_h = min(frame_h, int(h * (1 + 2 * self.roi_margin)) + 16)
+        # 窗口尺寸固定，靠近画面边缘时平移而不是裁小
+        x0 = min(max(0, cx - roi_w // 2), frame_w - roi_w)
+        y0 = min(max(0, cy - roi_h // 2), frame_h - roi_h)
+        return (int(x0), int(y0), int(roi_w), int(roi_h))
+
+    def _init_backend(self, frame, bbox):
+        cx, cy, w, h = bbox
+        if self.scale_mode != 'none':
+            self._scale = min(1.0, self.target_size / max(1, w, h))
+        self._roi = self._choose_roi(frame, bbox) if self.scale_mode == 'roi' else None
+
+        # OpenCV 跟踪器需要 (x_min, y_min, w, h) 格式，坐标相对于送入的图像
+        x_min = cx - w // 2
+        y_min = cy - h // 2
+        if self._roi is not None:
+            x_min -= self._roi[0]
+            y_min -= self._roi[1]
+        init_bbox_format = (x_min * self._scale, y_min * self._scale, w * self._scale, h * self._scale)
+
+        self.tracker = _create_backend(self.tracker_type, self.model_dir)
+        # cv2.legacy 接口要求浮点坐标，新接口要求整数坐标
+        if self._legacy:
+            self.tracker.init(self._prepare(frame), tuple(float(v) for v in init_bbox_format))
+        else:
+            self.tracker.init(self._prepare(frame), tuple(int(round(v)) for v in init_bbox_format))
+
+    @tracing.traced("tracker.initialize")
     def initialize(self, frame, bbox):
         """
         使用第一帧和边界框初始化跟踪器。
@@ -21,16 +216,23 @@ class Tracker:
             frame: 视频的第一帧。
             bbox: 物体的初始边界框 (cx, cy, w, h)。
         """
-        # CSRT 跟踪器需要 (x_min, y_min, w, h) 格式
+        self._init_backend(frame, bbox)
+        if self.gate is not None:
+            self.gate.reset(frame, bbox)
+        tracing.count("tracker_inits")
         cx, cy, w, h = bbox
-        x_min = cx - w // 2
-        y_min = cy - h // 2
-        init_bbox_format = (x_min, y_min, w, h)
+        print(f"跟踪器已使用边界框 {(cx - w // 2, cy - h // 2, w, h)} 初始化 (缩放 {self._scale:.2f})")
 
-        self.tracker = cv2.TrackerCSRT_create()
-        self.tracker.init(frame, init_bbox_format)
-        print(f"跟踪器已使用边界框 {init_bbox_format} 初始化")
+    def needs_update(self, frame):
+        """
+        稀疏跟踪时判断当前帧是否为关键帧；未启用稀疏跟踪时总是返回 True。
+        """
+        if self.gate is None or self.tracker is None or self.gate.is_keyframe(frame):
+            return True
+        tracing.count("tracker_skipped_frames")
+        return False
 
+    @tracing.traced("tracker.update")
     def update(self, frame):
         """
         使用新帧更新跟踪器。
@@ -44,13 +246,81 @@ class Tracker:
         if self.tracker is None:
             return False, None
 
-        success, bbox = self.tracker.update(frame)
+        success, bbox = self.tracker.update(self._prepare(frame))
         
         if success:
-            # 转换回 (cx, cy, w, h) 格式
-            x_min, y_min, w, h = map(int, bbox)
+            # 映射回原始分辨率，并转换回 (cx, cy, w, h) 格式
+            x_min, y_min, w, h = (v / self._scale for v in bbox)
+            if self._roi is not None:
+                x_min += self._roi[0]
+                y_min += self._roi[1]
+            x_min, y_min, w, h = int(x_min), int(y_min), int(w), int(h)
             cx = x_min + w // 2
             cy = y_min + h // 2
+
+            # 目标靠近窗口边缘时，以当前位置为中心重新取窗口
+            if self._roi is not None and self._near_roi_edge(x_min, y_min, w, h, frame):
+                self._init_backend(frame, (cx, cy, w, h))
+            if self.gate is not None:
+                self.gate.reset(frame, (cx, cy, w, h))
             return True, (cx, cy, w, h)
         else:
-            return False, None
\ No newline at end of file
+            tracing.count("tracker_failures")
+            if self.gate is not None:
+                self.gate.clear()
+            return False, None
+
+    def _near_roi_edge(self, x_min, y_min, w, h, frame):
+        x0, y0, roi_w, roi_h = self._roi
+        frame_h, frame_w = frame.shape[:2]
+        pad_x, pad_y = w * self.roi_margin / 2, h * self.roi_margin / 2
+        # 窗口已贴住画面边缘的一侧不需要再移动
+        return ((x_min - x0 < pad_x and x0 > 0) or
+                (y_min - y0 < pad_y and y0 > 0) or
+                (x0 + roi_w - (x_min + w) < pad_x and x0 + roi_w < frame_w) or
+                (y0 + roi_h - (y_min + h) < pad_y and y0 + roi_h < frame_h))
+
+
+def add_tracker_arguments(parser):
+    """
+    注册跟踪器相关的命令行参数 (main_llm.py 与 run_all_videos.py 共用)。
+    """
+    parser.add_argument('--tracker_type', type=str, default='CSRT', choices=list(TRACKER_BACKENDS),
+                        help='跟踪器后端 (MOSSE/KCF 最快，CSRT 最慢但最稳)')
+    parser.add_argument('--tracker_model_dir', type=str, default='models', help='Nano/Vit 等 DNN 跟踪器的 ONNX 模型目录')
+    parser.add_argument('--track_scale_mode', type=str, default='none', choices=SCALE_MODES,
+                        help='跟踪输入: none 原始整帧; downscale 缩小后的整帧; roi 目标周围缩小后的窗口')
+    parser.add_argument('--track_target_size', type=int, default=96, help='downscale/roi 模式下缩放后目标长边的像素数')
+    parser.add_argument('--roi_margin', type=float, default=2.0, help='roi 模式下窗口在目标四周扩展的框尺寸倍数')
+    parser.add_argument('--track_max_skip', type=int, default=1,
+                        help='稀疏跟踪: 目标区域静止时最多连续跳过的帧数 (跳过的帧由前后关键帧插值)，1 表示每帧都跟踪')
+    parser.add_argument('--track_motion_threshold', type=float, default=0.02,
+                        help='稀疏跟踪: 自上一关键帧以来目标的累计位移超过框尺寸的该比例时立即跟踪')
+
+
+def tracker_arguments_to_argv(args):
+    """
+    把已解析的跟踪器参数还原为命令行参数列表，用于转发给子进程。
+    """
+    argv = ['--tracker_type', args.tracker_type,
+            '--tracker_model_dir', args.tracker_model_dir,
+            '--track_scale_mode', args.track_scale_mode,
+            '--track_target_size', str(args.track_target_size),
+            '--roi_margin', str(args.roi_margin)]
+    # 只在启用稀疏跟踪时附加，逐帧跟踪的运行哈希保持不变
+    if args.track_max_skip > 1:
+        argv += ['--track_max_skip', str(args.track_max_skip),
+                 '--track_motion_threshold', str(args.track_motion_threshold)]
+    return argv
+
+
+def tracker_factory_from_args(args):
+    """
+    返回一个无参调用即创建新 Tracker 的工厂函数。
+    """
+    def factory():
+        return Tracker(tracker_type=args.tracker_type, model_dir=args.tracker_model_dir,
+                       scale_mode=args.track_scale_mode, target_size=args.track_target_size,
+                       roi_margin=args.roi_margin, max_skip=args.track_max_skip,
+                       motion_threshold=args.track_motion_threshold)
+    return factory
@@ -2,50 +2,278 @@
 
 import cv2
 import json
+import os
+import queue
+import tempfile
+import threading
+import numpy as np
 
-def read_video_frames(video_path, start_frame, end_frame):
+from disk_cache import hash_key
+import tracing
+
+# 帧的颜色空间标签：OpenCV 解码得到 BGR，PIL/Grounding DINO 需要 RGB
+COLOR_BGR = "BGR"
+COLOR_RGB = "RGB"
+
+def convert_color(frame, src_space, dst_space):
     """
-    (旧功能，保持不变)
-    顺序读取从 start_frame 到 end_frame 的视频帧。
-    """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"错误: 无法打开视频文件 {video_path}")
-        return
-    
-    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-    current_frame = start_frame
-    
-    while current_frame <= end_frame:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        current_frame += 1
-        
-    cap.release()
+    仅在颜色空间不同时做一次转换，否则原样返回 (不复制)。
+    """
+    if src_space == dst_space:
+        return frame
+    if (src_space, dst_space) == (COLOR_BGR, COLOR_RGB):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if (src_space, dst_space) == (COLOR_RGB, COLOR_BGR):
+        return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    raise ValueError(f"不支持的颜色空间转换: {src_space} -> {dst_space}")
 
-def read_single_frame(video_path, frame_number):
+def empty_candidates():
     """
-    (新增功能)
-    直接读取指定编号的单帧画面。
+    没有任何候选框时的 (boxes, scores)。
     """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"错误: 无法打开视频文件 {video_path}")
+    return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+
+def best_box(candidates):
+    """
+    从检测候选 (boxes, scores) 中取后处理输出的第一个框，并转换为中心点格式 (cx, cy, w, h)；没有候选时返回 None。
+    """
+    boxes, _ = candidates
+    if len(boxes) == 0:
         return None
-    
-    # 直接跳转到指定帧
-    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-    ret, frame = cap.read()
-    cap.release()
+    xmin, ymin, xmax, ymax = boxes[0]
+    width = xmax - xmin
+    height = ymax - ymin
+    return (int(xmin + width / 2), int(ymin + height / 2), int(width), int(height))
 
-    if ret:
-        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    else:
-        print(f"警告: 无法读取视频 {video_path} 的第 {frame_number} 帧。")
+
+def redetect_window(frame_shape, bbox_hint, expand=2.0, max_fraction=0.6):
+    """
+    计算局部重检的裁剪窗口：提示框 (cx, cy, w, h) 四周各扩展 expand 倍框尺寸，并裁剪到帧内。
+
+    Returns:
+        (x0, y0, x1, y1)；窗口为空或已超过整帧面积的 max_fraction (此时应直接整帧检测) 时返回 None。
+    """
+    cx, cy, w, h = bbox_hint
+    frame_h, frame_w = frame_shape[:2]
+    half_w = int(w * (0.5 + expand)) + 8
+    half_h = int(h * (0.5 + expand)) + 8
+    x0, y0 = max(0, int(cx) - half_w), max(0, int(cy) - half_h)
+    x1, y1 = min(frame_w, int(cx) + half_w), min(frame_h, int(cy) + half_h)
+    if x1 <= x0 or y1 <= y0 or (x1 - x0) * (y1 - y0) >= max_fraction * frame_w * frame_h:
         return None
+    return x0, y0, x1, y1
+
+
+class VideoReader:
+    """
+    只打开一次、可随机访问的视频读取器，单帧读取与区间读取共用同一个句柄。
+
+    首次打开某个视频时，以不解码的方式扫描一遍数据包，建立关键帧索引并缓存到磁盘
+    (以文件路径、大小和修改时间为键)。跳转时先定位到目标帧之前最近的关键帧，再向前逐帧解码，
+    若目标就在当前位置之后且中间没有更近的关键帧，则直接向前解码而不重新定位。
+    无法建立索引时 (例如非 FFmpeg 后端) 退回到直接按帧号定位。
+
+    该对象不是线程安全的；交给 PrefetchingFrameReader 使用期间不要在其他线程中读取。
+    """
+    def __init__(self, video_path, index_cache_dir='.cache/keyframe_index'):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"错误: 无法打开视频文件 {video_path}")
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.keyframes = self._load_or_build_index(index_cache_dir)
+        self._next_frame = 0
+
+    def _build_index(self):
+        raw_cap = cv2.VideoCapture(self.video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        if not raw_cap.isOpened():
+            return None
+        keyframes = []
+        try:
+            frame_number = 0
+            while raw_cap.grab():
+                if raw_cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                    keyframes.append(frame_number)
+                frame_number += 1
+        finally:
+            raw_cap.release()
+        if not keyframes or keyframes[0] != 0:
+            return None
+        return np.asarray(keyframes, dtype=np.int64)
+
+    def _load_or_build_index(self, cache_dir):
+        st = os.stat(self.video_path)
+        key = hash_key(os.path.abspath(self.video_path), st.st_size, st.st_mtime_ns)
+        cache_path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+
+        if cache_path and os.path.exists(cache_path):
+            with np.load(cache_path) as data:
+                return data['keyframes']
+
+        keyframes = self._build_index()
+        if keyframes is not None and cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, keyframes=keyframes)
+            os.replace(tmp_path, cache_path)
+        return keyframes
+
+    def seek(self, frame_number):
+        """
+        定位到 frame_number，使下一次读取得到该帧。
+        """
+        if frame_number == self._next_frame:
+            return
+        if self.keyframes is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            self._next_frame = frame_number
+            return
+
+        keyframe = int(self.keyframes[max(np.searchsorted(self.keyframes, frame_number, side='right') - 1, 0)])
+        if not keyframe <= self._next_frame <= frame_number:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self._next_frame = keyframe
+        while self._next_frame < frame_number and self.cap.grab():
+            self._next_frame += 1
+
+    @tracing.traced("decode")
+    def read_frame(self, frame_number, buf=None):
+        """
+        读取指定编号的单帧 (BGR)，失败时返回 None。
+        """
+        self.seek(frame_number)
+        ret, frame = self.cap.read(buf)
+        if not ret:
+            return None
+        self._next_frame += 1
+        return frame
+
+    def iter_frames(self, start_frame, end_frame):
+        """
+        顺序读取 [start_frame, end_frame] 区间的帧 (BGR)。
+        """
+        self.seek(start_frame)
+        while self._next_frame <= end_frame:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self._next_frame += 1
+            yield frame
+
+    def close(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class PrefetchingFrameReader:
+    """
+    在后台线程中解码 [start_frame, end_frame] 区间的帧，与跟踪过程重叠执行。
+
+    帧直接解码进一组预分配、循环复用的缓冲区中，不做颜色转换，
+    颜色空间由 color_space 属性标明 (始终为 BGR)，由各个使用方按需转换一次。
+    迭代得到的帧在下一次迭代时会被回收复用，如需长期保存请自行复制。
+
+    video 可以是视频路径 (自行打开并在结束时释放)，也可以是已打开的 VideoReader
+    (复用其句柄和关键帧索引，结束后句柄仍归 VideoReader 所有)。
+    """
+    _END = object()
+
+    def __init__(self, video, start_frame, end_frame, queue_size=8):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.color_space = COLOR_BGR
+
+        if isinstance(video, VideoReader):
+            self.video_path = video.video_path
+            self._video = video
+            video.seek(start_frame)
+            self._cap = video.cap
+            width, height = video.width, video.height
+        else:
+            self.video_path = video
+            self._video = None
+            self._cap = cv2.VideoCapture(video)
+            if not self._cap.isOpened():
+                raise IOError(f"错误: 无法打开视频文件 {video}")
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # 解码线程最多领先 queue_size 帧，另有一个缓冲区留给当前正在使用的帧
+        self._free = queue.Queue()
+        for _ in range(queue_size + 1):
+            self._free.put(np.empty((height, width, 3), dtype=np.uint8))
+        self._ready = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self._thread.start()
+
+    def _decode_loop(self):
+        current_frame = self.start_frame
+        try:
+            while current_frame <= self.end_frame and not self._stop.is_set():
+                buf = self._free.get()
+                if self._stop.is_set():
+                    break
+                with tracing.span("decode"):
+                    ret, frame = self._cap.read(buf)
+                if not ret:
+                    break
+                # 尺寸不符时 OpenCV 会另行分配，此后就复用新分配的数组
+                self._ready.put(frame)
+                current_frame += 1
+            self._ready.put(self._END)
+        except Exception as e:
+            self._ready.put(e)
+        finally:
+            if self._video is not None:
+                self._video._next_frame = current_frame
+            else:
+                self._cap.release()
+
+    def __iter__(self):
+        held = None
+        try:
+            while True:
+                if held is not None:
+                    self._free.put(held)
+                    held = None
+                item = self._ready.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                held = item
+                yield item
+        finally:
+            # 迭代提前结束 (break/异常/被回收) 时通知解码线程退出
+            self._stop.set()
+            self._free.put(None)
+
+    def close(self):
+        """
+        提前停止后台解码线程并释放视频句柄。
+        """
+        self._stop.set()
+        self._free.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 
+@tracing.traced("save_results_to_json")
 def save_results_to_json(data, output_path):
     """
     (旧功能，保持不变)